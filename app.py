@@ -1,13 +1,14 @@
-import os
 import json
 import logging
-import redis
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, g, flash
+import time
+from datetime import datetime, timedelta
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, g, flash, stream_with_context
 from dotenv import load_dotenv
-from werkzeug.utils import secure_filename
 
 # Import extensions
-from extensions import db, migrate, oauth, socketio, make_celery
+from extensions import db, migrate, oauth, socketio, make_celery, get_redis
+# Imported up front: it registers Session listeners, which must not happen during a commit
+import generation
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,7 +17,12 @@ logger = logging.getLogger(__name__)
 # Load environment variables from .env file
 load_dotenv()
 
-def create_app():
+def create_app(web=True):
+    """
+    Builds the Flask app. Workers pass web=False and skip everything only
+    needed to serve requests: OAuth, sessions, Socket.IO, blueprints,
+    assets and routes.
+    """
     app = Flask(__name__)
 
     # App Configuration
@@ -25,21 +31,52 @@ def create_app():
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
-    oauth.init_app(app)
 
-    # Initialize Socket.IO with message queue from config
-    socketio.init_app(app, message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
+    # Bind the shared Celery app; tasks enqueued from here or run by workers use this app
+    make_celery(app)
+
+    # Register dashboard cache invalidation, which must run wherever rows are written
+    import dashboard as dashboard_cache  # noqa: F401
+
+    # Import models within app context
+    with app.app_context():
+        from models import User, Character, Conversation, Message
+
+    if not web:
+        return app
+
+    # The Auth0 client itself is registered on first login (auth.get_auth0)
+    oauth.init_app(app)
 
-    # Initialize Celery
-    celery = make_celery(app)
+    # Server-side sessions in Redis
+    from session_store import RedisSessionInterface, load_profile
+    app.session_interface = RedisSessionInterface(app.config['SESSION_KEY_PREFIX'])
 
-    # Redis client
-    redis_client = redis.from_url(app.config['REDIS_URL'])
+    # Initialize Socket.IO with message queue from config; the Redis queue lets
+    # several server processes share rooms and receive emits from workers
+    socketio.init_app(
+        app,
+        message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'],
+        channel=app.config['SOCKETIO_CHANNEL'],
+        async_mode=app.config['SOCKETIO_ASYNC_MODE'],
+    )
 
     # Register blueprints to avoid circular imports
     from auth import auth as auth_blueprint
     app.register_blueprint(auth_blueprint, url_prefix="/auth")
 
+    # Register Socket.IO event handlers
+    import sockets
+    sockets.init_app(app)
+
+    # Fingerprinted static assets with immutable caching, and compressed API responses
+    import assets
+    assets.init_app(app)
+
+    # Templates pick the processed avatar variant that fits
+    from avatars import avatar_url
+    app.jinja_env.globals['avatar_url'] = avatar_url
+
     # Allowed extensions for file uploads
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
@@ -47,16 +84,33 @@ def create_app():
     def allowed_file(filename):
         return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-    # Import models within app context
-    with app.app_context():
-        from models import User, Character, Conversation
-
-    # Load current user before each request
+    # Load current user before each request; the profile normally arrives with the session
     @app.before_request
     def load_current_user():
         g.current_user = None
-        if 'user' in session:
-            g.current_user = session['user']
+        user_id = session.get('user_id')
+        if user_id:
+            g.current_user = getattr(session, 'profile', None) or load_profile(
+                get_redis(), user_id, app.config['PROFILE_CACHE_TTL'])
+
+    # Correlation id and timing for every request
+    @app.before_request
+    def start_request_trace():
+        from tracing import CORRELATION_HEADER, new_correlation_id
+        g.correlation_id = new_correlation_id(request.headers.get(CORRELATION_HEADER))
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def finish_request_trace(response):
+        from tracing import CORRELATION_HEADER
+        if 'correlation_id' not in g:
+            return response
+        response.headers[CORRELATION_HEADER] = g.correlation_id
+        if request.endpoint not in (None, 'static', 'prometheus_metrics'):
+            import metrics
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - g.request_started,
+                            endpoint=request.endpoint, status=response.status_code)
+        return response
 
     # Home route
     @app.route('/')
@@ -69,8 +123,12 @@ def create_app():
         if not g.current_user:
             return redirect(url_for('auth.login'))
         user_id = g.current_user['sub']
-        characters = Character.query.filter_by(user_id=user_id).all()
-        return render_template('dashboard.html', characters=characters)
+
+        # The character list is rendered from a projection query and cached per user
+        from dashboard import cached_character_list, character_summaries
+        character_list = cached_character_list(user_id, lambda user_id: render_template(
+            '_character_list.html', characters=character_summaries(db.session, user_id)))
+        return render_template('dashboard.html', character_list=character_list)
 
     # Character creation route
     @app.route('/create_character', methods=['GET', 'POST'])
@@ -90,7 +148,16 @@ def create_app():
                 flash('Invalid attributes format.', 'danger')
                 return redirect(request.url)
 
+            # Optional generation settings; blank fields keep the defaults
+            model = request.form.get('model', '').strip()[:100] or None
+            temperature = request.form.get('temperature', type=float)
+            max_tokens = request.form.get('max_tokens', type=int)
+            if (temperature is not None and not 0 <= temperature <= 2) or (max_tokens is not None and max_tokens <= 0):
+                flash('Temperature must be between 0 and 2 and max tokens positive.', 'danger')
+                return redirect(request.url)
+
             # Handle avatar upload if 'custom' is selected
+            staged_avatar = None
             if avatar == 'custom':
                 if 'avatarUpload' not in request.files:
                     flash('No file part', 'danger')
@@ -100,10 +167,15 @@ def create_app():
                     flash('No selected file', 'danger')
                     return redirect(request.url)
                 if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    avatar_path = os.path.join(app.root_path, 'static', 'images', 'avatars', filename)
-                    file.save(avatar_path)
-                    avatar = filename
+                    # Staged under a random name; process_avatar_task validates and converts it
+                    from avatars import AvatarError, stage_upload
+                    try:
+                        staged_avatar = stage_upload(file, app.config['AVATAR_UPLOAD_DIR'],
+                                                     app.config['AVATAR_MAX_UPLOAD_BYTES'])
+                    except AvatarError as e:
+                        flash(str(e), 'danger')
+                        return redirect(request.url)
+                    avatar = 'avatar1.png'  # Shown until the processed variants are ready
                 else:
                     flash('Invalid file type. Allowed types: png, jpg, jpeg, gif.', 'danger')
                     return redirect(request.url)
@@ -115,10 +187,22 @@ def create_app():
                 description=description,
                 attributes=attributes,
                 avatar=avatar,
+                model=model,
+                temperature=temperature,
+                max_tokens=max_tokens,
                 user_id=g.current_user['sub']
             )
             db.session.add(new_character)
+            if staged_avatar:
+                db.session.flush()
+                from tasks import process_avatar_task
+                from unit_of_work import run_after_commit
+                character_id = new_character.id
+                run_after_commit(db.session, lambda: process_avatar_task.delay(character_id, staged_avatar))
             db.session.commit()
+            # Warm the prompt cache so the first chat message skips prompt assembly
+            from prompt_cache import cache_prompt
+            cache_prompt(new_character)
             flash('Character created successfully.', 'success')
             return redirect(url_for('dashboard'))
 
@@ -131,7 +215,11 @@ def create_app():
             return redirect(url_for('auth.login'))
 
         character = Character.query.filter_by(id=character_id, user_id=g.current_user['sub']).first_or_404()
-        return render_template('chat.html', character=character)
+        # Bring an archived history back before the page asks for it
+        from archive import rehydrate_for
+        rehydrate_for(db.session, g.current_user['sub'], character_id)
+        return render_template('chat.html', character=character,
+                               stream_transport=app.config['STREAM_TRANSPORT'])
 
     # API route to send message and get AI response
     @app.route('/api/send_message', methods=['POST'])
@@ -142,29 +230,91 @@ def create_app():
         data = request.get_json()
         character_id = data.get('character_id')
         user_message = data.get('message')
+        # Optional client-generated id so double-submits and retries are only processed once
+        client_message_id = data.get('client_message_id') or request.headers.get('Idempotency-Key')
 
         if not character_id or not user_message:
             return jsonify({'error': 'Character ID and message are required.'}), 400
 
+        # Per-user rate and concurrency limits, plus backpressure when queues are deep,
+        # checked before the idempotency claim and any database work
+        import scheduler
+        admission = scheduler.admit(g.current_user['sub'])
+        if not admission.allowed:
+            response = jsonify({'error': 'Too many requests. Please wait before sending another message.',
+                                'reason': admission.reason, 'retry_after': admission.retry_after})
+            response.headers['Retry-After'] = str(admission.retry_after)
+            return response, 429
+
+        if client_message_id:
+            from dedup import claim_request
+            if not claim_request(g.current_user['sub'], client_message_id, app.config['IDEMPOTENCY_TTL']):
+                scheduler.release_slot(g.current_user['sub'])
+                return jsonify({'message': 'Message already received', 'duplicate': True}), 200
+
+        def release_claim():
+            # Nothing was stored, so a retry with the same id must be processed
+            if client_message_id:
+                from dedup import release_request
+                release_request(g.current_user['sub'], client_message_id)
+
         character = Character.query.filter_by(id=character_id, user_id=g.current_user['sub']).first()
         if not character:
+            scheduler.release_slot(g.current_user['sub'])
+            release_claim()
             return jsonify({'error': 'Character not found'}), 404
 
-        conversation = Conversation.query.filter_by(character_id=character_id, user_id=g.current_user['sub']).first()
-        if not conversation:
-            conversation = Conversation(character_id=character_id, user_id=g.current_user['sub'], messages=[])
-            db.session.add(conversation)
-            db.session.commit()
+        try:
+            # The generation builds its context from the message history, so it must be hot
+            from archive import rehydrate_for
+            rehydrate_for(db.session, g.current_user['sub'], character_id)
 
-        # Append user message to conversation
-        conversation.add_message('user', user_message)
-        db.session.commit()
+            from unit_of_work import get_or_create_conversation
+            conversation = get_or_create_conversation(db.session, g.current_user['sub'], character_id)
 
-        # Enqueue background task for AI response
-        from tasks import generate_character_response_task
-        generate_character_response_task.delay(conversation.id, character_id, user_message, g.current_user['sub'])
+            # Append user message to conversation
+            message = conversation.add_message('user', user_message)
+
+            from tracing import trace_context
+            conversation_id = conversation.id
+            task_args = (conversation_id, character_id, user_message, g.current_user['sub'])
+            task_kwargs = {'message_seq': message.seq, 'trace': trace_context(g.correlation_id)}
+
+            # A new message supersedes the reply still streaming for the previous one
+            generation.cancel_generation(g.current_user['sub'], character_id)
+            db.session.commit()
+        except Exception:
+            # The task never ran, so it will not release the slot itself
+            scheduler.release_slot(g.current_user['sub'])
+            release_claim()
+            raise
+
+        # Enqueue background task for AI response now that the message is committed. Done
+        # here rather than via run_after_commit so a failure is reported to the client.
+        try:
+            scheduler.enqueue_generation(admission.queue, task_args, task_kwargs)
+        except Exception as e:
+            logger.error(f"Failed to enqueue generation for conversation {conversation_id}: {e}")
+            scheduler.release_slot(g.current_user['sub'])
+            release_claim()
+            return jsonify({'error': 'Your message was saved but no reply could be started. Please try again.'}), 503
+
+        return jsonify({'message': 'Message sent and processing in background',
+                        'conversation_id': conversation_id}), 200
+
+    # API route to stop the reply currently streaming for a character
+    @app.route('/api/cancel_generation', methods=['POST'])
+    def cancel_generation():
+        if not g.current_user:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        data = request.get_json(silent=True) or {}
+        character_id = data.get('character_id')
+        if not character_id:
+            return jsonify({'error': 'Character ID is required.'}), 400
 
-        return jsonify({'message': 'Message sent and processing in background'}), 200
+        message_id = generation.cancel_generation(g.current_user['sub'], character_id)
+        return jsonify({'cancelled': message_id is not None, 'message_id': message_id})
 
     # API route to get conversation messages
     @app.route('/api/get_conversation/<int:character_id>')
@@ -172,29 +322,168 @@ def create_app():
         if not g.current_user:
             return jsonify({'error': 'Authentication required'}), 401
 
-        page = request.args.get('page', 1, type=int)
-        per_page = 20  # Number of messages per page
+        # Keyset pagination: `before` is the seq of the oldest message the client has
+        before = request.args.get('before', type=int)
+        per_page = max(1, min(request.args.get('limit', 20, type=int), 100))  # Number of messages per page
 
         conversation = Conversation.query.filter_by(
             character_id=character_id,
             user_id=g.current_user['sub']
         ).order_by(Conversation.created_at.desc()).first()
 
-        if conversation and conversation.messages:
-            messages = conversation.messages
-            messages.reverse()
-            start = (page - 1) * per_page
-            end = start + per_page
-            page_messages = messages[start:end]
-            has_more = end < len(messages)
+        if conversation and conversation.archived_at is not None:
+            from archive import rehydrate
+            rehydrate(db.session, conversation.id)
+
+        if conversation and conversation.message_count:
+            # Fetch one extra row to know whether an older page exists
+            rows = conversation.recent_messages(per_page + 1, before=before)
+            page_messages = rows[:per_page]
+            has_more = len(rows) > per_page
             result = {
-                'messages': page_messages,
-                'has_more': has_more
+                'conversation_id': conversation.id,
+                'messages': [message.to_dict() for message in page_messages],
+                'has_more': has_more,
+                'next_cursor': page_messages[-1].seq if has_more else None
             }
             return jsonify(result)
         else:
             return jsonify({'messages': [], 'info': 'No conversation found for this character. Start chatting to begin!'})
 
+    # API route to catch up on a reply that is still streaming, e.g. after a reconnect
+    @app.route('/api/resume_generation/<int:character_id>')
+    def resume_generation(character_id):
+        if not g.current_user:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        offset = max(0, request.args.get('offset', 0, type=int))
+        conversation = Conversation.query.filter_by(
+            character_id=character_id,
+            user_id=g.current_user['sub']
+        ).first()
+        if not conversation:
+            return jsonify({'active': False})
+
+        from extensions import get_redis
+        from reply_buffer import current_generation, read_reply
+        client = get_redis()
+        message_id = request.args.get('message_id', type=int) or current_generation(client, conversation.id)
+        if message_id is None:
+            return jsonify({'active': False})
+
+        buffered = read_reply(client, message_id, offset)
+        if buffered is not None:
+            content, end, status = buffered
+            return jsonify({'active': status is None, 'message_id': message_id,
+                            'content': content, 'offset': end, 'status': status})
+
+        # The stream has expired; fall back to the last database checkpoint
+        message = Message.query.filter_by(id=message_id, conversation_id=conversation.id).first()
+        if not message:
+            return jsonify({'active': False})
+        # An incomplete row older than the buffer TTL was abandoned by a dead worker; the sweep finalizes it
+        abandoned = (not message.complete and message.created_at is not None and
+                     message.created_at < datetime.utcnow() - timedelta(seconds=app.config['REPLY_BUFFER_TTL']))
+        return jsonify({'active': not message.complete and not abandoned, 'message_id': message_id,
+                        'content': message.content[offset:], 'offset': max(offset, len(message.content)),
+                        'status': 'done' if message.complete else 'abandoned' if abandoned else None})
+
+    # API route streaming a conversation's replies as Server-Sent Events, resumable via Last-Event-ID
+    @app.route('/api/stream/<int:conversation_id>')
+    def stream_replies(conversation_id):
+        if not g.current_user:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        conversation = Conversation.query.filter_by(id=conversation_id, user_id=g.current_user['sub']).first()
+        if not conversation:
+            return jsonify({'error': 'Conversation not found'}), 404
+
+        from reply_buffer import follow_conversation, parse_event_id
+        # EventSource sends the header on reconnects; the query parameter covers a fresh page
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        message_id, entry_id = parse_event_id(last_event_id)
+        events = follow_conversation(
+            get_redis(), conversation_id, message_id, entry_id or '0',
+            block_ms=app.config['SSE_KEEPALIVE_SECONDS'] * 1000,
+            duration=app.config['SSE_MAX_DURATION'],
+        )
+
+        # No request or database state is needed while streaming, so the
+        # session is released before the first event is sent
+        def generate():
+            yield f"retry: {app.config['SSE_RETRY_MS']}\n\n"
+            for event in events:
+                if event is None:
+                    yield ': keepalive\n\n'
+                    continue
+                name, event_message_id, event_entry_id, data = event
+                if data is None:
+                    # Sets the browser's Last-Event-ID without dispatching an event
+                    yield f'id: {event_message_id}:{event_entry_id}\n\n'
+                    continue
+                data = json.dumps(dict(data, message_id=event_message_id))
+                if event_entry_id is None:
+                    yield f'event: {name}\ndata: {data}\n\n'
+                else:
+                    yield f'id: {event_message_id}:{event_entry_id}\nevent: {name}\ndata: {data}\n\n'
+
+        response = Response(generate(), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        # Stop nginx from buffering the stream
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    # API route to search the current user's messages and characters
+    @app.route('/api/search')
+    def search_conversations():
+        if not g.current_user:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        # Keyset pagination: `before` is the id of the last message on the previous page
+        before = request.args.get('before', type=int)
+        per_page = max(1, min(request.args.get('limit', 20, type=int), 50))
+
+        from search import search
+        return jsonify(search(db.session, g.current_user['sub'], request.args.get('q', ''),
+                              limit=per_page, before=before))
+
+    # API route to download the current user's characters and conversations as NDJSON
+    @app.route('/api/export')
+    def export_data():
+        if not g.current_user:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        from transfer import export_records, to_ndjson
+        records = export_records(db.session, user_id=g.current_user['sub'])
+        # Streamed straight from a server-side cursor; nothing is buffered
+        response = Response(stream_with_context(to_ndjson(records)), mimetype='application/x-ndjson')
+        response.headers['Content-Disposition'] = 'attachment; filename="matrixmingle-export.ndjson"'
+        return response
+
+    # API route to upload an NDJSON export into the current user's account
+    @app.route('/api/import', methods=['POST'])
+    def import_data():
+        if not g.current_user:
+            return jsonify({'error': 'Authentication required'}), 401
+
+        from transfer import TransferError, import_lines
+        try:
+            # The request body is read line by line rather than loaded whole
+            counts, errors = import_lines(db.session, request.stream, owner_id=g.current_user['sub'])
+        except TransferError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        return jsonify({'imported': counts, 'rejected': errors})
+
+    # Prometheus scrape endpoint, aggregated across web and worker processes via Redis
+    @app.route('/metrics')
+    def prometheus_metrics():
+        token = app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return jsonify({'error': 'Authentication required'}), 401
+        import metrics
+        return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
     # Error Handlers
     @app.errorhandler(404)
     def not_found_error(error):
@@ -0,0 +1,266 @@
+# archive.py
+
+"""
+Hot/cold tiering of conversations.
+
+archive_idle_conversations(), run periodically by Celery beat, takes
+conversations not updated for ARCHIVE_IDLE_DAYS and moves all but their
+newest ARCHIVE_KEEP_RECENT messages out of the messages table into a single
+compressed row in conversation_archives, then marks the conversation
+archived. The kept messages leave dashboard previews working unchanged.
+
+rehydrate() restores the archived messages with their original ids and
+sequence numbers and drops the archive row; the chat page, the
+conversation API and sending a message call it before reading history.
+Archived messages leave the full-text index with their rows, so their text
+is indexed again in archived_message_index (migration 9e2c4a7b1d58): a
+contentless FTS5 table on SQLite, a tsvector on PostgreSQL. Neither stores
+the text itself. search.py queries that index and reads only the archives
+holding its hits. Exports include archived messages.
+
+Archives are zstd-compressed when the zstandard package is installed and
+zlib-compressed otherwise; the codec is stored per row so either can be read.
+"""
+
+import json
+import logging
+import time
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import delete, insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from models import Conversation, ConversationArchive, Message
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MESSAGE_FIELDS = ('id', 'seq', 'role', 'content', 'complete', 'created_at')
+
+try:
+    import zstandard
+except ImportError:
+    # zstandard is optional; zlib is always available
+    zstandard = None
+
+
+def compress(data, level):
+    """
+    Returns (codec, compressed bytes), preferring zstd.
+    """
+    if zstandard is not None:
+        return 'zstd', zstandard.ZstdCompressor(level=level).compress(data)
+    return 'zlib', zlib.compress(data, min(level, 9))
+
+
+def decompress(codec, data):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read zstd archives')
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f'Unknown archive codec: {codec}')
+
+
+def _encode_messages(rows):
+    messages = []
+    for row in rows:
+        message = dict(row._mapping)
+        if message['created_at'] is not None:
+            message['created_at'] = message['created_at'].isoformat()
+        messages.append(message)
+    return json.dumps(messages, separators=(',', ':')).encode('utf-8')
+
+
+def read_archive(codec, data):
+    """
+    Returns archived messages as dicts, created_at still as ISO strings.
+    """
+    return json.loads(decompress(codec, data))
+
+
+def index_messages(executor, dialect_name, conversation_id, messages):
+    """
+    Adds archived messages, mappings with 'id' and 'content', to the archived
+    message search index. executor is a session or connection.
+    """
+    rows = [{'id': message['id'], 'conversation_id': conversation_id, 'content': message['content']}
+            for message in messages]
+    if not rows:
+        return
+    if dialect_name == 'sqlite':
+        executor.execute(text("INSERT INTO archived_message_index (message_id, conversation_id) "
+                              "VALUES (:id, :conversation_id)"), rows)
+        executor.execute(text("INSERT INTO archived_messages_fts (rowid, content) VALUES (:id, :content)"), rows)
+    elif dialect_name == 'postgresql':
+        executor.execute(text("INSERT INTO archived_message_index (message_id, conversation_id, terms) "
+                              "VALUES (:id, :conversation_id, to_tsvector('english', :content))"), rows)
+
+
+def unindex_messages(executor, dialect_name, conversation_id, messages):
+    """
+    Removes a conversation's archived messages from the search index.
+    """
+    if dialect_name == 'sqlite':
+        # A contentless FTS5 row can only be deleted by repeating the text it was indexed with
+        rows = [{'id': message['id'], 'content': message['content']} for message in messages]
+        if rows:
+            executor.execute(text("INSERT INTO archived_messages_fts (archived_messages_fts, rowid, content) "
+                                  "VALUES ('delete', :id, :content)"), rows)
+    if dialect_name in ('sqlite', 'postgresql'):
+        executor.execute(text("DELETE FROM archived_message_index WHERE conversation_id = :conversation_id"),
+                         {'conversation_id': conversation_id})
+
+
+def archive_conversation(session, conversation_id, idle_before, keep_recent=1, level=10):
+    """
+    Archives one conversation if it is still idle, committing on success.
+    Returns the number of bytes saved, or None when it was skipped.
+    """
+    # Lock the row so a concurrent append waits for the archive to commit
+    conversation = session.execute(
+        select(Conversation).where(Conversation.id == conversation_id).with_for_update()
+        .execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+    if (conversation is None or conversation.archived_at is not None
+            or conversation.updated_at is None or conversation.updated_at >= idle_before):
+        session.rollback()
+        return None
+
+    cutoff = conversation.message_count - keep_recent
+    rows = session.execute(
+        select(*(getattr(Message, field) for field in MESSAGE_FIELDS))
+        .where(Message.conversation_id == conversation_id, Message.seq < cutoff)
+        .order_by(Message.seq)
+    ).all()
+    # Never archive a reply that is still streaming or was left unfinished
+    if not rows or not all(row.complete for row in rows):
+        session.rollback()
+        return None
+
+    raw = _encode_messages(rows)
+    codec, stored = compress(raw, level)
+    session.add(ConversationArchive(
+        conversation_id=conversation_id, codec=codec, message_count=len(rows),
+        raw_bytes=len(raw), stored_bytes=len(stored), data=stored,
+    ))
+    index_messages(session, session.get_bind().dialect.name, conversation_id, [row._mapping for row in rows])
+    session.execute(delete(Message).where(Message.conversation_id == conversation_id, Message.seq < cutoff))
+    # Core update so archiving does not bump updated_at
+    session.execute(update(Conversation).where(Conversation.id == conversation_id)
+                    .values(archived_at=datetime.utcnow(), updated_at=conversation.updated_at))
+    session.commit()
+
+    metrics.incr('archive_conversations_total', result='archived')
+    metrics.incr('archive_messages_total', len(rows))
+    metrics.incr('archive_raw_bytes_total', len(raw))
+    metrics.incr('archive_stored_bytes_total', len(stored))
+    metrics.incr('archive_bytes_saved_total', len(raw) - len(stored))
+    return len(raw) - len(stored)
+
+
+def archive_idle_conversations(session, idle_days, batch_size=100, keep_recent=1, level=10):
+    """
+    Archives up to batch_size conversations idle for idle_days, oldest first.
+    Returns (conversations archived, bytes saved).
+    """
+    idle_before = datetime.utcnow() - timedelta(days=idle_days)
+    conversation_ids = session.execute(
+        select(Conversation.id)
+        .where(Conversation.archived_at.is_(None), Conversation.updated_at < idle_before,
+               Conversation.message_count > keep_recent)
+        .order_by(Conversation.updated_at)
+        .limit(batch_size)
+    ).scalars().all()
+    session.rollback()
+
+    archived = saved = 0
+    for conversation_id in conversation_ids:
+        try:
+            result = archive_conversation(session, conversation_id, idle_before, keep_recent, level)
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Failed to archive conversation {conversation_id}: {e}")
+            metrics.incr('archive_conversations_total', result='error')
+            continue
+        if result is not None:
+            archived += 1
+            saved += result
+    logger.info(f"Archived {archived} idle conversations, saving {saved} bytes")
+    return archived, saved
+
+
+def rehydrate(session, conversation_id):
+    """
+    Moves an archived conversation's messages back into the messages table,
+    committing. Returns True if this call restored them; False when the
+    conversation was not archived or a concurrent request got there first.
+    """
+    started = time.perf_counter()
+    archived_at = session.execute(
+        select(Conversation.archived_at).where(Conversation.id == conversation_id).with_for_update()
+    ).scalar_one_or_none()
+    archive = session.execute(
+        select(ConversationArchive.codec, ConversationArchive.data)
+        .where(ConversationArchive.conversation_id == conversation_id)
+    ).first() if archived_at is not None else None
+    if archive is None:
+        session.rollback()
+        return False
+
+    messages = read_archive(archive.codec, archive.data)
+    for message in messages:
+        message['conversation_id'] = conversation_id
+        if message['created_at'] is not None:
+            message['created_at'] = datetime.fromisoformat(message['created_at'])
+    try:
+        # Original ids keep search rows and buffered reply references valid
+        session.execute(insert(Message), messages)
+        unindex_messages(session, session.get_bind().dialect.name, conversation_id, messages)
+        session.execute(delete(ConversationArchive).where(ConversationArchive.conversation_id == conversation_id))
+        session.execute(update(Conversation).where(Conversation.id == conversation_id)
+                        .values(archived_at=None))
+        session.commit()
+    except IntegrityError:
+        # Restored by a concurrent request between our read and insert
+        session.rollback()
+        return False
+
+    elapsed = time.perf_counter() - started
+    metrics.observe('archive_rehydrate_seconds', elapsed)
+    metrics.incr('archive_rehydrations_total')
+    logger.info(f"Rehydrated {len(messages)} messages for conversation {conversation_id} in {elapsed:.3f}s")
+    return True
+
+
+def rehydrate_for(session, user_id, character_id):
+    """
+    Rehydrates the (user, character) conversation if it is archived. One
+    indexed lookup when it is not.
+    """
+    row = session.execute(
+        select(Conversation.id, Conversation.archived_at)
+        .where(Conversation.user_id == user_id, Conversation.character_id == character_id)
+    ).first()
+    if row is not None and row.archived_at is not None:
+        return rehydrate(session, row.id)
+    return False
+
+
+def archived_messages(session, user_id=None):
+    """
+    Yields archived messages as export-shaped dicts, for transfer.export_records.
+    """
+    query = (select(ConversationArchive.conversation_id, ConversationArchive.codec, ConversationArchive.data)
+             .join(Conversation, Conversation.id == ConversationArchive.conversation_id)
+             .order_by(ConversationArchive.conversation_id))
+    if user_id is not None:
+        query = query.where(Conversation.user_id == user_id)
+    # One archive at a time; each is a single conversation's history
+    for row in session.execute(query.execution_options(yield_per=1)):
+        for message in read_archive(row.codec, row.data):
+            yield {'conversation_id': row.conversation_id, 'seq': message['seq'], 'role': message['role'],
+                   'content': message['content'], 'complete': message['complete'],
+                   'created_at': message['created_at']}
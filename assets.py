@@ -0,0 +1,199 @@
+# assets.py
+
+"""
+Static asset fingerprinting and response compression.
+
+`python run.py build-assets` copies every file under static/ to a name
+containing a hash of its content (css/custom.css -> css/custom.1a2b3c4d5e6f.css),
+writes .gz and, when the brotli package is installed, .br siblings next
+to each copy, and records the mapping in static/manifest.json. The
+asset_url() template helper resolves names through that manifest.
+Fingerprinted files and processed avatars never change under the same
+name, so they are served with an immutable one-year Cache-Control and
+their precompressed siblings are used when the client accepts them.
+
+Without a build, asset_url() falls back to the plain file with a ?v=
+content hash, which still gets long-lived caching.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+from flask import current_app, request, send_from_directory, url_for
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Files already compressed gain nothing from gzip or brotli
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.json', '.txt', '.html', '.map'}
+COMPRESSIBLE_MIMETYPES = {'application/json', 'application/x-ndjson', 'text/plain', 'text/html'}
+# Built assets look like name.<12 hex chars>.ext
+_FINGERPRINT = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+IMMUTABLE_PREFIXES = ('images/avatars/processed/',)
+
+try:
+    import brotli
+except ImportError:
+    # brotli is optional; gzip is always available
+    brotli = None
+
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _fingerprinted_name(filename, digest):
+    root, ext = os.path.splitext(filename)
+    return f'{root}.{digest}{ext}'
+
+
+def _write_compressed(path, data):
+    with open(f'{path}.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(f'{path}.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build_assets(static_folder):
+    """
+    Writes fingerprinted and precompressed copies of every static file and
+    the manifest mapping original names to them. Returns the manifest.
+    """
+    manifest = {}
+    for root, _, files in os.walk(static_folder):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            if (filename == MANIFEST_NAME or filename.startswith(IMMUTABLE_PREFIXES)
+                    or _FINGERPRINT.search(filename) or name.endswith(('.gz', '.br'))):
+                continue
+
+            with open(path, 'rb') as f:
+                data = f.read()
+            built = _fingerprinted_name(filename, hashlib.sha256(data).hexdigest()[:12])
+            built_path = os.path.join(static_folder, built)
+            if not os.path.exists(built_path):
+                with open(built_path, 'wb') as f:
+                    f.write(data)
+                if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+                    _write_compressed(built_path, data)
+            manifest[filename] = built
+
+    with open(os.path.join(static_folder, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    logger.info(f"Built {len(manifest)} static assets")
+    return manifest
+
+
+def load_manifest(app):
+    path = os.path.join(app.static_folder, MANIFEST_NAME)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logger.warning(f"Ignoring unreadable asset manifest {path}: {e}")
+        return {}
+
+
+def asset_url(filename):
+    """
+    URL for a static file that changes whenever its content does.
+    """
+    state = current_app.extensions['assets']
+    built = state['manifest'].get(filename)
+    if built is not None:
+        return url_for('static', filename=built)
+    # Unbuilt trees: cache-bust with the content hash, computed once per process
+    digest = state['hashes'].get(filename)
+    if digest is None:
+        digest = _file_hash(os.path.join(current_app.static_folder, filename))
+        state['hashes'][filename] = digest
+    return url_for('static', filename=filename, v=digest)
+
+
+def _is_immutable(filename):
+    return (bool(_FINGERPRINT.search(filename)) or filename.startswith(IMMUTABLE_PREFIXES)
+            or 'v' in request.args)
+
+
+def _accepted_encodings():
+    header = request.headers.get('Accept-Encoding', '')
+    return {part.split(';')[0].strip().lower() for part in header.split(',') if part.strip()}
+
+
+def send_static(filename):
+    """
+    Replacement for Flask's static view: immutable caching for content-named
+    files and their precompressed variants when the client accepts them.
+    """
+    static_folder = current_app.static_folder
+    if not _is_immutable(filename):
+        return send_from_directory(static_folder, filename)
+
+    accepted = _accepted_encodings()
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in accepted and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+            response = send_from_directory(static_folder, filename + suffix, mimetype=mimetype,
+                                           max_age=31536000)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(static_folder, filename, max_age=31536000)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def compress_response(response):
+    """
+    after_request hook gzip-compressing (or brotli when available) JSON
+    and text API responses above COMPRESS_MIN_BYTES.
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    config = current_app.config
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_BYTES']:
+        return response
+
+    accepted = _accepted_encodings()
+    if brotli is not None and 'br' in accepted:
+        compressed = brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+        encoding = 'br'
+    elif 'gzip' in accepted:
+        compressed = gzip.compress(data, compresslevel=config['COMPRESS_LEVEL'])
+        encoding = 'gzip'
+    else:
+        return response
+
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    """
+    Registers asset_url(), the caching static view and response compression.
+    """
+    app.extensions['assets'] = {'manifest': load_manifest(app), 'hashes': {}}
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.view_functions['static'] = send_static
+    app.after_request(compress_response)
@@ -0,0 +1,129 @@
+# async_worker.py
+
+"""
+asyncio generation worker, an alternative to running generate_character_response_task
+on the prefork Celery pool.
+
+Jobs carry the same arguments as the Celery task and are pushed by
+scheduler.enqueue_generation onto Redis lists on the broker when
+GENERATION_ENGINE = 'async'. One process streams up to
+ASYNC_WORKER_CONCURRENCY replies at once over a shared httpx pool; the
+database phases of each generation run on a thread pool sized to the
+database connection pool.
+
+    python async_worker.py
+"""
+
+import asyncio
+import json
+import logging
+import signal
+from concurrent.futures import ThreadPoolExecutor
+import redis.asyncio as aioredis
+
+from generation import Generation
+from openrouter_api import agenerate_character_response
+from openrouter_client import AsyncOpenRouterClient
+from scheduler import ASYNC_QUEUE_PREFIX, QUEUE_DEFAULT, QUEUE_HIGH, QUEUE_LOW
+from tracing import span
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Polled in priority order by BLPOP
+ASYNC_QUEUES = [f'{ASYNC_QUEUE_PREFIX}{queue}' for queue in (QUEUE_HIGH, QUEUE_DEFAULT, QUEUE_LOW)]
+
+
+async def run_job(app, client, job):
+    """
+    Drives one Generation: database phases in threads, streaming on the event loop.
+    """
+    with app.app_context():
+        generation = await asyncio.to_thread(Generation, *job['args'], **job['kwargs'])
+        stream = None
+        try:
+            if not await asyncio.to_thread(generation.prepare):
+                return
+
+            stream = agenerate_character_response(client, generation.messages, model=generation.model,
+                                                  models=generation.models, hedge_delay=generation.hedge_delay,
+                                                  **generation.params)
+            with span('openrouter.stream', generation.correlation_id,
+                      conversation_id=generation.conversation_id) as stream_span:
+                async for token in stream:
+                    # Flushes (PUBLISH, XADD) and cancel checks (EXISTS) block on Redis, so
+                    # they run in a thread; other tokens are only buffered, on the loop
+                    if generation.io_due(token):
+                        keep_going = await asyncio.to_thread(generation.on_token, token)
+                    else:
+                        keep_going = generation.on_token(token, io=False)
+                    if not keep_going:
+                        break
+                    if generation.checkpoint_due():
+                        await asyncio.to_thread(generation.checkpoint)
+                stream_span['tokens'] = generation.token_count
+
+            await asyncio.to_thread(generation.finish)
+
+        except Exception as e:
+            await asyncio.to_thread(generation.fail, e)
+        finally:
+            # Close the upstream HTTP stream right away when we stopped early
+            if stream is not None:
+                await stream.aclose()
+            await asyncio.to_thread(generation.close)
+
+
+async def consume(app, concurrency=None):
+    """
+    Pulls jobs until SIGINT/SIGTERM, then waits for in-flight streams to finish.
+    """
+    config = app.config
+    concurrency = concurrency or config['ASYNC_WORKER_CONCURRENCY']
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(
+        max_workers=config['DB_POOL_SIZE'] + config['DB_MAX_OVERFLOW'],
+        thread_name_prefix='generation-db',
+    ))
+
+    stopping = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    broker = aioredis.from_url(config['REDIS_URL'])
+    client = AsyncOpenRouterClient.from_config(config)
+    semaphore = asyncio.Semaphore(concurrency)
+    running = set()
+    logger.info(f"Async generation worker started (concurrency {concurrency})")
+
+    async def guarded(job):
+        try:
+            await run_job(app, client, job)
+        except Exception as e:
+            logger.error(f"Async generation job failed: {e}")
+        finally:
+            semaphore.release()
+
+    try:
+        while not stopping.is_set():
+            await semaphore.acquire()
+            item = await broker.blpop(ASYNC_QUEUES, timeout=1)
+            if item is None:
+                semaphore.release()
+                continue
+            task = asyncio.create_task(guarded(json.loads(item[1])))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    finally:
+        logger.info(f"Stopping; waiting for {len(running)} in-flight generations")
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+        await client.aclose()
+        await broker.aclose()
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(consume(create_app(web=False)))
@@ -1,7 +1,8 @@
 import os
-from flask import Blueprint, session, redirect, url_for, g, jsonify
-from extensions import db, oauth
+from flask import Blueprint, current_app, session, redirect, url_for, g, jsonify
+from extensions import db, oauth, get_redis
 from models import User
+from session_store import cache_profile, slim_profile
 import logging
 from dotenv import load_dotenv
 
@@ -14,53 +15,70 @@ auth = Blueprint('auth', __name__)
 logging.basicConfig(level=logging.DEBUG)  # Enable debug logging
 logger = logging.getLogger(__name__)
 
-# Auth0 Configuration using oauth.register with correct parameter
-auth0 = oauth.register(
-    'auth0',
-    client_id=os.getenv('AUTH0_CLIENT_ID'),
-    client_secret=os.getenv('AUTH0_CLIENT_SECRET'),
-    api_base_url=f'https://{os.getenv("AUTH0_DOMAIN")}',
-    access_token_url=f'https://{os.getenv("AUTH0_DOMAIN")}/oauth/token',
-    authorize_url=f'https://{os.getenv("AUTH0_DOMAIN")}/authorize',
-    client_kwargs={
-        'scope': 'openid profile email',
-    },
-    # Correct parameter is 'server_metadata_url', not 'client_metadata_url'
-    server_metadata_url=f'https://{os.getenv("AUTH0_DOMAIN")}/.well-known/openid-configuration'
-)
+def get_auth0():
+    """
+    Returns the Auth0 client, registering it on first use so that importing
+    this module (and starting a process) does no OAuth setup.
+    """
+    client = oauth.create_client('auth0')
+    if client is None:
+        domain = os.getenv("AUTH0_DOMAIN")
+        # Auth0 Configuration using oauth.register with correct parameter
+        client = oauth.register(
+            'auth0',
+            client_id=os.getenv('AUTH0_CLIENT_ID'),
+            client_secret=os.getenv('AUTH0_CLIENT_SECRET'),
+            api_base_url=f'https://{domain}',
+            access_token_url=f'https://{domain}/oauth/token',
+            authorize_url=f'https://{domain}/authorize',
+            client_kwargs={
+                'scope': 'openid profile email',
+            },
+            # Correct parameter is 'server_metadata_url', not 'client_metadata_url'
+            server_metadata_url=f'https://{domain}/.well-known/openid-configuration'
+        )
+    return client
 
 @auth.route('/login')
 def login():
     logger.debug("Initiating login process")
     redirect_uri = 'https://matrixmingle.com/auth/callback'
     logger.debug(f"Redirect URI: {redirect_uri}")
-    return auth0.authorize_redirect(redirect_uri=redirect_uri)
+    return get_auth0().authorize_redirect(redirect_uri=redirect_uri)
 
 @auth.route('/register')
 def register():
     logger.debug("Initiating registration process")
     redirect_uri = 'https://matrixmingle.com/auth/callback'
     logger.debug(f"Redirect URI: {redirect_uri}")
-    return auth0.authorize_redirect(redirect_uri=redirect_uri, screen_hint='signup')
+    return get_auth0().authorize_redirect(redirect_uri=redirect_uri, screen_hint='signup')
 
 @auth.route('/callback')
 def callback():
     logger.debug("Handling callback from Auth0")
+    auth0 = get_auth0()
     token = auth0.authorize_access_token()
     logger.debug(f"Access token received: {token}")
     userinfo = auth0.get('userinfo').json()
     logger.debug(f"User info received: {userinfo}")
-    session['user'] = userinfo
+    # Only the user id goes into the session; the profile is stored and cached separately
+    profile = slim_profile(userinfo)
+    session.clear()
+    session['user_id'] = userinfo['sub']
 
     # Add user to the database if not already present
     user = User.query.filter_by(id=userinfo['sub']).first()
     if not user:
-        user = User(id=userinfo['sub'])
+        user = User(id=userinfo['sub'], profile=profile)
         db.session.add(user)
         db.session.commit()
         logger.info(f"New user added: {userinfo['sub']}")
     else:
         logger.debug(f"User already exists: {userinfo['sub']}")
+        if user.profile != profile:
+            user.profile = profile
+            db.session.commit()
+    cache_profile(get_redis(), profile, current_app.config['PROFILE_CACHE_TTL'])
 
     return redirect(url_for('dashboard'))
 
@@ -0,0 +1,128 @@
+# avatars.py
+
+"""
+Avatar upload processing.
+
+Uploads are staged under a random name in the request and handed to
+tasks.process_avatar_task, which validates the image and writes square
+WebP variants named by a hash of their content into
+static/images/avatars/processed/. A name therefore always refers to the
+same bytes and can be cached indefinitely; identical uploads share files
+and different uploads never overwrite each other.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import uuid
+from flask import url_for
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Square edge lengths in pixels; the largest doubles as Character.avatar
+AVATAR_SIZES = (64, 128, 256)
+PROCESSED_DIR = 'processed'
+ALLOWED_FORMATS = {'PNG', 'JPEG', 'GIF', 'WEBP'}
+# Refuse decompression bombs before decoding any pixels
+MAX_PIXELS = 40_000_000
+WEBP_QUALITY = 80
+CHUNK_SIZE = 64 * 1024
+
+
+class AvatarError(ValueError):
+    pass
+
+
+def stage_upload(file_storage, upload_dir, max_bytes):
+    """
+    Copies an uploaded file to upload_dir under a random name and returns
+    its path. Raises AvatarError when the upload exceeds max_bytes.
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    path = os.path.join(upload_dir, uuid.uuid4().hex)
+    written = 0
+    with open(path, 'wb') as f:
+        while True:
+            chunk = file_storage.stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            written += len(chunk)
+            if written > max_bytes:
+                f.close()
+                os.remove(path)
+                raise AvatarError(f"Avatar is larger than {max_bytes // (1024 * 1024)} MB")
+            f.write(chunk)
+    return path
+
+
+def render_variants(source_path, sizes=AVATAR_SIZES):
+    """
+    Decodes an image and returns {size: WebP bytes}, cropped to a centred
+    square. Raises AvatarError for anything that is not a supported image.
+    """
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(source_path) as image:
+            if image.format not in ALLOWED_FORMATS:
+                raise AvatarError(f"Unsupported image format {image.format}")
+            if image.width * image.height > MAX_PIXELS:
+                raise AvatarError(f"Image is too large ({image.width}x{image.height})")
+            # Animated images keep their first frame
+            image.seek(0)
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+            image.load()
+    except (OSError, Image.DecompressionBombError) as e:
+        raise AvatarError(f"Invalid image: {e}")
+
+    variants = {}
+    for size in sizes:
+        thumbnail = ImageOps.fit(image, (size, size), method=Image.LANCZOS)
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+        variants[size] = buffer.getvalue()
+    return variants
+
+
+def store_variants(variants, avatars_dir):
+    """
+    Writes variants under content-hash names and returns {size: filename}
+    relative to avatars_dir, with string keys as stored in JSON.
+    """
+    target_dir = os.path.join(avatars_dir, PROCESSED_DIR)
+    os.makedirs(target_dir, exist_ok=True)
+    stored = {}
+    for size, data in variants.items():
+        name = f'{hashlib.sha256(data).hexdigest()[:32]}.webp'
+        path = os.path.join(target_dir, name)
+        if not os.path.exists(path):
+            # Write then rename so a concurrent reader never sees a partial file
+            temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        stored[str(size)] = f'{PROCESSED_DIR}/{name}'
+    return stored
+
+
+def process_avatar(source_path, avatars_dir):
+    """
+    Validates and converts a staged upload; returns the variant map.
+    """
+    return store_variants(render_variants(source_path), avatars_dir)
+
+
+def avatar_url(avatar, variants=None, size=None):
+    """
+    URL of the smallest variant at least size pixels wide, falling back to
+    the largest variant and then to the original avatar file.
+    """
+    filename = avatar
+    if variants:
+        available = sorted(int(key) for key in variants)
+        wanted = available[-1] if size is None else next((s for s in available if s >= size), available[-1])
+        filename = variants[str(wanted)]
+    return url_for('static', filename=f'images/avatars/{filename}')
@@ -0,0 +1,161 @@
+# bench/engine_bench.py
+
+"""
+Compares the cost of holding many OpenRouter streams open under the two
+generation engines, against a local fake OpenRouter server:
+
+    # N streams multiplexed on one event loop (async_worker)
+    python -m bench.engine_bench --engine async --streams 500
+
+    # one process per stream, as with a prefork Celery pool of concurrency N
+    python -m bench.engine_bench --engine prefork --streams 50
+
+Only the upstream streaming is measured; database and Socket.IO work is the
+same for both engines. Reports CPU seconds per stream, the number of
+concurrent streams one fully used core could sustain, and peak resident
+memory (summed over children for prefork). Results are written as JSON.
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+MESSAGES = [{'role': 'user', 'content': 'Hello there.'}]
+MODEL = 'bench-model'
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Fake OpenRouter did not start on port {port}')
+
+
+def _maxrss_bytes(usage):
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+
+def run_async(url, streams, pool_size):
+    from openrouter_client import AsyncOpenRouterClient
+
+    async def one(client):
+        tokens = 0
+        async for _ in client.stream_chat(MESSAGES, MODEL):
+            tokens += 1
+        return tokens
+
+    async def main():
+        client = AsyncOpenRouterClient(api_key='bench', api_url=url, pool_size=pool_size)
+        try:
+            return await asyncio.gather(*(one(client) for _ in range(streams)))
+        finally:
+            await client.aclose()
+
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    tokens = asyncio.run(main())
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return elapsed, cpu, _maxrss_bytes(after), sum(tokens)
+
+
+def _prefork_child(url, results):
+    from openrouter_client import OpenRouterClient
+
+    client = OpenRouterClient(api_key='bench', api_url=url, pool_size=1)
+    tokens = sum(1 for _ in client.stream_chat(MESSAGES, MODEL))
+    client.close()
+    results.put((tokens, _maxrss_bytes(resource.getrusage(resource.RUSAGE_SELF))))
+
+
+def run_prefork(url, streams):
+    # Fork so children start from this interpreter's memory, as prefork workers do
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    children = [context.Process(target=_prefork_child, args=(url, results)) for _ in range(streams)]
+    for child in children:
+        child.start()
+    collected = [results.get() for _ in children]
+    for child in children:
+        child.join()
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return elapsed, cpu, sum(rss for _, rss in collected), sum(tokens for tokens, _ in collected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare stream density of the generation engines.')
+    parser.add_argument('--engine', choices=['async', 'prefork'], default='async')
+    parser.add_argument('--streams', type=int, default=200)
+    parser.add_argument('--tokens', type=int, default=200)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--first-token-delay', type=float, default=0.2)
+    parser.add_argument('--pool-size', type=int, default=None, help='async connection pool (default: --streams)')
+    parser.add_argument('--output', default='bench_results_engine.json')
+    args = parser.parse_args()
+
+    # The fake server runs in its own process so its CPU is not counted
+    port = _free_port()
+    server = subprocess.Popen([
+        sys.executable, 'fake_openrouter.py', '--port', str(port), '--tokens', str(args.tokens),
+        '--delay', str(args.token_delay), '--first-token-delay', str(args.first_token_delay),
+    ], stdout=subprocess.DEVNULL)
+    try:
+        _wait_for_port(port)
+        url = f'http://127.0.0.1:{port}/api/v1/chat/completions'
+        if args.engine == 'async':
+            elapsed, cpu, rss, tokens = run_async(url, args.streams, args.pool_size or args.streams)
+        else:
+            elapsed, cpu, rss, tokens = run_prefork(url, args.streams)
+    finally:
+        server.terminate()
+        server.wait()
+
+    stream_seconds = args.first_token_delay + args.tokens * args.token_delay
+    cpu_per_stream = cpu / args.streams
+    results = {
+        'config': {
+            'engine': args.engine,
+            'streams': args.streams,
+            'tokens_per_stream': args.tokens,
+            'token_delay': args.token_delay,
+            'cpu_count': os.cpu_count(),
+        },
+        'elapsed_seconds': elapsed,
+        'tokens_received': tokens,
+        'cpu_seconds': cpu,
+        'cpu_seconds_per_stream': cpu_per_stream,
+        # Concurrent streams of this length one core could keep open
+        'streams_per_core': stream_seconds / cpu_per_stream if cpu_per_stream else None,
+        'peak_rss_bytes': rss,
+        'rss_bytes_per_stream': rss / args.streams,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,322 @@
+# bench/pipeline_bench.py
+
+"""
+Load and latency benchmark for the send_message -> task -> Socket.IO pipeline.
+
+Runs against a local fake OpenRouter SSE server and a throwaway SQLite
+database (or DATABASE_URL), with Redis as broker and message queue:
+
+    # everything in one process, tasks executed eagerly in the request thread
+    python -m bench.pipeline_bench --users 20 --messages 5 --output results.json
+
+    # against a real Celery worker started with the printed environment
+    python -m bench.pipeline_bench --mode worker --port 8089 ...
+
+The app is served on a local port with Socket.IO's Redis message queue, so
+worker emits reach clients exactly as in production. Each simulated user
+posts messages over HTTP and listens with a python-socketio client joined to
+its chat room. Results are written as JSON and can be compared with an
+earlier run via --compare. In worker mode db_writes only covers statements
+issued by the web side.
+"""
+
+import argparse
+import json
+import os
+import queue
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'p50': pick(0.50),
+        'p95': pick(0.95),
+        'p99': pick(0.99),
+        'max': ordered[-1],
+    }
+
+
+class WriteCounter:
+    """
+    Counts INSERT/UPDATE/DELETE statements issued through an engine.
+    """
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.counts = {'INSERT': 0, 'UPDATE': 0, 'DELETE': 0}
+        self._lock = threading.Lock()
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        verb = statement.lstrip().split(' ', 1)[0].upper()
+        if verb in self.counts:
+            with self._lock:
+                self.counts[verb] += 1
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def session_cookie(app, user_id):
+    """
+    Returns a Cookie header value for a signed-in session of user_id.
+    """
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = user_id
+    name = app.config['SESSION_COOKIE_NAME']
+    return f'{name}={client.get_cookie(name).value}'
+
+
+def run_user(app, base_url, user_id, character_id, messages, timeout):
+    """
+    Sends messages one after another and records per-message timings.
+    """
+    import requests
+    import socketio as socketio_client
+
+    samples = []
+    cookie = session_cookie(app, user_id)
+    http = requests.Session()
+    http.headers['Cookie'] = cookie
+
+    events = queue.Queue()
+    socket_client = socketio_client.Client()
+    for name in ('partial_ai_response', 'ai_response_complete', 'error'):
+        socket_client.on(name, lambda payload, name=name: events.put((name, payload, time.perf_counter())))
+    socket_client.connect(base_url, headers={'Cookie': cookie}, wait_timeout=timeout)
+    joined = socket_client.call('join', {'character_id': character_id}, timeout=timeout)
+    if not (joined or {}).get('ok'):
+        raise RuntimeError(f"{user_id} could not join its chat room: {joined}")
+
+    for i in range(messages):
+        start = time.perf_counter()
+        response_holder = {}
+
+        def post():
+            response_holder['response'] = http.post(f'{base_url}/api/send_message', json={
+                'character_id': character_id,
+                'message': f'benchmark message {i} from {user_id}',
+                'client_message_id': str(uuid.uuid4()),
+            }, timeout=timeout)
+            response_holder['enqueued'] = time.perf_counter()
+
+        # In eager mode the request only returns once the reply is complete,
+        # so it runs in its own thread while this one watches the socket.
+        sender = threading.Thread(target=post)
+        sender.start()
+
+        first_token = None
+        completed = None
+        chunks = 0
+        chars = 0
+        deadline = start + timeout
+        while completed is None:
+            try:
+                name, payload, now = events.get(timeout=max(0.0, deadline - time.perf_counter()))
+            except queue.Empty:
+                break
+            if name == 'partial_ai_response':
+                first_token = first_token or now
+                chunks += 1
+                chars += len(payload.get('chunk', payload.get('token', '')))
+            elif name == 'ai_response_complete':
+                first_token = first_token or now
+                completed = now
+                chars = chars or len(payload['content'])
+            else:
+                completed = now
+        sender.join()
+
+        samples.append({
+            'status': response_holder['response'].status_code,
+            'enqueue': response_holder['enqueued'] - start,
+            'ttft': (first_token - start) if first_token else None,
+            'total': (completed - start) if completed else None,
+            'chunks': chunks,
+            'chars': chars,
+        })
+
+    socket_client.disconnect()
+    http.close()
+    return samples
+
+
+def summarize(samples, writes, elapsed, args):
+    completed = [s for s in samples if s['total'] is not None]
+    streaming = [s for s in completed if s['total'] and s['ttft'] is not None and s['total'] > s['ttft']]
+    return {
+        'config': {
+            'mode': args.mode,
+            'users': args.users,
+            'messages_per_user': args.messages,
+            'tokens_per_reply': args.tokens,
+            'token_delay': args.token_delay,
+            'database': os.environ.get('DATABASE_URL'),
+        },
+        'git_commit': _git_commit(),
+        'elapsed_seconds': elapsed,
+        'messages_sent': len(samples),
+        'messages_completed': len(completed),
+        'errors': sum(1 for s in samples if s['status'] != 200),
+        'enqueue_latency': percentiles([s['enqueue'] for s in samples]),
+        'time_to_first_token': percentiles([s['ttft'] for s in completed if s['ttft'] is not None]),
+        'total_latency': percentiles([s['total'] for s in completed]),
+        'delivered_chars_per_second': percentiles([
+            s['chars'] / (s['total'] - s['ttft']) for s in streaming
+        ]),
+        'socket_events_per_reply': percentiles([s['chunks'] for s in completed]),
+        'db_writes': writes.counts,
+        'db_writes_per_message': writes.total / len(samples) if samples else 0,
+        'throughput_replies_per_second': len(completed) / elapsed if elapsed else 0,
+    }
+
+
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    rows = []
+    for metric in ('enqueue_latency', 'time_to_first_token', 'total_latency'):
+        for stat in ('p50', 'p95'):
+            old = baseline.get(metric, {}).get(stat)
+            new = current.get(metric, {}).get(stat)
+            if old and new:
+                rows.append(f'{metric}.{stat}: {old * 1000:.1f}ms -> {new * 1000:.1f}ms ({(new - old) / old:+.1%})')
+    for metric in ('db_writes_per_message', 'throughput_replies_per_second'):
+        old, new = baseline.get(metric), current.get(metric)
+        if old and new:
+            rows.append(f'{metric}: {old:.2f} -> {new:.2f} ({(new - old) / old:+.1%})')
+    return rows
+
+
+def _wait_for_port(port, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the send_message streaming pipeline.')
+    parser.add_argument('--mode', choices=['eager', 'worker'], default='eager')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=5)
+    parser.add_argument('--tokens', type=int, default=200)
+    parser.add_argument('--token-delay', type=float, default=0.005)
+    parser.add_argument('--first-token-delay', type=float, default=0.1)
+    parser.add_argument('--port', type=int, default=0, help='fake OpenRouter port (fixed port for worker mode)')
+    parser.add_argument('--web-port', type=int, default=0, help='port the app is served on (default: any free port)')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    from fake_openrouter import FakeOpenRouterServer
+
+    server = FakeOpenRouterServer(port=args.port, tokens=args.tokens, delay=args.token_delay,
+                                  first_token_delay=args.first_token_delay).start()
+
+    # Configuration is read from the environment when config.Config is imported
+    os.environ['OPENROUTER_API_URL'] = server.url
+    os.environ.setdefault('OPENROUTER_API_KEY', 'bench')
+    # The app is served from a thread below, so Socket.IO must not pick eventlet or gevent
+    os.environ.setdefault('SOCKETIO_ASYNC_MODE', 'threading')
+    if 'DATABASE_URL' not in os.environ:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='mm-bench-'), 'bench.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+
+    if args.mode == 'worker':
+        print('Start a worker with:')
+        print(f"  OPENROUTER_API_URL={server.url} DATABASE_URL={os.environ['DATABASE_URL']} "
+              f"celery -A celery_worker worker --loglevel=warning")
+
+    from app import create_app
+    from extensions import db, socketio
+    from models import User, Character
+
+    app = create_app()
+    if args.mode == 'eager':
+        from tasks import generate_character_response_task
+        generate_character_response_task.app.conf.task_always_eager = True
+
+    with app.app_context():
+        db.create_all()
+        pairs = []
+        for n in range(args.users):
+            user_id = f'bench|{uuid.uuid4().hex[:12]}'
+            db.session.add(User(id=user_id))
+            character = Character(name=f'Bench {n}', description='A benchmark character.',
+                                  attributes={'mood': 'patient'}, avatar='avatar1.png', user_id=user_id)
+            db.session.add(character)
+            db.session.flush()
+            pairs.append((user_id, character.id))
+        db.session.commit()
+        writes = WriteCounter(db.engine)
+
+    # A real server rather than the Socket.IO test client: that client cannot be used with
+    # the message queue, and emits from tasks only ever arrive through the queue
+    web_port = args.web_port or free_port()
+    threading.Thread(target=socketio.run, args=(app,), daemon=True,
+                     kwargs={'host': '127.0.0.1', 'port': web_port, 'use_reloader': False,
+                             'log_output': False, 'allow_unsafe_werkzeug': True}).start()
+    base_url = f'http://127.0.0.1:{web_port}'
+    _wait_for_port(web_port, args.timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        futures = [pool.submit(run_user, app, base_url, user_id, character_id, args.messages, args.timeout)
+                   for user_id, character_id in pairs]
+        samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    results = summarize(samples, writes, elapsed, args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+    if args.compare:
+        print('\nCompared with', args.compare)
+        for row in compare(results, args.compare):
+            print(' ', row)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,157 @@
+# bench/search_bench.py
+
+"""
+Latency benchmark for /api/search's queries on a large synthetic corpus.
+
+Builds a throwaway SQLite database (or uses DATABASE_URL) through the
+migrations, so the real full-text indexes and triggers are in place,
+loads it with generated messages spread over many users and then times
+search queries for random users and terms:
+
+    python -m bench.search_bench --messages 1000000 --output search.json
+
+Loading a million messages also exercises the index-maintaining triggers;
+its rate is reported as insert_messages_per_second. Pass --reuse to query
+a database loaded by an earlier run.
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+
+from bench.pipeline_bench import percentiles, _git_commit
+
+WORDS = ('dragon castle river lantern whisper garden storm harbor violin mirror forest '
+         'ember crystal meadow compass thunder orchard velvet shadow beacon falcon '
+         'marble canyon ribbon glacier anchor willow saffron quartz tide').split()
+# Per-message filler drawn from a larger vocabulary so common and rare terms both exist
+FILLER = [f'w{n}' for n in range(5000)]
+
+
+def make_content(rng):
+    words = rng.choices(FILLER, k=rng.randint(8, 40))
+    words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return ' '.join(words)
+
+
+def load_corpus(session, rng, users, conversations_per_user, messages, batch_size):
+    from sqlalchemy import insert
+    from models import User, Character, Conversation, Message
+
+    session.execute(insert(User), [{'id': f'bench|{n}'} for n in range(users)])
+    conversation_ids = []
+    for n in range(users):
+        for c in range(conversations_per_user):
+            character = Character(name=f'{rng.choice(WORDS).title()} {n}-{c}', description=make_content(rng),
+                                  attributes={}, avatar='avatar1.png', user_id=f'bench|{n}')
+            session.add(character)
+            session.flush()
+            conversation = Conversation(user_id=f'bench|{n}', character_id=character.id)
+            session.add(conversation)
+            session.flush()
+            conversation_ids.append(conversation.id)
+    session.commit()
+
+    per_conversation = max(1, messages // len(conversation_ids))
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    batch = []
+    inserted = 0
+    for conversation_id in conversation_ids:
+        for seq in range(per_conversation):
+            batch.append({'conversation_id': conversation_id, 'seq': seq, 'role': 'user' if seq % 2 == 0 else 'ai',
+                          'content': make_content(rng), 'complete': True, 'created_at': now})
+            if len(batch) >= batch_size:
+                session.execute(insert(Message), batch)
+                session.commit()
+                inserted += len(batch)
+                batch = []
+        session.execute(
+            Conversation.__table__.update()
+            .where(Conversation.id == conversation_id)
+            .values(message_count=per_conversation)
+        )
+    if batch:
+        session.execute(insert(Message), batch)
+        inserted += len(batch)
+    session.commit()
+    return inserted, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark full-text search latency.')
+    parser.add_argument('--messages', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--conversations-per-user', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reuse', action='store_true', help='query an already loaded DATABASE_URL')
+    parser.add_argument('--output', default='bench_results_search.json')
+    args = parser.parse_args()
+
+    if 'DATABASE_URL' not in os.environ:
+        db_path = os.path.join(tempfile.mkdtemp(prefix='mm-search-'), 'search.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+
+    from flask_migrate import upgrade
+    from app import create_app
+    from extensions import db
+    from search import get_backend, search
+
+    app = create_app()
+    rng = random.Random(args.seed)
+    results = {
+        'config': {
+            'messages': args.messages,
+            'users': args.users,
+            'conversations_per_user': args.conversations_per_user,
+            'queries': args.queries,
+            'limit': args.limit,
+            'database': os.environ['DATABASE_URL'],
+        },
+        'git_commit': _git_commit(),
+    }
+
+    with app.app_context():
+        if not args.reuse:
+            upgrade()
+            inserted, elapsed = load_corpus(db.session, rng, args.users, args.conversations_per_user,
+                                            args.messages, args.batch_size)
+            results['messages_loaded'] = inserted
+            results['insert_messages_per_second'] = inserted / elapsed if elapsed else None
+        results['backend'] = type(get_backend(db.session)).__name__
+
+        first_page, next_page, hits = [], [], []
+        for _ in range(args.queries):
+            user_id = f'bench|{rng.randrange(args.users)}'
+            query = rng.choice(WORDS)
+            if rng.random() < 0.3:
+                query = f'{query} {rng.choice(FILLER)}'
+
+            start = time.perf_counter()
+            page = search(db.session, user_id, query, limit=args.limit)
+            first_page.append(time.perf_counter() - start)
+            hits.append(len(page['messages']))
+
+            if page['next_cursor'] is not None:
+                start = time.perf_counter()
+                search(db.session, user_id, query, limit=args.limit, before=page['next_cursor'])
+                next_page.append(time.perf_counter() - start)
+            db.session.rollback()
+
+    results['first_page_latency'] = percentiles(first_page)
+    results['next_page_latency'] = percentiles(next_page)
+    results['results_per_page'] = percentiles(hits)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# bench/startup_bench.py
+
+"""
+Measures how long a fresh process takes to become ready, as an autoscaled
+worker or web process would from a cold interpreter:
+
+    python -m bench.startup_bench --target worker --runs 20
+    python -m bench.startup_bench --target web --runs 20
+
+Each run starts a new interpreter that imports the entry point's modules and
+builds the app the same way the entry point does, and reports the wall time
+from process launch to ready. One extra run with -X importtime lists the
+slowest imports. Nothing connects to Redis, the database or Auth0 during
+startup, so neither needs to be running. Results are written as JSON.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from bench.pipeline_bench import _git_commit, percentiles
+
+# Each snippet does what the entry point does at startup, then prints the wall clock
+TARGETS = {
+    # celery_worker builds the app on import; the worker then imports the task modules
+    'worker': 'import celery_worker, tasks, time; print(time.time())',
+    'async-worker': 'import async_worker, time; from app import create_app; create_app(web=False); print(time.time())',
+    # run.py builds the web app on import
+    'web': 'import run, time; print(time.time())',
+}
+
+
+def run_once(code, env):
+    """
+    Returns (seconds until the child reported ready, seconds until it exited).
+    """
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-c', code], env=env, text=True)
+    exited = time.time() - start
+    return float(output.strip().splitlines()[-1]) - start, exited
+
+
+def slowest_imports(code, env, top):
+    """
+    Parses -X importtime output into the top imports by cumulative time.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env,
+                            capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    return [{'module': name, 'cumulative_ms': cumulative / 1000, 'self_ms': self_time / 1000}
+            for cumulative, self_time, name in rows[:top]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold process startup time.')
+    parser.add_argument('--target', choices=sorted(TARGETS), default='worker')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--top', type=int, default=15, help='slowest imports to report')
+    parser.add_argument('--output', default='bench_results_startup.json')
+    args = parser.parse_args()
+
+    code = TARGETS[args.target]
+    env = dict(os.environ)
+    # Warm the bytecode and OS file caches once, as a deployed image would have them
+    run_once(code, env)
+
+    ready, exited = [], []
+    for _ in range(args.runs):
+        ready_seconds, exit_seconds = run_once(code, env)
+        ready.append(ready_seconds)
+        exited.append(exit_seconds)
+
+    results = {
+        'config': {
+            'target': args.target,
+            'runs': args.runs,
+            'python': sys.version.split()[0],
+            'git_commit': _git_commit(),
+        },
+        # Process launch to app ready, the figure autoscaling cares about
+        'ready_seconds': percentiles(ready),
+        # Process launch to exit, including interpreter teardown
+        'exit_seconds': percentiles(exited),
+        'slowest_imports': slowest_imports(code, env, args.top),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,39 @@
 # celery_worker.py
 
+import subprocess
+import sys
+
 from app import create_app
-from extensions import make_celery
+from extensions import celery
+from scheduler import GENERATION_QUEUES, QUEUE_MAINTENANCE
+
+# Workers only need the config, database and task context, not the web stack
+app = create_app(web=False)
+
+# Generation queues are drained in strict priority order, so maintenance tasks
+# (summaries, avatars, sweeps, archiving) run on a worker of their own and are
+# never starved by a steady stream of generations
+WORKERS = {
+    'generation': ['-Q', ','.join(GENERATION_QUEUES), '-n', 'generation@%h'],
+    'maintenance': ['-Q', QUEUE_MAINTENANCE, '-n', 'maintenance@%h',
+                    '--concurrency', str(app.config['MAINTENANCE_WORKER_CONCURRENCY'])],
+}
+
+
+def run_worker(role):
+    celery.worker_main(['worker', '--loglevel=info', *WORKERS[role]])
 
-app = create_app()
-celery = make_celery(app)
 
 if __name__ == '__main__':
-    celery.worker_main(['worker', '--loglevel=info'])
\ No newline at end of file
+    # `python celery_worker.py generation|maintenance` runs one worker, e.g. to scale
+    # them separately; with no argument the maintenance worker runs alongside
+    role = sys.argv[1] if len(sys.argv) > 1 else None
+    if role is not None:
+        run_worker(role)
+    else:
+        maintenance = subprocess.Popen([sys.executable, __file__, 'maintenance'])
+        try:
+            run_worker('generation')
+        finally:
+            maintenance.terminate()
+            maintenance.wait()
@@ -13,7 +13,111 @@ class Config:
     REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6380/0')
     CELERY_BROKER_URL = REDIS_URL
     CELERY_RESULT_BACKEND = REDIS_URL
-    SESSION_TYPE = 'filesystem'
+    # Sessions live in Redis (session_store.py); the cookie only holds a signed id
+    SESSION_KEY_PREFIX = os.environ.get('SESSION_KEY_PREFIX', 'session:')
+    SESSION_COOKIE_SAMESITE = 'Lax'
+    PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 24 * 60 * 60))
+
+    # OpenRouter client
+    OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY')
+    OPENROUTER_API_URL = os.environ.get('OPENROUTER_API_URL', 'https://openrouter.ai/api/v1/chat/completions')
+    OPENROUTER_CONNECT_TIMEOUT = float(os.environ.get('OPENROUTER_CONNECT_TIMEOUT', 5))
+    OPENROUTER_READ_TIMEOUT = float(os.environ.get('OPENROUTER_READ_TIMEOUT', 60))
+    OPENROUTER_MAX_RETRIES = int(os.environ.get('OPENROUTER_MAX_RETRIES', 3))
+    OPENROUTER_RETRY_BACKOFF = float(os.environ.get('OPENROUTER_RETRY_BACKOFF', 0.5))
+    OPENROUTER_POOL_SIZE = int(os.environ.get('OPENROUTER_POOL_SIZE', 10))
+    OPENROUTER_ASYNC_POOL_SIZE = int(os.environ.get('OPENROUTER_ASYNC_POOL_SIZE', 100))
+
+    # Conversation context sent with each message
+    CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 3000))
+    CONTEXT_KEEP_RECENT = int(os.environ.get('CONTEXT_KEEP_RECENT', 20))
+    SUMMARY_TRIGGER_MESSAGES = int(os.environ.get('SUMMARY_TRIGGER_MESSAGES', 20))
+    SUMMARY_BATCH_MESSAGES = int(os.environ.get('SUMMARY_BATCH_MESSAGES', 100))
+    SUMMARY_MODEL = os.environ.get('SUMMARY_MODEL', 'openai/gpt-3.5-turbo')
+    SUMMARY_MAX_TOKENS = int(os.environ.get('SUMMARY_MAX_TOKENS', 400))
+
+    # Model routing: a character's model is tried first, then these fallbacks (comma-separated)
+    ROUTER_FALLBACK_MODELS = [m.strip() for m in os.environ.get('ROUTER_FALLBACK_MODELS', '').split(',') if m.strip()]
+    # Fail over when a model has produced no token after this many seconds
+    ROUTER_TTFT_TIMEOUT = float(os.environ.get('ROUTER_TTFT_TIMEOUT', 4.0))
+    # Per-model health is judged over this window, once it holds enough attempts
+    ROUTER_STATS_WINDOW = int(os.environ.get('ROUTER_STATS_WINDOW', 300))
+    ROUTER_MIN_SAMPLES = int(os.environ.get('ROUTER_MIN_SAMPLES', 10))
+    ROUTER_MAX_ERROR_RATE = float(os.environ.get('ROUTER_MAX_ERROR_RATE', 0.2))
+    # Users whose replies race a second model after ROUTER_HEDGE_DELAY seconds (comma-separated ids)
+    ROUTER_HEDGE_USER_IDS = frozenset(u.strip() for u in os.environ.get('ROUTER_HEDGE_USER_IDS', '').split(',') if u.strip())
+    ROUTER_HEDGE_DELAY = float(os.environ.get('ROUTER_HEDGE_DELAY', 1.0))
+
+    # Duplicate suppression and response caching for generations
+    GENERATION_TEMPERATURE = float(os.environ['GENERATION_TEMPERATURE']) if os.environ.get('GENERATION_TEMPERATURE') else None
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 300))
+    GENERATION_DEDUP_TTL = int(os.environ.get('GENERATION_DEDUP_TTL', 600))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 86400))
+
+    # 'celery' runs generations on the prefork Celery pool, 'async' on async_worker
+    GENERATION_ENGINE = os.environ.get('GENERATION_ENGINE', 'celery')
+    ASYNC_WORKER_CONCURRENCY = int(os.environ.get('ASYNC_WORKER_CONCURRENCY', 200))
+
+    # Generation scheduling: per-user limits and queue backpressure
+    GENERATION_MAX_INFLIGHT_PER_USER = int(os.environ.get('GENERATION_MAX_INFLIGHT_PER_USER', 2))
+    GENERATION_INFLIGHT_TTL = int(os.environ.get('GENERATION_INFLIGHT_TTL', 600))
+    RATE_LIMIT_CAPACITY = int(os.environ.get('RATE_LIMIT_CAPACITY', 10))
+    RATE_LIMIT_REFILL_PER_SECOND = float(os.environ.get('RATE_LIMIT_REFILL_PER_SECOND', 0.5))
+    GENERATION_QUEUE_MAX_DEPTH = int(os.environ.get('GENERATION_QUEUE_MAX_DEPTH', 500))
+    BACKPRESSURE_RETRY_AFTER = int(os.environ.get('BACKPRESSURE_RETRY_AFTER', 5))
+    # Processes of the worker consuming the maintenance queue (see celery_worker.py)
+    MAINTENANCE_WORKER_CONCURRENCY = int(os.environ.get('MAINTENANCE_WORKER_CONCURRENCY', 2))
+
+    # Uploaded avatars wait here until process_avatar_task converts them; must be shared with workers
+    AVATAR_UPLOAD_DIR = os.environ.get('AVATAR_UPLOAD_DIR', os.path.join(os.path.dirname(__file__), 'uploads', 'avatars'))
+    AVATAR_MAX_UPLOAD_BYTES = int(os.environ.get('AVATAR_MAX_UPLOAD_BYTES', 10 * 1024 * 1024))
+
+    # Conversations idle this long have all but their newest messages archived, compressed,
+    # by a Celery beat job every ARCHIVE_INTERVAL_SECONDS; see archive.py
+    ARCHIVE_IDLE_DAYS = int(os.environ.get('ARCHIVE_IDLE_DAYS', 30))
+    ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', 3600))
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 200))
+    ARCHIVE_KEEP_RECENT = int(os.environ.get('ARCHIVE_KEEP_RECENT', 1))
+    ARCHIVE_ZSTD_LEVEL = int(os.environ.get('ARCHIVE_ZSTD_LEVEL', 10))
+
+    # Rendered dashboard character lists are cached per user for this many seconds
+    DASHBOARD_CACHE_TTL = int(os.environ.get('DASHBOARD_CACHE_TTL', 300))
+
+    # JSON and text responses at least this large are gzip/brotli compressed
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 6))
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+
+    # Optional bearer token required to scrape /metrics
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Database connection pool used by Celery worker processes
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
 
     # Add SOCKETIO_MESSAGE_QUEUE configuration
-    SOCKETIO_MESSAGE_QUEUE = REDIS_URL
\ No newline at end of file
+    SOCKETIO_MESSAGE_QUEUE = REDIS_URL
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'flask-socketio')
+    # eventlet or gevent in production; None lets Flask-SocketIO pick what is installed
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE')
+
+    # Streamed tokens are coalesced and flushed every interval or once this many bytes are buffered
+    SOCKETIO_FLUSH_INTERVAL_MS = int(os.environ.get('SOCKETIO_FLUSH_INTERVAL_MS', 40))
+    SOCKETIO_FLUSH_BYTES = int(os.environ.get('SOCKETIO_FLUSH_BYTES', 512))
+
+    # Streamed replies are mirrored to a Redis Stream for resume and checkpointed to the database
+    REPLY_BUFFER_TTL = int(os.environ.get('REPLY_BUFFER_TTL', 3600))
+    REPLY_CHECKPOINT_INTERVAL = float(os.environ.get('REPLY_CHECKPOINT_INTERVAL', 2.0))
+    # Replies still incomplete after REPLY_BUFFER_TTL were abandoned by a dead worker and are finalized
+    REPLY_SWEEP_INTERVAL_SECONDS = int(os.environ.get('REPLY_SWEEP_INTERVAL_SECONDS', 600))
+
+    # /api/stream/<conversation_id> serves replies as Server-Sent Events straight from the reply buffer.
+    # Connections close after SSE_MAX_DURATION seconds and the browser reconnects with Last-Event-ID.
+    SSE_KEEPALIVE_SECONDS = int(os.environ.get('SSE_KEEPALIVE_SECONDS', 15))
+    SSE_MAX_DURATION = int(os.environ.get('SSE_MAX_DURATION', 300))
+    SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', 1000))
+    # 'socketio' or 'sse': how chat.js receives streamed replies
+    STREAM_TRANSPORT = os.environ.get('STREAM_TRANSPORT', 'socketio')
\ No newline at end of file
@@ -0,0 +1,113 @@
+# context_builder.py
+
+import logging
+from models import Message
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Tokens added per chat message for role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+# Rows fetched per keyset page while walking back through the history
+PAGE_SIZE = 50
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding('cl100k_base')
+except Exception:
+    # tiktoken is optional; fall back to the ~4 characters per token heuristic
+    _encoding = None
+
+
+def estimate_tokens(text):
+    """
+    Estimates the number of tokens in text using a local tokenizer.
+    """
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def to_chat_role(role):
+    # Replies are stored as 'ai' but the chat completions API expects 'assistant'
+    return 'assistant' if role == 'ai' else role
+
+
+def build_history(session, conversation, user_message, budget, message_seq=None):
+    """
+    Returns the earlier turns to send with user_message, oldest first, fitting
+    within budget tokens. Turns already folded into the conversation's rolling
+    summary are replaced by that summary; the newest turns are kept verbatim.
+    message_seq is the triggering message's sequence number; only turns
+    before it are used. Jobs queued without one skip the newest user turn
+    with the same content instead.
+    """
+    history = []
+    if conversation.summary:
+        summary_message = {
+            'role': 'system',
+            'content': f"Summary of the earlier conversation: {conversation.summary}"
+        }
+        budget -= estimate_tokens(summary_message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+    before = message_seq
+    skipped_current = message_seq is not None
+    while budget > 0:
+        query = session.query(Message).filter(
+            Message.conversation_id == conversation.id,
+            Message.seq >= conversation.summary_seq
+        )
+        if before is not None:
+            query = query.filter(Message.seq < before)
+        page = query.order_by(Message.seq.desc()).limit(PAGE_SIZE).all()
+        if not page:
+            break
+
+        for message in page:
+            # Replies still being streamed (including this task's own) are not context
+            if not message.complete:
+                continue
+            # Without message_seq: the triggering user message is already persisted; it is sent separately
+            if not skipped_current and message.role == 'user' and message.content == user_message:
+                skipped_current = True
+                continue
+            skipped_current = True
+            cost = estimate_tokens(message.content) + MESSAGE_OVERHEAD_TOKENS
+            if cost > budget:
+                budget = 0
+                break
+            budget -= cost
+            history.append({'role': to_chat_role(message.role), 'content': message.content})
+
+        before = page[-1].seq
+
+    history.reverse()
+    if conversation.summary:
+        history.insert(0, summary_message)
+    return history
+
+
+def needs_summary(conversation, keep_recent, trigger):
+    """
+    Returns True once enough turns have accumulated outside the recent window.
+    """
+    return conversation.message_count - keep_recent - conversation.summary_seq >= trigger
+
+
+def summarization_prompt(previous_summary, messages):
+    """
+    Builds the chat messages asking the model to fold messages into the running summary.
+    """
+    transcript = '\n'.join(f"{to_chat_role(m.role)}: {m.content}" for m in messages)
+    instructions = (
+        "Update the running summary of a roleplay conversation. Keep names, facts, "
+        "relationships, promises and unresolved threads; drop small talk. "
+        "Reply with the updated summary only."
+    )
+    content = f"Current summary:\n{previous_summary or '(none)'}\n\nNew turns:\n{transcript}"
+    return [
+        {'role': 'system', 'content': instructions},
+        {'role': 'user', 'content': content},
+    ]
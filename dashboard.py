@@ -0,0 +1,123 @@
+# dashboard.py
+
+import logging
+import redis
+from flask import current_app
+from sqlalchemy import and_, event, func, select
+from sqlalchemy.orm import Session
+
+from extensions import get_redis
+from models import Character, Conversation, Message
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'dashboard:'
+DESCRIPTION_PREVIEW_CHARS = 200
+MESSAGE_PREVIEW_CHARS = 120
+
+
+def _version_key(user_id):
+    return f'{KEY_PREFIX}version:{user_id}'
+
+
+def _fragment_key(user_id, version):
+    return f'{KEY_PREFIX}fragment:{user_id}:{version}'
+
+
+def character_summaries(session, user_id):
+    """
+    Returns the list-view fields for a user's characters in one query: a
+    description preview, the conversation's message count and a preview of
+    its last message, instead of full rows plus a query per character.
+    """
+    last_message = Message.__table__.alias('last_message')
+    query = (
+        select(
+            Character.id,
+            Character.name,
+            Character.avatar,
+            Character.avatar_variants,
+            func.substr(Character.description, 1, DESCRIPTION_PREVIEW_CHARS).label('description'),
+            func.coalesce(Conversation.message_count, 0).label('message_count'),
+            func.substr(last_message.c.content, 1, MESSAGE_PREVIEW_CHARS).label('last_message'),
+            last_message.c.role.label('last_message_role'),
+            last_message.c.created_at.label('last_message_at'),
+        )
+        .outerjoin(Conversation, and_(Conversation.character_id == Character.id,
+                                      Conversation.user_id == user_id))
+        # The newest message is the one at seq message_count - 1, found by the (conversation_id, seq) key
+        .outerjoin(last_message, and_(last_message.c.conversation_id == Conversation.id,
+                                      last_message.c.seq == Conversation.message_count - 1))
+        .where(Character.user_id == user_id)
+        .order_by(Character.id)
+    )
+    return session.execute(query).mappings().all()
+
+
+def cached_character_list(user_id, render):
+    """
+    Returns the dashboard's character list HTML for a user, calling
+    render(user_id) only on a cache miss. Entries are keyed by a per-user
+    version that invalidate() bumps, so a render racing a commit is stored
+    under the old version and never served.
+    """
+    ttl = current_app.config['DASHBOARD_CACHE_TTL']
+    client = get_redis()
+    version = None
+    try:
+        version = int(client.get(_version_key(user_id)) or 0)
+        html = client.get(_fragment_key(user_id, version))
+        if html is not None:
+            metrics.incr('dashboard_cache_total', result='hit')
+            return html.decode('utf-8')
+    except redis.RedisError as e:
+        logger.warning(f"Dashboard cache unavailable: {e}")
+
+    metrics.incr('dashboard_cache_total', result='miss')
+    html = render(user_id)
+    if version is not None:
+        try:
+            client.set(_fragment_key(user_id, version), html, ex=ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to cache dashboard for {user_id}: {e}")
+    return html
+
+
+def invalidate(user_id):
+    """
+    Makes the user's cached character list stale.
+    """
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(_version_key(user_id))
+        pipe.expire(_version_key(user_id), current_app.config['DASHBOARD_CACHE_TTL'])
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to invalidate dashboard for {user_id}: {e}")
+
+
+# Like prompt_cache, collect affected users at flush time and invalidate after commit
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_dashboards(session, flush_context):
+    changed = session.info.setdefault('changed_dashboards', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, (Character, Conversation)):
+            changed.add(obj.user_id)
+        elif isinstance(obj, Message):
+            # Appends and reply checkpoints change the last-message preview
+            conversation = session.get(Conversation, obj.conversation_id)
+            if conversation is not None:
+                changed.add(conversation.user_id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_dashboards(session):
+    for user_id in session.info.pop('changed_dashboards', ()):
+        invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_dashboards(session):
+    session.info.pop('changed_dashboards', None)
@@ -0,0 +1,105 @@
+# dedup.py
+
+import hashlib
+import json
+import logging
+import redis
+
+from extensions import get_redis
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+REQUEST_KEY_PREFIX = 'idempotency:'
+FLIGHT_KEY_PREFIX = 'generation:flight:'
+RESPONSE_KEY_PREFIX = 'generation:response:'
+
+
+def prompt_hash(model, messages, **params):
+    """
+    Returns a stable hash of everything that determines a completion.
+    """
+    payload = json.dumps({'model': model, 'messages': messages, 'params': params},
+                         sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def claim_request(user_id, client_message_id, ttl):
+    """
+    Records a client-supplied message id. Returns False if the same id was
+    already submitted within ttl seconds, i.e. the request is a double-submit
+    or a retry. Fails open when Redis is unavailable.
+    """
+    try:
+        claimed = get_redis().set(f'{REQUEST_KEY_PREFIX}{user_id}:{client_message_id}', 1, nx=True, ex=ttl)
+    except redis.RedisError as e:
+        logger.warning(f"Idempotency check unavailable: {e}")
+        return True
+    if not claimed:
+        metrics.incr('send_message_duplicates_total')
+    return bool(claimed)
+
+
+def release_request(user_id, client_message_id):
+    """
+    Forgets a claimed message id so a retry of a request that failed is
+    processed instead of being reported as a duplicate.
+    """
+    try:
+        get_redis().delete(f'{REQUEST_KEY_PREFIX}{user_id}:{client_message_id}')
+    except redis.RedisError as e:
+        logger.warning(f"Failed to release idempotency key: {e}")
+
+
+def generation_key(conversation_id, message_seq, digest):
+    return f'{conversation_id}:{message_seq}:{digest}'
+
+
+def claim_generation(key, ttl):
+    """
+    Single-flight guard: returns True for the first caller with this key and
+    False for concurrent duplicates, which should leave the stream to the owner.
+    """
+    try:
+        claimed = get_redis().set(f'{FLIGHT_KEY_PREFIX}{key}', 1, nx=True, ex=ttl)
+    except redis.RedisError as e:
+        logger.warning(f"Single-flight check unavailable: {e}")
+        return True
+    if not claimed:
+        metrics.incr('generation_dedup_collapsed_total')
+    return bool(claimed)
+
+
+def release_generation(key):
+    """
+    Releases a single-flight claim so a retry of a failed generation can run.
+    """
+    try:
+        get_redis().delete(f'{FLIGHT_KEY_PREFIX}{key}')
+    except redis.RedisError as e:
+        logger.warning(f"Failed to release generation {key}: {e}")
+
+
+def is_cacheable(temperature):
+    """
+    Only deterministic completions are safe to serve from the cache.
+    """
+    return temperature is not None and float(temperature) == 0.0
+
+
+def get_cached_response(digest):
+    try:
+        cached = get_redis().get(f'{RESPONSE_KEY_PREFIX}{digest}')
+    except redis.RedisError as e:
+        logger.warning(f"Response cache unavailable: {e}")
+        cached = None
+    metrics.incr('response_cache_hits_total' if cached is not None else 'response_cache_misses_total')
+    return cached.decode('utf-8') if cached is not None else None
+
+
+def cache_response(digest, content, ttl):
+    try:
+        get_redis().set(f'{RESPONSE_KEY_PREFIX}{digest}', content, ex=ttl)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache response: {e}")
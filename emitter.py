@@ -0,0 +1,183 @@
+# emitter.py
+
+import logging
+import os
+import threading
+import time
+from flask_socketio import SocketIO
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Process-wide Socket.IO client used by workers to publish through the message queue
+_socketio = None
+_socketio_pid = None
+
+
+def get_socketio(message_queue, channel='flask-socketio'):
+    """
+    Returns a Socket.IO emitter bound to the message queue, created once per process.
+    """
+    global _socketio, _socketio_pid
+    if _socketio is None or _socketio_pid != os.getpid():
+        _socketio = SocketIO(message_queue=message_queue, channel=channel)
+        _socketio_pid = os.getpid()
+    return _socketio
+
+
+class _Flusher:
+    """
+    Daemon thread flushing emitters whose buffered text has gone past its
+    interval with no further token arriving to trigger the flush, e.g. while
+    the model pauses mid-reply. Emitters are watched only while they hold
+    buffered text.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.emitters = set()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='emitter-flusher', daemon=True)
+        self.thread.start()
+
+    def watch(self, emitter):
+        with self.lock:
+            self.emitters.add(emitter)
+        self.wakeup.set()
+
+    def unwatch(self, emitter):
+        with self.lock:
+            self.emitters.discard(emitter)
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                emitters = list(self.emitters)
+                if not emitters:
+                    self.wakeup.clear()
+                    continue
+            next_due = None
+            for emitter in emitters:
+                try:
+                    due = emitter.flush_overdue()
+                except Exception as e:
+                    # _take() has unwatched it; as with a failed flush from push(), the chunk is dropped
+                    logger.warning(f"Timed flush to {emitter.room} failed: {e}")
+                    continue
+                if due is not None and (next_due is None or due < next_due):
+                    next_due = due
+            if next_due is not None:
+                time.sleep(max(next_due - time.monotonic(), 0.001))
+
+
+# Process-wide flusher, started on first use in each process
+_flusher = None
+_flusher_pid = None
+
+
+def _get_flusher():
+    global _flusher, _flusher_pid
+    if _flusher is None or _flusher_pid != os.getpid():
+        _flusher = _Flusher()
+        _flusher_pid = os.getpid()
+    return _flusher
+
+
+class CoalescingEmitter:
+    """
+    Buffers streamed tokens and emits them as a single chunk once the flush
+    interval has elapsed or the buffered text reaches max_bytes, turning one
+    Socket.IO emit (and Redis PUBLISH) per token into one per interval.
+    Text left in the buffer when tokens stop arriving is flushed by a
+    background thread once its interval is up, so a stalled stream never
+    holds back what has already been generated.
+    """
+
+    def __init__(self, socketio, event, room, interval=0.04, max_bytes=512, buffer=None):
+        self.socketio = socketio
+        # Optional ReplyBuffer receiving the same chunks for reconnecting clients
+        self.buffer = buffer
+        self.event = event
+        self.room = room
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.offset = 0
+        self.emits = 0
+        # Time spent inside socketio.emit, for the emit latency metric
+        self.emit_seconds = 0.0
+        self._buffer = []
+        self._buffered_bytes = 0
+        self._last_flush = time.monotonic()
+        self._watched = False
+        # _lock guards the buffer; _emit_lock keeps chunks in order across threads.
+        # push() without a flush only takes _lock, so it never waits on an emit.
+        self._lock = threading.Lock()
+        self._emit_lock = threading.Lock()
+
+    def push(self, token, flush=True):
+        """
+        Buffers token and flushes if due. With flush=False the token is only
+        buffered; the caller has checked flush_due(token) beforehand.
+        """
+        with self._lock:
+            self._buffer.append(token)
+            self._buffered_bytes += len(token.encode('utf-8'))
+            if not self._watched:
+                self._watched = True
+                _get_flusher().watch(self)
+        if flush and self.flush_due():
+            self.flush()
+
+    def flush_due(self, token=''):
+        """
+        True when pushing token would flush, i.e. emit and append to the buffer.
+        """
+        return (self._buffered_bytes + len(token.encode('utf-8')) >= self.max_bytes
+                or time.monotonic() - self._last_flush >= self.interval)
+
+    def flush(self):
+        with self._emit_lock:
+            self._emit(self._take())
+
+    def flush_overdue(self):
+        """
+        Flushes if the interval has passed since the last flush. Otherwise
+        returns the time.monotonic() at which it will have.
+        """
+        with self._emit_lock:
+            due = self._last_flush + self.interval
+            if time.monotonic() < due:
+                return due
+            self._emit(self._take())
+        return None
+
+    def close(self):
+        """
+        Drops any buffered text and stops timed flushes, e.g. after the reply failed.
+        """
+        with self._emit_lock:
+            self._take()
+
+    def _take(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            chunk = ''.join(self._buffer)
+            self._buffer = []
+            self._buffered_bytes = 0
+            if self._watched:
+                self._watched = False
+                _get_flusher().unwatch(self)
+        return chunk
+
+    def _emit(self, chunk):
+        if not chunk:
+            return
+        # offset lets the client detect gaps or duplicates across reconnects
+        started = time.perf_counter()
+        self.socketio.emit(self.event, {'chunk': chunk, 'offset': self.offset}, room=self.room)
+        self.emit_seconds += time.perf_counter() - started
+        if self.buffer is not None:
+            self.buffer.append(chunk, self.offset)
+        self.offset += len(chunk)
+        self.emits += 1
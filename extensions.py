@@ -1,10 +1,12 @@
 # extensions.py
 
+import redis
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from authlib.integrations.flask_client import OAuth
 from flask_socketio import SocketIO
-from celery import Celery
+from celery import Celery, Task
 
 db = SQLAlchemy()
 migrate = Migrate()
@@ -13,18 +15,57 @@ oauth = OAuth()
 # Initialize Socket.IO with message queue
 socketio = SocketIO(cors_allowed_origins="*", message_queue=None)
 
+def get_redis():
+    """
+    Returns the Redis client shared by the current app, creating it on first use.
+    """
+    client = current_app.extensions.get('redis')
+    if client is None:
+        client = redis.from_url(current_app.config['REDIS_URL'])
+        current_app.extensions['redis'] = client
+    return client
+
+class ContextTask(Task):
+    """
+    Runs every task inside the Flask app bound by make_celery.
+    """
+
+    def __call__(self, *args, **kwargs):
+        with self.app.flask_app.app_context():
+            return self.run(*args, **kwargs)
+
+
+# The one Celery app; tasks.py registers on it at import, make_celery configures it
+celery = Celery('matrixmingle', task_cls=ContextTask, include=['tasks'])
+
 def make_celery(app):
-    celery = Celery(
-        app.import_name,
-        broker=app.config['CELERY_BROKER_URL'],
-        backend=app.config['CELERY_RESULT_BACKEND'],
+    """
+    Configures the shared Celery app from the Flask config and binds it to
+    app. Calling it again for the same app is a no-op.
+    """
+    if getattr(celery, 'flask_app', None) is app:
+        return celery
+    celery.conf.update(
+        broker_url=app.config['CELERY_BROKER_URL'],
+        result_backend=app.config['CELERY_RESULT_BACKEND'],
     )
-    celery.conf.update(app.config)
 
-    class ContextTask(celery.Task):
-        def __call__(self, *args, **kwargs):
-            with app.app_context():
-                return self.run(*args, **kwargs)
+    # Priority queues and routing for generation and maintenance tasks
+    from scheduler import celery_queue_config
+    celery.conf.update(celery_queue_config())
+
+    # Periodic jobs, run by `celery -A celery_worker.celery beat`
+    celery.conf.beat_schedule = {
+        'finalize-stale-replies': {
+            'task': 'tasks.finalize_stale_replies_task',
+            'schedule': app.config['REPLY_SWEEP_INTERVAL_SECONDS'],
+        },
+        'archive-idle-conversations': {
+            'task': 'tasks.archive_idle_conversations_task',
+            'schedule': app.config['ARCHIVE_INTERVAL_SECONDS'],
+        },
+    }
 
-    celery.Task = ContextTask
-    return celery
\ No newline at end of file
+    # Keep a handle on the Flask app for ContextTask and worker process signal handlers
+    celery.flask_app = app
+    return celery
@@ -0,0 +1,178 @@
+# fake_openrouter.py
+
+"""
+Local stand-in for the OpenRouter chat completions endpoint.
+
+Streams a canned reply as SSE chunks in the OpenRouter/OpenAI format so the
+client, workers and benchmarks can run without network access. Use it as a
+context manager:
+
+    with FakeOpenRouterServer(tokens=50, delay=0.01) as server:
+        client = OpenRouterClient(api_url=server.url)
+
+or standalone:
+
+    python fake_openrouter.py --port 8089 --tokens 200 --delay 0.02
+    python fake_openrouter.py --model-delay openai/gpt-3.5-turbo=10
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        # Once per TCP connection, however many requests it carries
+        with self.server.lock:
+            self.server.connections += 1
+
+    def _write_chunk(self, data):
+        # Chunked framing lets the connection be kept alive after the stream ends
+        self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+        self.wfile.flush()
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+
+        with server.lock:
+            server.requests.append(payload)
+            failure = server.failures.pop(0) if server.failures else None
+
+        # Injected stall: no response at all, so the client's read timeout fires
+        if failure == 'timeout':
+            time.sleep(server.stall)
+            self.close_connection = True
+            return
+
+        # Injected failure, e.g. 429 or 503, to exercise client retries
+        if failure:
+            body = json.dumps({'error': {'code': failure}}).encode()
+            self.send_response(failure)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if failure == 429:
+                self.send_header('Retry-After', '0')
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+        model = payload.get('model', 'fake/model')
+        first_token_delay = server.model_delays.get(model, server.first_token_delay)
+        if first_token_delay:
+            time.sleep(first_token_delay)
+        try:
+            for i in range(server.tokens):
+                chunk = {'model': model, 'choices': [{'delta': {'content': f'{server.word}{i} '}}]}
+                self._write_chunk(f'data: {json.dumps(chunk)}\n\n'.encode())
+                if server.delay:
+                    time.sleep(server.delay)
+            self._write_chunk(b'data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client went away mid-stream (e.g. a cancelled generation)
+            with server.lock:
+                server.disconnects += 1
+            self.close_connection = True
+
+
+class FakeOpenRouterServer:
+    """
+    Threaded fake SSE server. `failures` is a list of HTTP status codes
+    returned, in order, to the first requests before streaming succeeds;
+    'timeout' instead stalls for `stall` seconds without responding.
+    `model_delays` overrides first_token_delay per requested model, e.g. to
+    make one model slow enough for the router to fail over. `connections`
+    counts TCP connections accepted and `disconnects` streams the client
+    closed before the end.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, tokens=20, delay=0.0,
+                 first_token_delay=0.0, word='token', failures=None, model_delays=None, stall=1.0):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.tokens = tokens
+        self.httpd.delay = delay
+        self.httpd.first_token_delay = first_token_delay
+        self.httpd.word = word
+        self.httpd.failures = list(failures or [])
+        self.httpd.model_delays = dict(model_delays or {})
+        self.httpd.stall = stall
+        self.httpd.requests = []
+        self.httpd.connections = 0
+        self.httpd.disconnects = 0
+        self.httpd.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/api/v1/chat/completions'
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    @property
+    def connections(self):
+        return self.httpd.connections
+
+    @property
+    def disconnects(self):
+        return self.httpd.disconnects
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a fake OpenRouter SSE server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--tokens', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.02)
+    parser.add_argument('--first-token-delay', type=float, default=0.2)
+    parser.add_argument('--model-delay', action='append', default=[], metavar='MODEL=SECONDS',
+                        help='First-token delay for one model; may be repeated.')
+    args = parser.parse_args()
+
+    model_delays = {}
+    for item in args.model_delay:
+        model, _, seconds = item.rpartition('=')
+        model_delays[model] = float(seconds)
+    server = FakeOpenRouterServer(args.host, args.port, tokens=args.tokens, delay=args.delay,
+                                  first_token_delay=args.first_token_delay, model_delays=model_delays)
+    print(f'Fake OpenRouter listening on {server.url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
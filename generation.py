@@ -0,0 +1,353 @@
+# generation.py
+
+import logging
+import time
+import redis
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import case, update
+
+from extensions import get_redis
+from models import Conversation, Message
+from openrouter_api import DEFAULT_MODEL, FALLBACK_RESPONSE, build_messages
+from prompt_cache import get_compiled_character
+from context_builder import build_history, estimate_tokens, needs_summary
+from emitter import CoalescingEmitter, get_socketio
+from reply_buffer import ReplyBuffer, request_cancel
+from scheduler import release_slot
+from model_router import candidate_models
+from dedup import (cache_response, claim_generation, generation_key, get_cached_response,
+                   is_cacheable, prompt_hash, release_generation)
+from tracing import span
+from worker_db import new_worker_session
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+MAX_TOKENS = 1000  # Set a reasonable limit to prevent infinite loops
+# Seconds between checks of the Redis cancel flag while streaming
+CANCEL_CHECK_INTERVAL = 0.25
+
+
+class Generation:
+    """
+    One streamed character reply, independent of the engine driving it.
+
+    The engine calls prepare(), feeds tokens from the upstream stream to
+    on_token() (calling checkpoint() whenever checkpoint_due()), then
+    finish(), or fail() on error, and always close(). The Celery task drives
+    it synchronously; async_worker drives many at once from an event loop,
+    running the database phases in threads. The instance owns its own
+    session so those phases may run on different threads.
+    """
+
+    def __init__(self, conversation_id, character_id, user_message, user_id, message_seq=None, trace=None):
+        self.conversation_id = conversation_id
+        self.character_id = character_id
+        self.user_message = user_message
+        self.user_id = user_id
+        self.message_seq = message_seq
+        trace = trace or {}
+        self.correlation_id = trace.get('correlation_id')
+        self.enqueued_at = trace.get('enqueued_at')
+
+        self.config = current_app.config
+        self.session = new_worker_session()
+        self.socketio = None
+        self.room = f"chat_{user_id}_{character_id}"
+        self.conversation = None
+        self.messages = None
+        self.model = DEFAULT_MODEL
+        self.models = None
+        self.hedge_delay = None
+        self.params = {}
+        self.digest = None
+        self.cacheable = False
+        self.flight_key = None
+        self.reply = None
+        self.reply_buffer = None
+        self.emitter = None
+        self.response_parts = []
+        self.token_count = 0
+        self.stream_started = None
+        self.first_token_at = None
+        self.last_checkpoint = None
+        self.cancelled = False
+        self.next_cancel_check = 0.0
+
+    def log(self, level, message):
+        logger.log(level, f"[{self.correlation_id}] {message}")
+
+    def prepare(self):
+        """
+        Loads everything needed to stream. Returns False when there is nothing
+        to stream: missing rows, a cache hit already delivered, or a duplicate.
+        """
+        config = self.config
+        if self.enqueued_at:
+            metrics.observe('generation_queue_wait_seconds', time.time() - self.enqueued_at)
+
+        # Retrieve conversation and the character's cached system prompt
+        self.conversation = self.session.query(Conversation).get(self.conversation_id)
+        compiled = get_compiled_character(self.character_id, self.session)
+        if not self.conversation or compiled is None:
+            self.log(logging.ERROR, f"Conversation or character not found (ID: {self.conversation_id}, {self.character_id})")
+            return False
+
+        # A newer user message replaces this one; its own job will answer instead
+        if self.superseded():
+            self.log(logging.INFO, f"Generation for message {self.message_seq} superseded before it started")
+            metrics.incr('generation_cancelled_total', reason='superseded')
+            return False
+
+        # Initialize Socket.IO with message queue
+        socketio_message_queue = config.get('SOCKETIO_MESSAGE_QUEUE')
+        if not socketio_message_queue:
+            self.log(logging.ERROR, "SOCKETIO_MESSAGE_QUEUE is not configured.")
+            return False
+        self.socketio = get_socketio(socketio_message_queue, config['SOCKETIO_CHANNEL'])
+
+        # Recent history under the token budget, with older turns replaced by the summary
+        system_prompt = compiled['prompt']
+        history_budget = (config['CONTEXT_TOKEN_BUDGET']
+                          - estimate_tokens(system_prompt) - estimate_tokens(self.user_message))
+        history = build_history(self.session, self.conversation, self.user_message, history_budget,
+                                self.message_seq)
+        self.messages = build_messages(system_prompt, self.user_message, history)
+
+        self.configure_model(compiled['settings'])
+        self.digest = prompt_hash(self.model, self.messages, **self.params)
+        self.cacheable = is_cacheable(self.params.get('temperature'))
+
+        # Deterministic configs can be answered from a previous identical completion
+        cached_response = get_cached_response(self.digest) if self.cacheable else None
+        if cached_response is not None:
+            reply = self.conversation.add_message('ai', cached_response)
+            self.session.commit()
+            # Written through the reply buffer like a streamed reply, so SSE clients and resumes see it
+            reply_buffer = ReplyBuffer(get_redis(), self.conversation_id, reply.id, ttl=config['REPLY_BUFFER_TTL'])
+            reply_buffer.start()
+            reply_buffer.append(cached_response, 0)
+            reply_buffer.finish('done')
+            self.socketio.emit('ai_response_complete', {'role': 'ai', 'content': cached_response}, room=self.room)
+            return False
+
+        # Collapse duplicate jobs for the same message onto the first one's stream
+        flight_key = generation_key(self.conversation_id, self.message_seq, self.digest)
+        if not claim_generation(flight_key, config['GENERATION_DEDUP_TTL']):
+            self.log(logging.INFO, f"Duplicate generation for conversation {self.conversation_id} collapsed")
+            return False
+        self.flight_key = flight_key
+
+        # Reserve the reply row up front so partial output can be checkpointed into it
+        self.reply = self.conversation.add_message('ai', '', complete=False)
+        self.session.commit()
+        self.reply_buffer = ReplyBuffer(get_redis(), self.conversation_id, self.reply.id,
+                                        ttl=config['REPLY_BUFFER_TTL'])
+        self.reply_buffer.start()
+
+        self.emitter = CoalescingEmitter(
+            self.socketio, 'partial_ai_response', self.room,
+            interval=config['SOCKETIO_FLUSH_INTERVAL_MS'] / 1000.0,
+            max_bytes=config['SOCKETIO_FLUSH_BYTES'],
+            buffer=self.reply_buffer,
+        )
+        self.stream_started = time.perf_counter()
+        self.last_checkpoint = time.monotonic()
+        return True
+
+    def configure_model(self, settings):
+        """
+        Applies the character's model settings, cached with its prompt, and
+        orders the fallback models by recent health. The digest keys on the
+        character's own model, so the response cache is unaffected by which
+        fallback served a reply.
+        """
+        config = self.config
+        self.model = settings['model'] or DEFAULT_MODEL
+        temperature = settings['temperature'] if settings['temperature'] is not None else config.get('GENERATION_TEMPERATURE')
+        if temperature is not None:
+            self.params['temperature'] = temperature
+        if settings['max_tokens']:
+            self.params['max_tokens'] = settings['max_tokens']
+
+        self.models = candidate_models(self.model)
+        if self.user_id in config['ROUTER_HEDGE_USER_IDS'] and len(self.models) > 1:
+            self.hedge_delay = config['ROUTER_HEDGE_DELAY']
+
+    def superseded(self):
+        if self.message_seq is None:
+            return False
+        newer = self.session.query(Message.id).filter(
+            Message.conversation_id == self.conversation_id,
+            Message.role == 'user',
+            Message.seq > self.message_seq
+        ).first()
+        return newer is not None
+
+    def io_due(self, token):
+        """
+        True when on_token(token) would call Redis: an emitter flush (PUBLISH
+        and XADD) or a cancel-flag check.
+        """
+        return self.emitter.flush_due(token) or time.monotonic() >= self.next_cancel_check
+
+    def on_token(self, token, io=True):
+        """
+        Records and emits one token. Returns False once the token limit is hit
+        or the reply has been cancelled; the engine then closes the upstream stream.
+        With io=False nothing touches Redis: the token is only buffered and the
+        cancel flag is not checked. async_worker passes it when io_due() is
+        False, and otherwise runs on_token in a thread.
+        """
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        # Tokens are collected in a list and joined once, avoiding quadratic concatenation
+        self.response_parts.append(token)
+        self.token_count += 1
+
+        # Emit partial responses to the client via Socket.IO, coalesced into chunks
+        self.emitter.push(token, flush=io)
+
+        if self.token_count >= MAX_TOKENS:
+            self.log(logging.WARNING, f"Token limit reached for conversation {self.conversation_id}")
+            return False
+
+        now = time.monotonic()
+        if io and now >= self.next_cancel_check:
+            self.next_cancel_check = now + CANCEL_CHECK_INTERVAL
+            if self.reply_buffer.cancel_requested():
+                self.log(logging.INFO, f"Generation for conversation {self.conversation_id} cancelled")
+                self.cancelled = True
+                return False
+        return True
+
+    def checkpoint_due(self):
+        return time.monotonic() - self.last_checkpoint >= self.config['REPLY_CHECKPOINT_INTERVAL']
+
+    def checkpoint(self):
+        """
+        Persists the partial reply so a worker crash loses little.
+        """
+        self.reply.content = ''.join(self.response_parts)
+        self.session.commit()
+        self.last_checkpoint = time.monotonic()
+
+    def finish(self):
+        """
+        Stores the completed reply and notifies the client.
+        """
+        config = self.config
+        self.emitter.flush()
+        ai_response = ''.join(self.response_parts)
+
+        stream_ended = time.perf_counter()
+        if self.first_token_at is not None:
+            metrics.observe('generation_time_to_first_token_seconds', self.first_token_at - self.stream_started)
+        metrics.observe('generation_stream_duration_seconds', stream_ended - self.stream_started)
+        metrics.incr('generation_tokens_total', self.token_count)
+        metrics.observe('socketio_emit_seconds', self.emitter.emit_seconds)
+        metrics.incr('socketio_emits_total', self.emitter.emits)
+
+        # Store the final AI response in the reserved row
+        with span('db.commit_reply', self.correlation_id, conversation_id=self.conversation_id):
+            self.reply.content = ai_response
+            self.reply.complete = True
+
+            # Commit the session to save changes
+            self.session.commit()
+        metrics.observe('generation_db_commit_seconds', time.perf_counter() - stream_ended)
+        self.reply_buffer.finish('cancelled' if self.cancelled else 'done')
+
+        if self.cancelled:
+            metrics.incr('generation_cancelled_total', reason='requested')
+        elif self.cacheable and ai_response != FALLBACK_RESPONSE:
+            cache_response(self.digest, ai_response, config['RESPONSE_CACHE_TTL'])
+
+        # Notify client that the AI response is complete
+        self.socketio.emit('ai_response_complete',
+                           {'role': 'ai', 'content': ai_response, 'cancelled': self.cancelled}, room=self.room)
+
+        # Fold older turns into the rolling summary off the hot path
+        self.session.refresh(self.conversation)
+        if needs_summary(self.conversation, config['CONTEXT_KEEP_RECENT'], config['SUMMARY_TRIGGER_MESSAGES']):
+            from tasks import summarize_conversation_task
+            summarize_conversation_task.delay(self.conversation_id)
+
+    def fail(self, error):
+        """
+        Keeps whatever was streamed, frees the single-flight claim and tells the client.
+        """
+        self.log(logging.ERROR, f"Error generating character response: {error}")
+        metrics.incr('generation_errors_total')
+        # Let a retry of this message run instead of being collapsed
+        if self.flight_key:
+            release_generation(self.flight_key)
+        # Keep whatever was streamed before the failure
+        if self.reply is not None:
+            try:
+                self.session.rollback()
+                self.reply.content = ''.join(self.response_parts)
+                self.reply.complete = True
+                self.session.commit()
+            except Exception as persist_error:
+                self.log(logging.ERROR, f"Failed to persist partial reply: {persist_error}")
+        # Nothing more may reach the reply buffer once it is marked failed
+        if self.emitter is not None:
+            self.emitter.close()
+        if self.reply_buffer is not None:
+            self.reply_buffer.finish('error')
+        # Emit error message to the client
+        if self.socketio is not None:
+            try:
+                self.socketio.emit('error', {'error': 'An error occurred while generating the AI response.'}, room=self.room)
+            except Exception as emit_error:
+                self.log(logging.ERROR, f"Failed to emit error message via Socket.IO: {emit_error}")
+
+    def close(self):
+        # Stop timed flushes of anything still buffered
+        if self.emitter is not None:
+            self.emitter.close()
+        # Return the connection to the pool
+        self.session.close()
+        # Free the user's in-flight generation slot taken in send_message
+        release_slot(self.user_id)
+
+
+def cancel_generation(user_id, character_id):
+    """
+    Cancels the reply streaming in a user's conversation with a character.
+    Returns the reply's message id, or None when nothing was streaming.
+    """
+    conversation = Conversation.query.with_entities(Conversation.id).filter_by(
+        user_id=user_id, character_id=character_id
+    ).first()
+    if conversation is None:
+        return None
+    try:
+        return request_cancel(get_redis(), conversation.id, current_app.config['REPLY_BUFFER_TTL'])
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cancel generation for conversation {conversation.id}: {e}")
+        return None
+
+
+def finalize_stale_replies(session, max_age):
+    """
+    Marks replies left incomplete for longer than max_age seconds as complete,
+    keeping their last checkpoint. A worker that died mid-stream never runs
+    finish() or fail(), and such a row would otherwise stay out of the history,
+    block archiving and report itself as still streaming. Returns the count.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=max_age)
+    result = session.execute(
+        update(Message)
+        .where(Message.complete.is_(False), Message.created_at < cutoff)
+        .values(complete=True,
+                content=case((Message.content == '', FALLBACK_RESPONSE), else_=Message.content))
+    )
+    session.commit()
+    if result.rowcount:
+        logger.warning(f"Finalized {result.rowcount} replies abandoned mid-stream")
+        metrics.incr('generation_abandoned_total', result.rowcount)
+    return result.rowcount
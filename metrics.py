@@ -0,0 +1,128 @@
+# metrics.py
+
+import logging
+import re
+from extensions import get_redis
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Metrics are kept in Redis hashes so that every web and worker process
+# contributes to the same set of values.
+COUNTERS_KEY = 'metrics:counters'
+GAUGES_KEY = 'metrics:gauges'
+HISTOGRAMS_KEY = 'metrics:histograms'
+
+# Histogram bucket upper bounds, in seconds for latency metrics
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _field(name, labels):
+    if not labels:
+        return name
+    label_str = ','.join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+    return f'{name}{{{label_str}}}'
+
+
+def _bucket_field(name, labels, le):
+    return _field(f'{name}_bucket', dict(labels, le=le))
+
+
+def incr(name, amount=1, **labels):
+    """
+    Increments a counter. Failures are logged and never raised to the caller.
+    """
+    try:
+        get_redis().hincrbyfloat(COUNTERS_KEY, _field(name, labels), amount)
+    except Exception as e:
+        logger.warning(f"Failed to record metric {name}: {e}")
+
+
+def set_gauge(name, value, **labels):
+    """
+    Sets a gauge to the given value. Failures are logged and never raised to the caller.
+    """
+    try:
+        get_redis().hset(GAUGES_KEY, _field(name, labels), value)
+    except Exception as e:
+        logger.warning(f"Failed to record metric {name}: {e}")
+
+
+def clear_gauges(names, **labels):
+    """
+    Removes gauges whose source has gone away, e.g. a stopped process, so
+    they are not exported with their last value forever. Failures are logged
+    and never raised to the caller.
+    """
+    try:
+        get_redis().hdel(GAUGES_KEY, *(_field(name, labels) for name in names))
+    except Exception as e:
+        logger.warning(f"Failed to clear metrics {', '.join(names)}: {e}")
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    """
+    Records one observation in a cumulative histogram. Failures are logged and
+    never raised to the caller.
+    """
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for bound in buckets:
+            if value <= bound:
+                pipe.hincrby(HISTOGRAMS_KEY, _bucket_field(name, labels, bound), 1)
+        pipe.hincrby(HISTOGRAMS_KEY, _bucket_field(name, labels, '+Inf'), 1)
+        pipe.hincrbyfloat(HISTOGRAMS_KEY, _field(f'{name}_sum', labels), value)
+        pipe.hincrby(HISTOGRAMS_KEY, _field(f'{name}_count', labels), 1)
+        pipe.execute()
+    except Exception as e:
+        logger.warning(f"Failed to record metric {name}: {e}")
+
+
+def snapshot():
+    """
+    Returns all recorded counters and gauges as {'counters': {...}, 'gauges': {...}}.
+    """
+    client = get_redis()
+    return {
+        'counters': {k.decode(): float(v) for k, v in client.hgetall(COUNTERS_KEY).items()},
+        'gauges': {k.decode(): float(v) for k, v in client.hgetall(GAUGES_KEY).items()},
+        'histograms': {k.decode(): float(v) for k, v in client.hgetall(HISTOGRAMS_KEY).items()},
+    }
+
+
+def _base_name(field):
+    name = field.split('{', 1)[0]
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def _bucket_sort_key(field):
+    # Keep buckets in ascending `le` order with +Inf last, as Prometheus expects
+    name, _, labels = field.partition('{')
+    match = re.search(r'le="([^"]*)"', labels)
+    if not match:
+        return (name, labels, 0.0)
+    le = match.group(1)
+    bound = float('inf') if le == '+Inf' else float(le)
+    return (name, labels.replace(match.group(0), ''), bound)
+
+
+def render_prometheus():
+    """
+    Renders every recorded metric in the Prometheus text exposition format.
+    """
+    data = snapshot()
+    lines = []
+    for kind, values in (('counter', data['counters']), ('gauge', data['gauges']),
+                         ('histogram', data['histograms'])):
+        by_name = {}
+        for field, value in values.items():
+            by_name.setdefault(_base_name(field) if kind == 'histogram' else field.split('{', 1)[0], []).append((field, value))
+        for name in sorted(by_name):
+            lines.append(f'# TYPE {name} {kind}')
+            for field, value in sorted(by_name[name], key=lambda item: _bucket_sort_key(item[0])):
+                # repr keeps every digit; :g would round large counters to six significant figures
+                lines.append(f'{field} {float(value)!r}')
+    return '\n'.join(lines) + '\n'
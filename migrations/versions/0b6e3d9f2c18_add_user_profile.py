@@ -0,0 +1,26 @@
+"""Store a slim user profile for the Redis session store
+
+Revision ID: 0b6e3d9f2c18
+Revises: f7a2c4e8b915
+Create Date: 2024-10-29 16:47:05.391826
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b6e3d9f2c18'
+down_revision = 'f7a2c4e8b915'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.add_column(sa.Column('profile', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('profile')
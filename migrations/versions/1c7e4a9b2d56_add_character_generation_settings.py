@@ -0,0 +1,30 @@
+"""Per-character model, temperature and max_tokens
+
+Revision ID: 1c7e4a9b2d56
+Revises: 0b6e3d9f2c18
+Create Date: 2024-11-04 15:22:47.318205
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c7e4a9b2d56'
+down_revision = '0b6e3d9f2c18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('characters') as batch_op:
+        batch_op.add_column(sa.Column('model', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('temperature', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('max_tokens', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('characters') as batch_op:
+        batch_op.drop_column('max_tokens')
+        batch_op.drop_column('temperature')
+        batch_op.drop_column('model')
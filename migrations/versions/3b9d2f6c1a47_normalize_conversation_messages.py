@@ -0,0 +1,106 @@
+"""Normalize conversation messages into an append-only table
+
+Revision ID: 3b9d2f6c1a47
+Revises: ee44e4bf37af
+Create Date: 2024-10-20 14:05:11.482913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d2f6c1a47'
+down_revision = 'ee44e4bf37af'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+conversations = sa.table(
+    'conversations',
+    sa.column('id', sa.Integer),
+    sa.column('messages', sa.JSON),
+    sa.column('message_count', sa.Integer),
+)
+
+messages = sa.table(
+    'messages',
+    sa.column('id', sa.Integer),
+    sa.column('conversation_id', sa.Integer),
+    sa.column('seq', sa.Integer),
+    sa.column('role', sa.String),
+    sa.column('content', sa.Text),
+)
+
+
+def upgrade():
+    op.create_table('messages',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('conversation_id', sa.Integer(), nullable=False),
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('role', sa.String(length=20), nullable=False),
+    sa.Column('content', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('conversation_id', 'seq', name='uq_messages_conversation_seq')
+    )
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), nullable=False, server_default='0'))
+
+    # Backfill from the JSON column, one conversation at a time, inserting in batches
+    bind = op.get_bind()
+    ids = [row[0] for row in bind.execute(sa.select(conversations.c.id)).fetchall()]
+    for conversation_id in ids:
+        history = bind.execute(
+            sa.select(conversations.c.messages).where(conversations.c.id == conversation_id)
+        ).scalar() or []
+        batch = []
+        for seq, item in enumerate(history):
+            batch.append({
+                'conversation_id': conversation_id,
+                'seq': seq,
+                'role': item.get('role', 'user'),
+                'content': item.get('content', ''),
+            })
+            if len(batch) >= BATCH_SIZE:
+                bind.execute(messages.insert(), batch)
+                batch = []
+        if batch:
+            bind.execute(messages.insert(), batch)
+        bind.execute(
+            conversations.update()
+            .where(conversations.c.id == conversation_id)
+            .values(message_count=len(history))
+        )
+
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.drop_column('messages')
+
+
+def downgrade():
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('messages', sa.JSON(), nullable=True))
+
+    bind = op.get_bind()
+    ids = [row[0] for row in bind.execute(sa.select(conversations.c.id)).fetchall()]
+    for conversation_id in ids:
+        history = [
+            {'role': role, 'content': content}
+            for role, content in bind.execute(
+                sa.select(messages.c.role, messages.c.content)
+                .where(messages.c.conversation_id == conversation_id)
+                .order_by(messages.c.seq)
+            )
+        ]
+        bind.execute(
+            conversations.update()
+            .where(conversations.c.id == conversation_id)
+            .values(messages=history)
+        )
+
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.alter_column('messages', existing_type=sa.JSON(), nullable=False)
+        batch_op.drop_column('message_count')
+    op.drop_table('messages')
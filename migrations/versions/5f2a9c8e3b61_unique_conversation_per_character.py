@@ -0,0 +1,72 @@
+"""One conversation per user and character
+
+Revision ID: 5f2a9c8e3b61
+Revises: 8c41e7a2d9f3
+Create Date: 2024-10-24 16:12:08.930157
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2a9c8e3b61'
+down_revision = '8c41e7a2d9f3'
+branch_labels = None
+depends_on = None
+
+conversations = sa.table(
+    'conversations',
+    sa.column('id', sa.Integer),
+    sa.column('user_id', sa.String),
+    sa.column('character_id', sa.Integer),
+    sa.column('message_count', sa.Integer),
+    sa.column('summary', sa.Text),
+    sa.column('summary_seq', sa.Integer),
+)
+
+messages = sa.table(
+    'messages',
+    sa.column('conversation_id', sa.Integer),
+    sa.column('seq', sa.Integer),
+)
+
+
+def upgrade():
+    # Merge duplicates left by earlier racing get-or-create code into the oldest
+    # conversation, appending their messages after its own.
+    bind = op.get_bind()
+    duplicates = bind.execute(
+        sa.select(conversations.c.user_id, conversations.c.character_id)
+        .group_by(conversations.c.user_id, conversations.c.character_id)
+        .having(sa.func.count() > 1)
+    ).fetchall()
+    for user_id, character_id in duplicates:
+        rows = bind.execute(
+            sa.select(conversations.c.id, conversations.c.message_count)
+            .where(conversations.c.user_id == user_id, conversations.c.character_id == character_id)
+            .order_by(conversations.c.id)
+        ).fetchall()
+        keep_id, total = rows[0]
+        for extra_id, extra_count in rows[1:]:
+            bind.execute(
+                messages.update()
+                .where(messages.c.conversation_id == extra_id)
+                .values(conversation_id=keep_id, seq=messages.c.seq + total)
+            )
+            total += extra_count
+            bind.execute(conversations.delete().where(conversations.c.id == extra_id))
+        # The merged history no longer matches the old summary; rebuild it from scratch
+        bind.execute(
+            conversations.update()
+            .where(conversations.c.id == keep_id)
+            .values(message_count=total, summary=None, summary_seq=0)
+        )
+
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.create_unique_constraint('uq_conversations_user_character', ['user_id', 'character_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.drop_constraint('uq_conversations_user_character', type_='unique')
@@ -0,0 +1,43 @@
+"""Archive idle conversations' older messages into compressed blobs
+
+Revision ID: 6a3f8d2c9e14
+Revises: 1c7e4a9b2d56
+Create Date: 2024-11-06 11:37:12.906431
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a3f8d2c9e14'
+down_revision = '1c7e4a9b2d56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'conversation_archives',
+        sa.Column('conversation_id', sa.Integer(), nullable=False),
+        sa.Column('codec', sa.String(length=16), nullable=False),
+        sa.Column('message_count', sa.Integer(), nullable=False),
+        sa.Column('raw_bytes', sa.Integer(), nullable=False),
+        sa.Column('stored_bytes', sa.Integer(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['conversation_id'], ['conversations.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('conversation_id'),
+    )
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('archived_at', sa.DateTime(), nullable=True))
+    # The archival job looks for conversations idle since a cutoff
+    op.create_index('ix_conversations_updated_at', 'conversations', ['updated_at'])
+
+
+def downgrade():
+    # Archived messages are lost with the table; run `python run.py rehydrate-all` first
+    op.drop_index('ix_conversations_updated_at', table_name='conversations')
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.drop_column('archived_at')
+    op.drop_table('conversation_archives')
@@ -0,0 +1,28 @@
+"""Add rolling summary to conversations
+
+Revision ID: 8c41e7a2d9f3
+Revises: 3b9d2f6c1a47
+Create Date: 2024-10-22 09:41:37.215604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41e7a2d9f3'
+down_revision = '3b9d2f6c1a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.add_column(sa.Column('summary', sa.Text(), nullable=True))
+        batch_op.add_column(sa.Column('summary_seq', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('conversations') as batch_op:
+        batch_op.drop_column('summary_seq')
+        batch_op.drop_column('summary')
@@ -0,0 +1,68 @@
+"""Full-text index for archived messages
+
+Revision ID: 9e2c4a7b1d58
+Revises: 6a3f8d2c9e14
+Create Date: 2024-11-08 10:14:52.640173
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2c4a7b1d58'
+down_revision = '6a3f8d2c9e14'
+branch_labels = None
+depends_on = None
+
+# SQLite: a contentless FTS5 table, so the archived text is not stored a second time
+SQLITE_UPGRADE = [
+    """CREATE TABLE archived_message_index (
+        message_id INTEGER NOT NULL PRIMARY KEY,
+        conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE
+    )""",
+    "CREATE INDEX ix_archived_message_index_conversation_id ON archived_message_index (conversation_id)",
+    "CREATE VIRTUAL TABLE archived_messages_fts USING fts5(content, content='')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TABLE IF EXISTS archived_messages_fts",
+    "DROP TABLE IF EXISTS archived_message_index",
+]
+
+# PostgreSQL: the tsvector only; the expression must match search.PostgresSearch
+POSTGRES_UPGRADE = [
+    """CREATE TABLE archived_message_index (
+        message_id INTEGER NOT NULL PRIMARY KEY,
+        conversation_id INTEGER NOT NULL REFERENCES conversations (id) ON DELETE CASCADE,
+        terms tsvector NOT NULL
+    )""",
+    "CREATE INDEX ix_archived_message_index_conversation_id ON archived_message_index (conversation_id)",
+    "CREATE INDEX ix_archived_message_index_terms ON archived_message_index USING gin (terms)",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP TABLE IF EXISTS archived_message_index",
+]
+
+
+def _run(statements_by_dialect):
+    statements = statements_by_dialect.get(op.get_bind().dialect.name, [])
+    for statement in statements:
+        op.execute(statement)
+
+
+def upgrade():
+    # Other databases get no index; search scans the archives there
+    _run({'sqlite': SQLITE_UPGRADE, 'postgresql': POSTGRES_UPGRADE})
+
+    # Index conversations archived before this revision
+    from archive import index_messages, read_archive
+    bind = op.get_bind()
+    archives = bind.execute(sa.text("SELECT conversation_id, codec, data FROM conversation_archives"))
+    for archive in archives.all():
+        index_messages(bind, bind.dialect.name, archive.conversation_id, read_archive(archive.codec, archive.data))
+
+
+def downgrade():
+    _run({'sqlite': SQLITE_DOWNGRADE, 'postgresql': POSTGRES_DOWNGRADE})
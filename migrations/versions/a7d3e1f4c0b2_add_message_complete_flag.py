@@ -0,0 +1,26 @@
+"""Track whether a message has finished streaming
+
+Revision ID: a7d3e1f4c0b2
+Revises: 5f2a9c8e3b61
+Create Date: 2024-10-27 11:03:52.648120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3e1f4c0b2'
+down_revision = '5f2a9c8e3b61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.add_column(sa.Column('complete', sa.Boolean(), nullable=False, server_default=sa.true()))
+
+
+def downgrade():
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_column('complete')
@@ -0,0 +1,84 @@
+"""Full-text search indexes for messages and characters
+
+Revision ID: d4b8f2a61e93
+Revises: a7d3e1f4c0b2
+Create Date: 2024-10-28 09:41:17.203512
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'd4b8f2a61e93'
+down_revision = 'a7d3e1f4c0b2'
+branch_labels = None
+depends_on = None
+
+# SQLite: external-content FTS5 tables kept in sync by triggers on every write
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE messages_fts USING fts5(content, content='messages', content_rowid='id')",
+    """CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO messages_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    "INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')",
+
+    "CREATE VIRTUAL TABLE characters_fts USING fts5(name, description, content='characters', content_rowid='id')",
+    """CREATE TRIGGER characters_fts_insert AFTER INSERT ON characters BEGIN
+        INSERT INTO characters_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    """CREATE TRIGGER characters_fts_delete AFTER DELETE ON characters BEGIN
+        INSERT INTO characters_fts(characters_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END""",
+    """CREATE TRIGGER characters_fts_update AFTER UPDATE OF name, description ON characters BEGIN
+        INSERT INTO characters_fts(characters_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO characters_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END""",
+    "INSERT INTO characters_fts(characters_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS messages_fts_insert",
+    "DROP TRIGGER IF EXISTS messages_fts_delete",
+    "DROP TRIGGER IF EXISTS messages_fts_update",
+    "DROP TABLE IF EXISTS messages_fts",
+    "DROP TRIGGER IF EXISTS characters_fts_insert",
+    "DROP TRIGGER IF EXISTS characters_fts_delete",
+    "DROP TRIGGER IF EXISTS characters_fts_update",
+    "DROP TABLE IF EXISTS characters_fts",
+]
+
+# PostgreSQL: GIN expression indexes; the expressions must match search.PostgresSearch
+POSTGRES_UPGRADE = [
+    "CREATE INDEX ix_messages_content_fts ON messages USING gin (to_tsvector('english', content))",
+    "CREATE INDEX ix_characters_fts ON characters "
+    "USING gin (to_tsvector('english', name || ' ' || description))",
+]
+
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS ix_messages_content_fts",
+    "DROP INDEX IF EXISTS ix_characters_fts",
+]
+
+
+def _run(statements_by_dialect):
+    statements = statements_by_dialect.get(op.get_bind().dialect.name, [])
+    for statement in statements:
+        op.execute(statement)
+
+
+def upgrade():
+    # Other databases get no index; search falls back to a LIKE scan there
+    _run({'sqlite': SQLITE_UPGRADE, 'postgresql': POSTGRES_UPGRADE})
+
+
+def downgrade():
+    _run({'sqlite': SQLITE_DOWNGRADE, 'postgresql': POSTGRES_DOWNGRADE})
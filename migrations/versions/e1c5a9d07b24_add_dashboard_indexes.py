@@ -0,0 +1,28 @@
+"""Indexes for the dashboard's per-user character list
+
+Revision ID: e1c5a9d07b24
+Revises: d4b8f2a61e93
+Create Date: 2024-10-28 15:26:44.118230
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1c5a9d07b24'
+down_revision = 'd4b8f2a61e93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Dashboard lists a user's characters in id order
+    op.create_index('ix_characters_user_id_id', 'characters', ['user_id', 'id'])
+    # Conversations are already unique on (user_id, character_id); this one
+    # serves lookups and cascading deletes by character alone
+    op.create_index('ix_conversations_character_id', 'conversations', ['character_id'])
+
+
+def downgrade():
+    op.drop_index('ix_conversations_character_id', table_name='conversations')
+    op.drop_index('ix_characters_user_id_id', table_name='characters')
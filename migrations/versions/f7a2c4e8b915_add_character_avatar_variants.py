@@ -0,0 +1,26 @@
+"""Record processed avatar variants on characters
+
+Revision ID: f7a2c4e8b915
+Revises: e1c5a9d07b24
+Create Date: 2024-10-29 10:08:31.774602
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f7a2c4e8b915'
+down_revision = 'e1c5a9d07b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('characters') as batch_op:
+        batch_op.add_column(sa.Column('avatar_variants', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('characters') as batch_op:
+        batch_op.drop_column('avatar_variants')
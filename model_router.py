@@ -0,0 +1,333 @@
+# model_router.py
+
+"""
+Chooses which OpenRouter model serves a reply and fails over between models.
+
+Each model's recent requests, errors, first-token timeouts and
+time-to-first-token are counted in per-minute Redis hashes, shared by all
+workers. candidate_models() orders a character's model and the configured
+fallbacks so that models currently slow or failing are tried last.
+
+route_stream() and aroute_stream() (for async_worker) then stream from the
+first candidate. If it produces no token within ROUTER_TTFT_TIMEOUT, or
+fails before its first token, the next candidate is started. In hedged
+mode the next candidate is started after hedge_delay while the first keeps
+running, and whichever answers first wins; the loser is closed. Once a
+token has been passed on, the reply is committed to that model.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+import redis
+from flask import current_app
+
+from extensions import get_redis
+from openrouter_client import OpenRouterError
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+STATS_KEY_PREFIX = 'router:stats:'
+BUCKET_SECONDS = 60
+
+
+def _bucket_key(model, bucket):
+    return f'{STATS_KEY_PREFIX}{model}:{bucket}'
+
+
+def record_attempt(model, ttft=None, error=False, timed_out=False):
+    """
+    Counts one attempt against a model: its time to first token, or whether
+    it failed or timed out before producing one.
+    """
+    window = current_app.config['ROUTER_STATS_WINDOW']
+    key = _bucket_key(model, int(time.time() // BUCKET_SECONDS))
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.hincrby(key, 'requests', 1)
+        if error:
+            pipe.hincrby(key, 'errors', 1)
+        if timed_out:
+            pipe.hincrby(key, 'timeouts', 1)
+        if ttft is not None:
+            pipe.hincrbyfloat(key, 'ttft_sum', ttft)
+            pipe.hincrby(key, 'ttft_count', 1)
+        pipe.expire(key, window + BUCKET_SECONDS)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to record router stats for {model}: {e}")
+
+    if ttft is not None:
+        metrics.observe('router_time_to_first_token_seconds', ttft, model=model)
+    outcome = 'timeout' if timed_out else 'error' if error else 'ok'
+    metrics.incr('router_attempts_total', model=model, outcome=outcome)
+
+
+def model_health(models):
+    """
+    Returns {model: {'requests', 'error_rate', 'ttft'}} over the stats window
+    for all models with one pipelined read.
+    """
+    window = current_app.config['ROUTER_STATS_WINDOW']
+    now_bucket = int(time.time() // BUCKET_SECONDS)
+    buckets = range(now_bucket - window // BUCKET_SECONDS, now_bucket + 1)
+    pipe = get_redis().pipeline(transaction=False)
+    for model in models:
+        for bucket in buckets:
+            pipe.hgetall(_bucket_key(model, bucket))
+    results = iter(pipe.execute())
+
+    health = {}
+    for model in models:
+        totals = {'requests': 0.0, 'errors': 0.0, 'timeouts': 0.0, 'ttft_sum': 0.0, 'ttft_count': 0.0}
+        for _ in buckets:
+            for field, value in next(results).items():
+                field = field.decode()
+                if field in totals:
+                    totals[field] += float(value)
+        requests_seen = totals['requests']
+        health[model] = {
+            'requests': int(requests_seen),
+            'error_rate': (totals['errors'] + totals['timeouts']) / requests_seen if requests_seen else 0.0,
+            'ttft': totals['ttft_sum'] / totals['ttft_count'] if totals['ttft_count'] else None,
+        }
+    return health
+
+
+def candidate_models(primary):
+    """
+    The character's model followed by the configured fallbacks, with models
+    currently failing or slow moved to the end. Order is kept otherwise.
+    """
+    config = current_app.config
+    models = list(dict.fromkeys([primary, *config['ROUTER_FALLBACK_MODELS']]))
+    if len(models) == 1:
+        return models
+    try:
+        health = model_health(models)
+    except redis.RedisError as e:
+        logger.warning(f"Router stats unavailable, using configured order: {e}")
+        return models
+
+    def degraded(model):
+        stats = health[model]
+        if stats['requests'] < config['ROUTER_MIN_SAMPLES']:
+            return False
+        slow = stats['ttft'] is not None and stats['ttft'] > config['ROUTER_TTFT_TIMEOUT']
+        return slow or stats['error_rate'] > config['ROUTER_MAX_ERROR_RATE']
+
+    return sorted(models, key=degraded)
+
+
+class _Race:
+    """
+    Bookkeeping shared by the blocking and asyncio routers: which attempts
+    are live, when the next candidate is due, and what to record.
+    """
+
+    def __init__(self, models, ttft_timeout, hedge_delay):
+        self.pending = list(models)
+        self.ttft_timeout = ttft_timeout if ttft_timeout is not None else current_app.config['ROUTER_TTFT_TIMEOUT']
+        self.hedge_delay = hedge_delay
+        self.started = {}
+        self.deadline = None
+
+    def next_model(self):
+        model = self.pending.pop(0)
+        self.started[model] = time.perf_counter()
+        self.deadline = time.monotonic() + (self.hedge_delay if self.hedge_delay is not None else self.ttft_timeout)
+        return model
+
+    def timeout(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def on_deadline(self):
+        """
+        Called when the deadline passes without a first token. Returns the
+        models to abandon; the caller then starts next_model() if any remain.
+        """
+        if not self.pending:
+            self.deadline = None
+            return []
+        if self.hedge_delay is not None:
+            return []
+        # Failover: give up on the slow model entirely
+        abandoned = list(self.started)
+        for model in abandoned:
+            record_attempt(model, timed_out=True)
+            metrics.incr('router_failovers_total', model=model, reason='ttft')
+            logger.warning(f"{model} exceeded {self.ttft_timeout}s to first token, failing over")
+        self.started.clear()
+        return abandoned
+
+    def on_failure(self, model, error):
+        self.started.pop(model, None)
+        record_attempt(model, error=True)
+        metrics.incr('router_failovers_total', model=model, reason='error')
+        logger.warning(f"{model} failed before its first token: {error}")
+
+    def on_first_token(self, model):
+        record_attempt(model, ttft=time.perf_counter() - self.started.pop(model))
+        losers = list(self.started)
+        for loser in losers:
+            record_attempt(loser, timed_out=True)
+        self.started.clear()
+        return losers
+
+
+class _Attempt:
+    """
+    Reads one model's stream on a daemon thread into the shared queue. A
+    stopped attempt closes its upstream response at its next token, or when
+    the client's read timeout expires if the model never answers.
+    """
+
+    def __init__(self, client, model, messages, params, events):
+        self.model = model
+        self.stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(client, messages, params, events),
+                                        name=f'route-{model}', daemon=True)
+        self._thread.start()
+
+    def _run(self, client, messages, params, events):
+        stream = client.stream_chat(messages, self.model, **params)
+        try:
+            for token in stream:
+                if self.stopped.is_set():
+                    return
+                events.put((self.model, 'token', token))
+            events.put((self.model, 'done', None))
+        except Exception as e:
+            events.put((self.model, 'error', e))
+        finally:
+            stream.close()
+
+    def stop(self):
+        self.stopped.set()
+
+
+def route_stream(client, messages, models, params, ttft_timeout=None, hedge_delay=None):
+    """
+    Yields the reply tokens of the first model in models to answer in time,
+    waiting ttft_timeout (default ROUTER_TTFT_TIMEOUT) before failing over.
+    Raises OpenRouterError when every model fails before its first token.
+    """
+    events = queue.Queue()
+    race = _Race(models, ttft_timeout, hedge_delay)
+    attempts = {}
+    winner = None
+
+    def start_next():
+        model = race.next_model()
+        attempts[model] = _Attempt(client, model, messages, params, events)
+
+    try:
+        start_next()
+        while winner is None:
+            try:
+                model, kind, value = events.get(timeout=race.timeout())
+            except queue.Empty:
+                for model in race.on_deadline():
+                    attempts.pop(model).stop()
+                if race.pending:
+                    start_next()
+                continue
+            if model not in attempts:
+                continue  # Late output from an abandoned attempt
+            if kind == 'token':
+                winner = model
+                for loser in race.on_first_token(model):
+                    attempts.pop(loser).stop()
+                yield value
+            else:
+                attempts.pop(model)
+                race.on_failure(model, value if kind == 'error' else 'empty response')
+                if race.pending:
+                    start_next()
+                elif not attempts:
+                    raise OpenRouterError(f"All models failed: {', '.join(models)}")
+
+        while True:
+            model, kind, value = events.get()
+            if model != winner:
+                continue
+            if kind == 'token':
+                yield value
+            elif kind == 'error':
+                raise OpenRouterError(f"{winner} failed mid-stream: {value}")
+            else:
+                return
+    finally:
+        for attempt in attempts.values():
+            attempt.stop()
+
+
+async def aroute_stream(client, messages, models, params, ttft_timeout=None, hedge_delay=None):
+    """
+    asyncio counterpart of route_stream for an AsyncOpenRouterClient. Losing
+    attempts are cancelled, which closes their upstream responses at once.
+    """
+    events = asyncio.Queue()
+    race = _Race(models, ttft_timeout, hedge_delay)
+    tasks = {}
+    winner = None
+
+    async def pump(model):
+        try:
+            async for token in client.stream_chat(messages, model, **params):
+                await events.put((model, 'token', token))
+            await events.put((model, 'done', None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await events.put((model, 'error', e))
+
+    def start_next():
+        model = race.next_model()
+        tasks[model] = asyncio.ensure_future(pump(model))
+
+    try:
+        start_next()
+        while winner is None:
+            try:
+                model, kind, value = await asyncio.wait_for(events.get(), race.timeout())
+            except asyncio.TimeoutError:
+                for model in race.on_deadline():
+                    tasks.pop(model).cancel()
+                if race.pending:
+                    start_next()
+                continue
+            if model not in tasks:
+                continue
+            if kind == 'token':
+                winner = model
+                for loser in race.on_first_token(model):
+                    tasks.pop(loser).cancel()
+                yield value
+            else:
+                tasks.pop(model)
+                race.on_failure(model, value if kind == 'error' else 'empty response')
+                if race.pending:
+                    start_next()
+                elif not tasks:
+                    raise OpenRouterError(f"All models failed: {', '.join(models)}")
+
+        while True:
+            model, kind, value = await events.get()
+            if model != winner:
+                continue
+            if kind == 'token':
+                yield value
+            elif kind == 'error':
+                raise OpenRouterError(f"{winner} failed mid-stream: {value}")
+            else:
+                return
+    finally:
+        for task in tasks.values():
+            task.cancel()
@@ -1,9 +1,12 @@
 from datetime import datetime
+from sqlalchemy.orm import object_session
 from extensions import db
 
 class User(db.Model):
     __tablename__ = 'users'
     id = db.Column(db.String(255), primary_key=True)
+    # Subset of the Auth0 userinfo (session_store.PROFILE_FIELDS), cached in Redis per request
+    profile = db.Column(db.JSON, nullable=True)
     characters = db.relationship('Character', backref='owner', lazy=True, cascade="all, delete-orphan")
     conversations = db.relationship('Conversation', backref='user', lazy=True, cascade="all, delete-orphan")
 
@@ -14,22 +17,100 @@ class Character(db.Model):
     description = db.Column(db.Text, nullable=False)
     attributes = db.Column(db.JSON, nullable=False)
     avatar = db.Column(db.String(255), nullable=True)
+    # Processed WebP variants, {"<size>": "processed/<hash>.webp"}; None for built-in avatars
+    avatar_variants = db.Column(db.JSON, nullable=True)
+    # Generation settings; None uses DEFAULT_MODEL and the configured defaults
+    model = db.Column(db.String(100), nullable=True)
+    temperature = db.Column(db.Float, nullable=True)
+    max_tokens = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     user_id = db.Column(db.String(255), db.ForeignKey('users.id'), nullable=False)
     conversations = db.relationship('Conversation', backref='character', lazy=True, cascade="all, delete-orphan")
 
+    __table_args__ = (
+        db.Index('ix_characters_user_id_id', 'user_id', 'id'),
+    )
+
 class Conversation(db.Model):
     __tablename__ = 'conversations'
     id = db.Column(db.Integer, primary_key=True)
     character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=False)
     user_id = db.Column(db.String(255), db.ForeignKey('users.id'), nullable=False)
-    messages = db.Column(db.JSON, nullable=False, default=list)
+    # Number of messages appended so far; also the next sequence number to hand out
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    # Rolling summary of every message with seq below summary_seq
+    summary = db.Column(db.Text, nullable=True)
+    summary_seq = db.Column(db.Integer, nullable=False, default=0)
+    # Set while older messages are moved to conversation_archives; see archive.py
+    archived_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    messages = db.relationship('Message', backref='conversation', lazy='dynamic',
+                               cascade="all, delete-orphan", order_by='Message.seq')
+    archive = db.relationship('ConversationArchive', uselist=False, cascade="all, delete-orphan")
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'character_id', name='uq_conversations_user_character'),
+        db.Index('ix_conversations_character_id', 'character_id'),
+        db.Index('ix_conversations_updated_at', 'updated_at'),
+    )
+
+    def add_message(self, role, content, complete=True):
+        """
+        Appends a message in the session that owns this conversation (the Flask
+        session or a worker session) without committing; the caller commits.
+        """
+        session = object_session(self) or db.session
+        # Reserve the next sequence number with a single atomic UPDATE instead of
+        # rewriting the whole history, so appends cost the same at any length.
+        seq = session.execute(
+            db.update(Conversation)
+            .where(Conversation.id == self.id)
+            .values(message_count=Conversation.message_count + 1,
+                    updated_at=datetime.utcnow())
+            .returning(Conversation.message_count)
+        ).scalar_one() - 1
+        message = Message(conversation_id=self.id, seq=seq, role=role, content=content, complete=complete)
+        session.add(message)
+        return message
+
+    def recent_messages(self, limit, before=None):
+        """
+        Returns up to `limit` messages newest-first, optionally only those with
+        a sequence number below the `before` cursor.
+        """
+        query = Message.query.filter(Message.conversation_id == self.id)
+        if before is not None:
+            query = query.filter(Message.seq < before)
+        return query.order_by(Message.seq.desc()).limit(limit).all()
+
+class Message(db.Model):
+    __tablename__ = 'messages'
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id', ondelete='CASCADE'), nullable=False)
+    seq = db.Column(db.Integer, nullable=False)
+    role = db.Column(db.String(20), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    # False while a reply is still streaming; content then holds the last checkpoint
+    complete = db.Column(db.Boolean, nullable=False, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('conversation_id', 'seq', name='uq_messages_conversation_seq'),
+    )
+
+    def to_dict(self):
+        return {'seq': self.seq, 'role': self.role, 'content': self.content, 'complete': self.complete}
 
-    def add_message(self, role, content):
-        if not self.messages:
-            self.messages = []
-        self.messages.append({'role': role, 'content': content})
-        db.session.commit()
\ No newline at end of file
+class ConversationArchive(db.Model):
+    __tablename__ = 'conversation_archives'
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversations.id', ondelete='CASCADE'), primary_key=True)
+    # 'zstd' or 'zlib', whichever was available when the archive was written
+    codec = db.Column(db.String(16), nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    raw_bytes = db.Column(db.Integer, nullable=False)
+    stored_bytes = db.Column(db.Integer, nullable=False)
+    # Deferred so cascading deletes and stats queries never load the blob
+    data = db.deferred(db.Column(db.LargeBinary, nullable=False))
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
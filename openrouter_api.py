@@ -1,47 +1,69 @@
 import os
+import logging
 import requests
-import json
+from openrouter_client import OpenRouterError, get_client
+
+# Configure logging
+logger = logging.getLogger(__name__)
 
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+DEFAULT_MODEL = "openai/gpt-3.5-turbo"
+FALLBACK_RESPONSE = "I'm sorry, I'm having trouble responding right now. Please try again later."
 
-def generate_character_response(character, user_message):
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
+def build_system_prompt(character):
     system_prompt = f"You are roleplaying as {character.name}. Here's your character description: {character.description}"
     for key, value in character.attributes.items():
         system_prompt += f"\n{key.capitalize()}: {value}"
+    return system_prompt
+
+def build_messages(system_prompt, user_message, history=None):
+    # history holds earlier turns (and any rolling summary) chosen by context_builder
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(history or [])
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+def generate_character_response(character, user_message, history=None, system_prompt=None, model=DEFAULT_MODEL,
+                                messages=None, models=None, hedge_delay=None, **params):
+    # character may be None when a precompiled system_prompt or full messages list is passed in
+    if messages is None:
+        if system_prompt is None:
+            system_prompt = build_system_prompt(character)
+        messages = build_messages(system_prompt, user_message, history)
     
-    data = {
-        "model": "openai/gpt-3.5-turbo",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message}
-        ],
-        "stream": True
-    }
-    
     try:
-        response = requests.post(OPENROUTER_API_URL, headers=headers, json=data, stream=True)
-        response.raise_for_status()
-        
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    json_str = line[6:]
-                    if json_str != '[DONE]':
-                        try:
-                            chunk = json.loads(json_str)
-                            if 'choices' in chunk and len(chunk['choices']) > 0:
-                                token = chunk['choices'][0]['delta'].get('content', '')
-                                if token:
-                                    yield token
-                        except json.JSONDecodeError:
-                            print(f"Error decoding JSON: {json_str}")
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling OpenRouter API: {e}")
-        yield "I'm sorry, I'm having trouble responding right now. Please try again later."
\ No newline at end of file
+        # Reuses the worker's pooled keep-alive connection to OpenRouter
+        if models and len(models) > 1:
+            # Several candidates: fail over (or hedge) between them by time to first token
+            from model_router import route_stream
+            stream = route_stream(get_client(), messages, models, params, hedge_delay=hedge_delay)
+        else:
+            # A single candidate streams directly, without the router's reader thread
+            stream = get_client().stream_chat(messages, model=models[0] if models else model, **params)
+        try:
+            for token in stream:
+                yield token
+        finally:
+            stream.close()
+    except (requests.exceptions.RequestException, OpenRouterError) as e:
+        logger.exception(f"Error calling OpenRouter API: {e}")
+        yield FALLBACK_RESPONSE
+
+
+async def agenerate_character_response(client, messages, model=DEFAULT_MODEL, models=None, hedge_delay=None, **params):
+    # asyncio counterpart used by async_worker; client is an AsyncOpenRouterClient
+    import httpx
+    if models and len(models) > 1:
+        from model_router import aroute_stream
+        stream = aroute_stream(client, messages, models, params, hedge_delay=hedge_delay)
+    else:
+        stream = client.stream_chat(messages, model=models[0] if models else model, **params)
+    try:
+        async for token in stream:
+            yield token
+    except (httpx.HTTPError, OpenRouterError) as e:
+        logger.exception(f"Error calling OpenRouter API: {e}")
+        yield FALLBACK_RESPONSE
+    finally:
+        await stream.aclose()
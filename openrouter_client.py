@@ -0,0 +1,222 @@
+# openrouter_client.py
+
+import json
+import logging
+import os
+import random
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app, has_app_context
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class OpenRouterError(Exception):
+    """Raised when OpenRouter keeps failing after all retries."""
+
+
+def parse_sse_line(line):
+    """
+    Parses one line of an OpenRouter SSE stream.
+    Returns the content token, '' for lines without content, or None on [DONE].
+    """
+    if not line.startswith('data: '):
+        return ''
+    json_str = line[6:]
+    if json_str == '[DONE]':
+        return None
+    try:
+        chunk = json.loads(json_str)
+    except json.JSONDecodeError:
+        logger.warning(f"Error decoding JSON: {json_str}")
+        return ''
+    if 'choices' in chunk and len(chunk['choices']) > 0:
+        return chunk['choices'][0].get('delta', {}).get('content', '') or ''
+    return ''
+
+
+def _backoff_delay(attempt, response, base):
+    # Honour Retry-After when the server sends one, otherwise exponential backoff with jitter
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return base * (2 ** attempt) + random.uniform(0, base)
+
+
+class OpenRouterClient:
+    """
+    Blocking OpenRouter client backed by a pooled keep-alive requests.Session.
+    One instance is shared by every task in a worker process.
+    """
+
+    def __init__(self, api_key=None, api_url=DEFAULT_API_URL, connect_timeout=5.0,
+                 read_timeout=60.0, max_retries=3, backoff=0.5, pool_size=10):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        })
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            api_key=config.get('OPENROUTER_API_KEY'),
+            api_url=config.get('OPENROUTER_API_URL', DEFAULT_API_URL),
+            connect_timeout=config.get('OPENROUTER_CONNECT_TIMEOUT', 5.0),
+            read_timeout=config.get('OPENROUTER_READ_TIMEOUT', 60.0),
+            max_retries=config.get('OPENROUTER_MAX_RETRIES', 3),
+            backoff=config.get('OPENROUTER_RETRY_BACKOFF', 0.5),
+            pool_size=config.get('OPENROUTER_POOL_SIZE', 10),
+        )
+
+    def _open_stream(self, payload):
+        # Retries only happen before the first byte of the stream is consumed
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.post(self.api_url, json=payload, stream=True, timeout=self.timeout)
+                if response.status_code not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    return response
+                response.close()
+                error = requests.exceptions.HTTPError(f"{response.status_code} from OpenRouter", response=response)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                error = e
+            if attempt == self.max_retries:
+                raise OpenRouterError(f"OpenRouter request failed after {attempt + 1} attempts: {error}")
+            delay = _backoff_delay(attempt, response, self.backoff)
+            logger.warning(f"OpenRouter request failed ({error}), retrying in {delay:.2f}s")
+            time.sleep(delay)
+
+    def stream_chat(self, messages, model, **params):
+        """
+        Yields content tokens for a streamed chat completion.
+        """
+        payload = dict(params, model=model, messages=messages, stream=True)
+        response = self._open_stream(payload)
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                token = parse_sse_line(line)
+                if token is None:
+                    break
+                if token:
+                    yield token
+        finally:
+            response.close()
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncOpenRouterClient:
+    """
+    asyncio OpenRouter client on httpx, able to multiplex many concurrent
+    streaming completions over one connection pool.
+    """
+
+    def __init__(self, api_key=None, api_url=DEFAULT_API_URL, connect_timeout=5.0,
+                 read_timeout=60.0, max_retries=3, backoff=0.5, pool_size=100):
+        import httpx
+
+        self.api_url = api_url
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.client = httpx.AsyncClient(
+            headers={
+                "Authorization": f"Bearer {api_key}",
+                "Content-Type": "application/json"
+            },
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            api_key=config.get('OPENROUTER_API_KEY'),
+            api_url=config.get('OPENROUTER_API_URL', DEFAULT_API_URL),
+            connect_timeout=config.get('OPENROUTER_CONNECT_TIMEOUT', 5.0),
+            read_timeout=config.get('OPENROUTER_READ_TIMEOUT', 60.0),
+            max_retries=config.get('OPENROUTER_MAX_RETRIES', 3),
+            backoff=config.get('OPENROUTER_RETRY_BACKOFF', 0.5),
+            pool_size=config.get('OPENROUTER_ASYNC_POOL_SIZE', 100),
+        )
+
+    async def stream_chat(self, messages, model, **params):
+        """
+        Async generator yielding content tokens for a streamed chat completion.
+        """
+        import asyncio
+        import httpx
+
+        payload = dict(params, model=model, messages=messages, stream=True)
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                request = self.client.build_request('POST', self.api_url, json=payload)
+                response = await self.client.send(request, stream=True)
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                await response.aclose()
+                error = httpx.HTTPStatusError(f"{response.status_code} from OpenRouter",
+                                              request=request, response=response)
+            except (httpx.ConnectError, httpx.TimeoutException) as e:
+                error = e
+            if attempt == self.max_retries:
+                raise OpenRouterError(f"OpenRouter request failed after {attempt + 1} attempts: {error}")
+            delay = _backoff_delay(attempt, response, self.backoff)
+            logger.warning(f"OpenRouter request failed ({error}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+        try:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                token = parse_sse_line(line)
+                if token is None:
+                    break
+                if token:
+                    yield token
+        finally:
+            await response.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# Process-wide client; recreated after fork so children never share sockets
+_client = None
+_client_pid = None
+
+
+def get_client():
+    """
+    Returns the shared blocking client for this process.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        if has_app_context():
+            _client = OpenRouterClient.from_config(current_app.config)
+        else:
+            _client = OpenRouterClient(api_key=os.environ.get("OPENROUTER_API_KEY"))
+        _client_pid = os.getpid()
+    return _client
@@ -0,0 +1,150 @@
+# prompt_cache.py
+
+import json
+import logging
+import threading
+from collections import OrderedDict
+import redis
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from extensions import db, get_redis
+from models import Character
+from openrouter_api import build_system_prompt
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'character_prompt:'
+REDIS_TTL = 24 * 60 * 60
+LOCAL_CACHE_SIZE = 1024
+
+# Generation settings compiled alongside the prompt, so a reply needs no Character query
+SETTINGS_FIELDS = ('model', 'temperature', 'max_tokens')
+
+# In-process LRU tier of {'prompt', 'settings'} keyed by (character id, version)
+_local = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _version(character):
+    return character.updated_at.isoformat() if character.updated_at else '0'
+
+
+def _local_get(key):
+    with _local_lock:
+        compiled = _local.get(key)
+        if compiled is not None:
+            _local.move_to_end(key)
+        return compiled
+
+
+def _local_put(key, compiled):
+    with _local_lock:
+        _local[key] = compiled
+        _local.move_to_end(key)
+        while len(_local) > LOCAL_CACHE_SIZE:
+            _local.popitem(last=False)
+
+
+def _compile(character):
+    return {
+        'prompt': build_system_prompt(character),
+        'settings': {field: getattr(character, field) for field in SETTINGS_FIELDS},
+    }
+
+
+def cache_character(character):
+    """
+    Compiles the character's system prompt and generation settings and stores
+    them in both cache tiers. Returns {'prompt', 'settings'}.
+    """
+    compiled = _compile(character)
+    version = _version(character)
+    _local_put((character.id, version), compiled)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hset(f'{KEY_PREFIX}{character.id}', mapping={
+            'version': version, 'prompt': compiled['prompt'], 'settings': json.dumps(compiled['settings']),
+        })
+        pipe.expire(f'{KEY_PREFIX}{character.id}', REDIS_TTL)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache prompt for character {character.id}: {e}")
+    return compiled
+
+
+def cache_prompt(character):
+    """
+    Compiles the character's system prompt and stores it in both cache tiers.
+    """
+    return cache_character(character)['prompt']
+
+
+def get_compiled_character(character_id, session=None):
+    """
+    Returns {'prompt', 'settings'} for a character, or None if it does not exist.
+    Only the current version is looked up in Redis; the body comes from the
+    in-process LRU when possible, and the database is hit only on a miss.
+    """
+    key = f'{KEY_PREFIX}{character_id}'
+    try:
+        version = get_redis().hget(key, 'version')
+        if version is not None:
+            version = version.decode()
+            compiled = _local_get((character_id, version))
+            if compiled is None:
+                prompt, settings = get_redis().hmget(key, 'prompt', 'settings')
+                # Entries written before settings were cached are rebuilt below
+                if prompt is not None and settings is not None:
+                    compiled = {'prompt': prompt.decode(), 'settings': json.loads(settings)}
+                    _local_put((character_id, version), compiled)
+            if compiled is not None:
+                return compiled
+    except redis.RedisError as e:
+        logger.warning(f"Prompt cache unavailable, falling back to the database: {e}")
+
+    character = (session or db.session).query(Character).get(character_id)
+    if character is None:
+        return None
+    return cache_character(character)
+
+
+def get_system_prompt(character_id, session=None):
+    """
+    Returns the compiled system prompt for a character, or None if it does not exist.
+    """
+    compiled = get_compiled_character(character_id, session)
+    return compiled['prompt'] if compiled is not None else None
+
+
+def invalidate(character_id):
+    """
+    Drops the cached prompt and settings so the next lookup rebuilds them
+    from the database.
+    """
+    try:
+        get_redis().delete(f'{KEY_PREFIX}{character_id}')
+    except redis.RedisError as e:
+        logger.warning(f"Failed to invalidate prompt for character {character_id}: {e}")
+
+
+# Invalidate after commit rather than at flush time so a concurrent reader
+# cannot repopulate the cache from the row that is about to be replaced.
+@event.listens_for(Session, 'after_flush')
+def _collect_changed_characters(session, flush_context):
+    changed = session.info.setdefault('changed_characters', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Character):
+            changed.add(obj.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_characters(session):
+    for character_id in session.info.pop('changed_characters', ()):
+        invalidate(character_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_characters(session):
+    session.info.pop('changed_characters', None)
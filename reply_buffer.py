@@ -0,0 +1,227 @@
+# reply_buffer.py
+
+import logging
+import time
+import redis
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+STREAM_KEY_PREFIX = 'generation:stream:'
+CURRENT_KEY_PREFIX = 'generation:current:'
+CANCEL_KEY_PREFIX = 'generation:cancel:'
+STARTED_KEY_PREFIX = 'generation:started:'
+# Only the newest reply of a conversation is ever followed
+STARTED_MAXLEN = 16
+
+
+def stream_key(message_id):
+    return f'{STREAM_KEY_PREFIX}{message_id}'
+
+
+def current_key(conversation_id):
+    return f'{CURRENT_KEY_PREFIX}{conversation_id}'
+
+
+def cancel_key(message_id):
+    return f'{CANCEL_KEY_PREFIX}{message_id}'
+
+
+def started_key(conversation_id):
+    return f'{STARTED_KEY_PREFIX}{conversation_id}'
+
+
+class ReplyBuffer:
+    """
+    Mirrors a streamed reply into a Redis Stream, one entry per flushed chunk,
+    so a reconnecting client can catch up from any offset. Redis failures
+    disable the buffer instead of failing the generation.
+    """
+
+    def __init__(self, client, conversation_id, message_id, ttl=3600):
+        self.client = client
+        self.conversation_id = conversation_id
+        self.message_id = message_id
+        self.key = stream_key(message_id)
+        self.ttl = ttl
+        self.enabled = True
+
+    def _run(self, action):
+        if not self.enabled:
+            return
+        try:
+            action()
+        except redis.RedisError as e:
+            logger.warning(f"Reply buffer for message {self.message_id} disabled: {e}")
+            self.enabled = False
+
+    def start(self):
+        def action():
+            pipe = self.client.pipeline()
+            pipe.delete(self.key)
+            pipe.set(current_key(self.conversation_id), self.message_id, ex=self.ttl)
+            # Wakes SSE followers of the conversation blocked in follow_conversation
+            pipe.xadd(started_key(self.conversation_id), {'message_id': self.message_id},
+                      maxlen=STARTED_MAXLEN, approximate=True)
+            pipe.expire(started_key(self.conversation_id), self.ttl)
+            pipe.execute()
+        self._run(action)
+
+    def append(self, chunk, offset):
+        def action():
+            pipe = self.client.pipeline(transaction=False)
+            pipe.xadd(self.key, {'chunk': chunk, 'offset': offset})
+            pipe.expire(self.key, self.ttl)
+            pipe.execute()
+        self._run(action)
+
+    def cancel_requested(self):
+        """
+        True once request_cancel has flagged this reply. Redis errors read as
+        not cancelled so an outage never stops generations.
+        """
+        try:
+            return bool(self.client.exists(cancel_key(self.message_id)))
+        except redis.RedisError as e:
+            logger.warning(f"Cancel check for message {self.message_id} failed: {e}")
+            return False
+
+    def finish(self, status='done'):
+        def action():
+            pipe = self.client.pipeline()
+            pipe.xadd(self.key, {'done': status})
+            pipe.expire(self.key, self.ttl)
+            pipe.delete(current_key(self.conversation_id))
+            pipe.execute()
+        self._run(action)
+
+
+def current_generation(client, conversation_id):
+    """
+    Returns the id of the message currently being streamed for a conversation, or None.
+    """
+    message_id = client.get(current_key(conversation_id))
+    return int(message_id) if message_id is not None else None
+
+
+def request_cancel(client, conversation_id, ttl=3600):
+    """
+    Flags the reply currently streaming for a conversation so its worker
+    stops at the next check. Returns the message id, or None when nothing
+    is streaming.
+    """
+    message_id = current_generation(client, conversation_id)
+    if message_id is None:
+        return None
+    client.set(cancel_key(message_id), 1, ex=ttl)
+    return message_id
+
+
+def read_reply(client, message_id, offset=0):
+    """
+    Returns (text after offset, end offset, status) from a reply's stream.
+    status is None while the reply is still streaming. Returns None when the
+    stream has expired or never existed.
+    """
+    entries = client.xrange(stream_key(message_id))
+    if not entries:
+        return None
+
+    parts = []
+    end = offset
+    status = None
+    for _, fields in entries:
+        if b'done' in fields:
+            status = fields[b'done'].decode()
+            continue
+        chunk = fields[b'chunk'].decode('utf-8')
+        chunk_offset = int(fields[b'offset'])
+        chunk_end = chunk_offset + len(chunk)
+        if chunk_end <= offset:
+            continue
+        parts.append(chunk[max(0, offset - chunk_offset):])
+        end = chunk_end
+    return ''.join(parts), end, status
+
+
+def parse_event_id(event_id):
+    """
+    Splits a follow_conversation event id, '<message id>:<stream entry id>',
+    as sent back in Last-Event-ID. Returns (None, None) when it is malformed.
+    """
+    message_id, _, entry_id = (event_id or '').partition(':')
+    if not message_id.isdigit() or not entry_id:
+        return None, None
+    return int(message_id), entry_id
+
+
+def follow_conversation(client, conversation_id, message_id=None, entry_id='0', block_ms=15000, duration=300):
+    """
+    Yields (event, message_id, entry_id, data) for the replies of a
+    conversation as they are streamed, for duration seconds:
+
+    - ('start', id, None, {}) when a new reply begins
+    - ('chunk', id, entry_id, {'chunk', 'offset'}) for each buffered chunk
+    - ('done', id, entry_id, {'status'}) when a reply finishes
+    - ('gone', id, None, {}) when a resumed reply's stream has expired
+    - ('cursor', id, '$', None) to resume after an already finished reply
+    - None every block_ms without activity, for keep-alives
+
+    Pass message_id and entry_id from a previous event to resume after it.
+    Without them, a reply still in progress is replayed from its start.
+    One blocking XREAD covers both the followed reply and the conversation's
+    started stream, so new replies are picked up without polling.
+    """
+    deadline = time.monotonic() + duration
+    started = started_key(conversation_id)
+    latest = client.xrevrange(started, count=1)
+    started_cursor = latest[0][0] if latest else '0-0'
+
+    if message_id is None:
+        if latest:
+            newest = int(latest[0][1][b'message_id'])
+            if current_generation(client, conversation_id) == newest:
+                message_id, entry_id = newest, '0'
+                yield 'start', message_id, None, {}
+            else:
+                # A finished reply is already in the conversation history; a
+                # reconnect should resume after it rather than replay it
+                yield 'cursor', newest, '$', None
+    elif latest and int(latest[0][1][b'message_id']) > message_id:
+        # Superseded while the client was away; replay the newer reply instead
+        message_id, entry_id = int(latest[0][1][b'message_id']), '0'
+        yield 'start', message_id, None, {}
+    elif not client.exists(stream_key(message_id)):
+        yield 'gone', message_id, None, {}
+        message_id = None
+
+    while time.monotonic() < deadline:
+        streams = {started: started_cursor}
+        if message_id is not None:
+            streams[stream_key(message_id)] = entry_id
+        result = client.xread(streams, count=100, block=block_ms)
+        if not result:
+            yield None
+            continue
+
+        newest = None
+        for key, entries in result:
+            if isinstance(key, bytes):
+                key = key.decode()
+            if key == started:
+                started_cursor = entries[-1][0]
+                newest = int(entries[-1][1][b'message_id'])
+                continue
+            for entry, fields in entries:
+                entry_id = entry.decode() if isinstance(entry, bytes) else entry
+                if b'done' in fields:
+                    yield 'done', message_id, entry_id, {'status': fields[b'done'].decode()}
+                    message_id = None
+                    break
+                yield 'chunk', message_id, entry_id, {'chunk': fields[b'chunk'].decode('utf-8'),
+                                                      'offset': int(fields[b'offset'])}
+
+        # A newer reply supersedes the one being followed
+        if newest is not None and (message_id is None or newest > message_id):
+            message_id, entry_id = newest, '0'
+            yield 'start', message_id, None, {}
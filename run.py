@@ -1,5 +1,7 @@
 # app/run.py
 
+import sys
+import click
 from app import create_app, db, socketio
 from flask_migrate import Migrate
 from flask.cli import FlaskGroup
@@ -7,7 +9,75 @@ from flask.cli import FlaskGroup
 app = create_app()
 migrate = Migrate(app, db)
 
-cli = FlaskGroup(create_app=create_app)
+# CLI commands reuse the app built above instead of building a second one
+cli = FlaskGroup(create_app=lambda: app)
+
+
+@cli.command('export-data')
+@click.option('--user', 'user_id', help='Only export this user\'s characters and conversations.')
+@click.option('--output', type=click.File('w'), default='-', help='Output file (default: stdout).')
+def export_data(user_id, output):
+    """Export characters and conversations as NDJSON."""
+    from transfer import export_records, to_ndjson
+    for line in to_ndjson(export_records(db.session, user_id=user_id)):
+        output.write(line)
+
+
+@cli.command('import-data')
+@click.argument('source', type=click.File('r'), default='-')
+@click.option('--user', 'owner_id', help='Assign everything imported to this existing user.')
+@click.option('--batch-size', type=int, default=1000, show_default=True)
+def import_data(source, owner_id, batch_size):
+    """Import an NDJSON export, assigning new ids."""
+    from transfer import TransferError, import_lines
+    try:
+        counts, errors = import_lines(db.session, source, owner_id=owner_id, batch_size=batch_size)
+    except TransferError as e:
+        raise click.ClickException(str(e))
+    for error in errors:
+        click.echo(f'Rejected: {error}', err=True)
+    click.echo(', '.join(f'{kind}: {count}' for kind, count in counts.items()), err=True)
+
+
+@cli.command('build-assets')
+def build_assets():
+    """Fingerprint and precompress static files for long-lived caching."""
+    from flask import current_app
+    from assets import build_assets as build
+    manifest = build(current_app.static_folder)
+    click.echo(f'Built {len(manifest)} assets into {current_app.static_folder}', err=True)
+
+
+@cli.command('archive-idle')
+@click.option('--days', type=int, default=None, help='Idle threshold (default: ARCHIVE_IDLE_DAYS).')
+@click.option('--batch-size', type=int, default=None, help='Conversations per run (default: ARCHIVE_BATCH_SIZE).')
+def archive_idle(days, batch_size):
+    """Archive idle conversations now instead of waiting for Celery beat."""
+    from flask import current_app
+    from archive import archive_idle_conversations
+    config = current_app.config
+    archived, saved = archive_idle_conversations(
+        db.session, days if days is not None else config['ARCHIVE_IDLE_DAYS'],
+        batch_size=batch_size or config['ARCHIVE_BATCH_SIZE'],
+        keep_recent=config['ARCHIVE_KEEP_RECENT'], level=config['ARCHIVE_ZSTD_LEVEL'],
+    )
+    click.echo(f'Archived {archived} conversations, saving {saved} bytes', err=True)
+
+
+@cli.command('rehydrate-all')
+def rehydrate_all():
+    """Restore every archived conversation, e.g. before downgrading the schema."""
+    from archive import rehydrate
+    from models import Conversation
+    conversation_ids = db.session.scalars(
+        db.select(Conversation.id).where(Conversation.archived_at.is_not(None))).all()
+    restored = sum(rehydrate(db.session, conversation_id) for conversation_id in conversation_ids)
+    click.echo(f'Rehydrated {restored} conversations', err=True)
+
 
 if __name__ == '__main__':
-    socketio.run(app, debug=True)
\ No newline at end of file
+    # `python run.py <command>` runs CLI commands; no arguments starts the server
+    if len(sys.argv) > 1:
+        cli()
+    else:
+        socketio.run(app, debug=True)
@@ -0,0 +1,165 @@
+# scheduler.py
+
+import json
+import logging
+import math
+import time
+from collections import namedtuple
+import redis
+from flask import current_app
+
+from extensions import get_redis
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Celery queues in the order workers should drain them
+QUEUE_HIGH = 'generation_high'
+QUEUE_DEFAULT = 'generation'
+QUEUE_LOW = 'generation_low'
+QUEUE_MAINTENANCE = 'maintenance'
+QUEUES = (QUEUE_HIGH, QUEUE_DEFAULT, QUEUE_LOW, QUEUE_MAINTENANCE)
+# Drained strictly in priority order, so maintenance gets its own worker (see celery_worker.py)
+GENERATION_QUEUES = (QUEUE_HIGH, QUEUE_DEFAULT, QUEUE_LOW)
+
+# Redis lists consumed by async_worker, one per generation queue
+ASYNC_QUEUE_PREFIX = 'async:'
+
+INFLIGHT_KEY_PREFIX = 'scheduler:inflight:'
+RATE_KEY_PREFIX = 'scheduler:rate:'
+
+Admission = namedtuple('Admission', ['allowed', 'queue', 'retry_after', 'reason'])
+
+# Takes an in-flight slot and a rate-limit token together, or neither. The
+# in-flight limit is checked first so a user at the limit is not also charged
+# a token for a request that is refused anyway. The bucket refills `rate`
+# tokens per second up to `capacity`. Returns {slots in use, retry_after}:
+# -1 slots when the in-flight limit is hit, 0 when rate limited.
+_ADMIT = """
+local limit = tonumber(ARGV[1])
+local slot_ttl = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local rate = tonumber(ARGV[4])
+local now = tonumber(ARGV[5])
+if tonumber(redis.call('GET', KEYS[1]) or '0') >= limit then
+    return {-1, '0'}
+end
+local state = redis.call('HMGET', KEYS[2], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[2], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[2], math.ceil(capacity / rate) + 1)
+if retry_after > 0 then
+    return {0, tostring(retry_after)}
+end
+local current = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], slot_ttl)
+return {current, '0'}
+"""
+
+_RELEASE_SLOT = """
+local current = redis.call('DECR', KEYS[1])
+if current <= 0 then
+    redis.call('DEL', KEYS[1])
+end
+return current
+"""
+
+def celery_queue_config():
+    """
+    Queue settings applied to the Celery app by make_celery.
+    """
+    from kombu import Queue
+
+    return {
+        'task_queues': [Queue(name) for name in QUEUES],
+        'task_default_queue': QUEUE_DEFAULT,
+        'task_routes': {
+            'tasks.generate_character_response_task': {'queue': QUEUE_DEFAULT},
+            'tasks.summarize_conversation_task': {'queue': QUEUE_MAINTENANCE},
+            'tasks.process_avatar_task': {'queue': QUEUE_MAINTENANCE},
+            'tasks.finalize_stale_replies_task': {'queue': QUEUE_MAINTENANCE},
+            'tasks.archive_idle_conversations_task': {'queue': QUEUE_MAINTENANCE},
+        },
+        # Redis transport: always drain queues in the order above rather than round-robin.
+        # A worker consuming maintenance alongside generation would only reach it when
+        # every generation queue is empty, hence the separate maintenance worker.
+        'broker_transport_options': {'queue_order_strategy': 'priority'},
+    }
+
+
+def queue_depth(queue):
+    """
+    Number of generations waiting in a queue on the Redis broker, for either engine.
+    """
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.llen(queue)
+    pipe.llen(f'{ASYNC_QUEUE_PREFIX}{queue}')
+    return sum(pipe.execute())
+
+
+def enqueue_generation(queue, args, kwargs):
+    """
+    Hands a generation to the engine selected by GENERATION_ENGINE: the Celery
+    task, or a job for async_worker with the same arguments.
+    """
+    if current_app.config['GENERATION_ENGINE'] == 'async':
+        job = json.dumps({'args': list(args), 'kwargs': kwargs})
+        get_redis().rpush(f'{ASYNC_QUEUE_PREFIX}{queue}', job)
+        return
+    from tasks import generate_character_response_task
+    generate_character_response_task.apply_async(args, kwargs, queue=queue)
+
+
+def _retry_after_response(retry_after, reason):
+    metrics.incr('scheduler_rejections_total', reason=reason)
+    return Admission(False, None, max(1, math.ceil(retry_after)), reason)
+
+
+def admit(user_id):
+    """
+    Decides whether a user's generation may be enqueued now and on which queue.
+    On success the user holds an in-flight slot until release_slot is called.
+    Fails open when Redis is unavailable.
+    """
+    config = current_app.config
+    client = get_redis()
+    try:
+        depth = sum(queue_depth(queue) for queue in GENERATION_QUEUES)
+        if depth >= config['GENERATION_QUEUE_MAX_DEPTH']:
+            return _retry_after_response(config['BACKPRESSURE_RETRY_AFTER'], 'queue_depth')
+
+        in_flight, retry_after = client.eval(
+            _ADMIT, 2, f'{INFLIGHT_KEY_PREFIX}{user_id}', f'{RATE_KEY_PREFIX}{user_id}',
+            config['GENERATION_MAX_INFLIGHT_PER_USER'], config['GENERATION_INFLIGHT_TTL'],
+            config['RATE_LIMIT_CAPACITY'], config['RATE_LIMIT_REFILL_PER_SECOND'], time.time()
+        )
+        if in_flight < 0:
+            return _retry_after_response(config['BACKPRESSURE_RETRY_AFTER'], 'in_flight')
+        if in_flight == 0:
+            return _retry_after_response(float(retry_after), 'rate_limit')
+    except redis.RedisError as e:
+        logger.warning(f"Scheduler unavailable, admitting without limits: {e}")
+        return Admission(True, QUEUE_DEFAULT, None, None)
+
+    # A user's first concurrent generation jumps ahead of users already being served
+    queue = QUEUE_HIGH if in_flight == 1 else QUEUE_LOW
+    return Admission(True, queue, None, None)
+
+
+def release_slot(user_id):
+    """
+    Returns a user's in-flight slot once their generation has finished.
+    """
+    try:
+        get_redis().eval(_RELEASE_SLOT, 1, f'{INFLIGHT_KEY_PREFIX}{user_id}')
+    except redis.RedisError as e:
+        logger.warning(f"Failed to release in-flight slot for {user_id}: {e}")
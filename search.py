@@ -0,0 +1,274 @@
+# search.py
+
+"""
+Full-text search over a user's messages and characters.
+
+Each backend answers the same two queries against the indexes created by
+the d4b8f2a61e93 migration: FTS5 tables on SQLite, GIN tsvector indexes on
+PostgreSQL. The database keeps the indexes current on every insert and
+update, so nothing here has to. Message results are newest first and paged
+with a keyset cursor on the message id.
+
+Archived messages (see archive.py) leave the messages table and with it the
+index. They are matched against archived_message_index instead, only the
+archives holding a page's hits are read for snippets, and the results are
+merged in by id, which archiving preserves.
+"""
+
+import logging
+import re
+from sqlalchemy import bindparam, text
+
+from archive import read_archive
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+SNIPPET_WORDS = 12
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def query_terms(query):
+    """
+    Splits user input into plain search terms, dropping query syntax.
+    """
+    return _TERM.findall(query or '')[:16]
+
+
+def _message_result(row):
+    return {
+        'message_id': row.id,
+        'conversation_id': row.conversation_id,
+        'character_id': row.character_id,
+        'character_name': row.character_name,
+        'seq': row.seq,
+        'role': row.role,
+        'snippet': row.snippet,
+        'created_at': row.created_at.isoformat() if hasattr(row.created_at, 'isoformat') else row.created_at,
+    }
+
+
+def _plain_snippet(content, wanted):
+    """
+    Up to SNIPPET_WORDS words around the first match, matches in brackets,
+    in the shape the database snippets use.
+    """
+    words = content.split()
+    marked = [any(token.lower() in wanted for token in _TERM.findall(word)) for word in words]
+    first = marked.index(True) if True in marked else 0
+    start = max(0, min(first - SNIPPET_WORDS // 2, len(words) - SNIPPET_WORDS))
+    window = [f'[{word}]' if hit else word
+              for word, hit in zip(words[start:start + SNIPPET_WORDS], marked[start:start + SNIPPET_WORDS])]
+    return ('…' if start > 0 else '') + ' '.join(window) + ('…' if start + SNIPPET_WORDS < len(words) else '')
+
+
+def _archived_result(row, message, wanted):
+    return {
+        'message_id': message['id'],
+        'conversation_id': row.conversation_id,
+        'character_id': row.character_id,
+        'character_name': row.character_name,
+        'seq': message['seq'],
+        'role': message['role'],
+        'snippet': _plain_snippet(message['content'], wanted),
+        'created_at': message['created_at'],
+    }
+
+
+class SearchBackend:
+    """
+    LIKE scan used on databases without a full-text index.
+    """
+
+    # Column ordering and paging message results; must equal the message id
+    message_key = 'm.id'
+
+    def _match_messages(self, terms):
+        clauses = ' AND '.join(f"m.content LIKE :term{i}" for i in range(len(terms)))
+        params = {f'term{i}': f'%{term}%' for i, term in enumerate(terms)}
+        return 'FROM messages m', clauses, params, 'm.content'
+
+    def _match_characters(self, terms):
+        clauses = ' AND '.join(f"(ch.name LIKE :term{i} OR ch.description LIKE :term{i})"
+                               for i in range(len(terms)))
+        params = {f'term{i}': f'%{term}%' for i, term in enumerate(terms)}
+        return 'FROM characters ch', clauses, params
+
+    def search_messages(self, session, user_id, terms, limit, before=None):
+        source, match, params, snippet = self._match_messages(terms)
+        params = dict(params, user_id=user_id, limit=limit)
+        cursor = ''
+        if before is not None:
+            cursor = f'AND {self.message_key} < :before'
+            params['before'] = before
+        rows = session.execute(text(f"""
+            SELECT m.id, m.conversation_id, m.seq, m.role, m.created_at,
+                   c.character_id, ch.name AS character_name, {snippet} AS snippet
+            {source}
+            JOIN conversations c ON c.id = m.conversation_id
+            JOIN characters ch ON ch.id = c.character_id
+            WHERE {match} AND c.user_id = :user_id {cursor}
+            ORDER BY {self.message_key} DESC
+            LIMIT :limit
+        """), params)
+        return [_message_result(row) for row in rows]
+
+    def _match_archived(self, terms):
+        # No archived message index on other databases; search_archived scans instead
+        return None
+
+    def search_archived(self, session, user_id, terms, limit, before=None):
+        """
+        Archived messages containing every term, newest first. The index finds
+        the page and only the archives holding its hits are decompressed.
+        """
+        wanted = {term.lower() for term in terms}
+        matched = self._match_archived(terms)
+        if matched is None:
+            return self._scan_archives(session, user_id, wanted, limit, before)
+
+        source, match, params, key = matched
+        params = dict(params, user_id=user_id, limit=limit)
+        cursor = ''
+        if before is not None:
+            cursor = f'AND {key} < :before'
+            params['before'] = before
+        hits = session.execute(text(f"""
+            SELECT i.message_id, i.conversation_id, c.character_id, ch.name AS character_name
+            {source}
+            JOIN conversations c ON c.id = i.conversation_id
+            JOIN characters ch ON ch.id = c.character_id
+            WHERE {match} AND c.user_id = :user_id {cursor}
+            ORDER BY {key} DESC
+            LIMIT :limit
+        """), params).all()
+        if not hits:
+            return []
+
+        archives = session.execute(
+            text("SELECT conversation_id, codec, data FROM conversation_archives WHERE conversation_id IN :ids")
+            .bindparams(bindparam('ids', expanding=True)),
+            {'ids': sorted({hit.conversation_id for hit in hits})},
+        )
+        messages = {}
+        for archive in archives:
+            for message in read_archive(archive.codec, archive.data):
+                messages[message['id']] = message
+        # A hit without a message was rehydrated since the index was read; it is live again
+        return [_archived_result(hit, messages[hit.message_id], wanted)
+                for hit in hits if hit.message_id in messages]
+
+    def _scan_archives(self, session, user_id, wanted, limit, before):
+        rows = session.execute(text("""
+            SELECT a.conversation_id, a.codec, a.data, c.character_id, ch.name AS character_name
+            FROM conversation_archives a
+            JOIN conversations c ON c.id = a.conversation_id
+            JOIN characters ch ON ch.id = c.character_id
+            WHERE c.user_id = :user_id
+        """), {'user_id': user_id})
+        results = []
+        for row in rows:
+            for message in read_archive(row.codec, row.data):
+                if before is not None and message['id'] >= before:
+                    continue
+                if wanted <= {token.lower() for token in _TERM.findall(message['content'])}:
+                    results.append(_archived_result(row, message, wanted))
+        results.sort(key=lambda result: result['message_id'], reverse=True)
+        return results[:limit]
+
+    def search_characters(self, session, user_id, terms, limit):
+        source, match, params = self._match_characters(terms)
+        rows = session.execute(text(f"""
+            SELECT ch.id, ch.name, ch.avatar
+            {source}
+            WHERE {match} AND ch.user_id = :user_id
+            ORDER BY ch.id
+            LIMIT :limit
+        """), dict(params, user_id=user_id, limit=limit))
+        return [{'id': row.id, 'name': row.name, 'avatar': row.avatar} for row in rows]
+
+
+class SqliteSearch(SearchBackend):
+    """
+    FTS5 external-content tables messages_fts and characters_fts.
+    """
+
+    # FTS5 walks its index in rowid order, so sorting on it avoids a sort step
+    message_key = 'messages_fts.rowid'
+
+    @staticmethod
+    def _fts_query(terms):
+        # Each term quoted as a phrase so user input is never parsed as FTS5 syntax
+        return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    def _match_messages(self, terms):
+        snippet = f"snippet(messages_fts, 0, '[', ']', '…', {SNIPPET_WORDS})"
+        return ('FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid',
+                'messages_fts MATCH :query', {'query': self._fts_query(terms)}, snippet)
+
+    def _match_characters(self, terms):
+        return ('FROM characters_fts JOIN characters ch ON ch.id = characters_fts.rowid',
+                'characters_fts MATCH :query', {'query': self._fts_query(terms)})
+
+    def _match_archived(self, terms):
+        return ('FROM archived_messages_fts JOIN archived_message_index i ON i.message_id = archived_messages_fts.rowid',
+                'archived_messages_fts MATCH :query', {'query': self._fts_query(terms)}, 'archived_messages_fts.rowid')
+
+
+class PostgresSearch(SearchBackend):
+    """
+    GIN indexes on to_tsvector('english', ...) expressions.
+    """
+
+    def _match_messages(self, terms):
+        snippet = (f"ts_headline('english', m.content, plainto_tsquery('english', :query), "
+                   f"'StartSel=[, StopSel=], MaxWords={SNIPPET_WORDS}, MinWords=4')")
+        return ('FROM messages m',
+                "to_tsvector('english', m.content) @@ plainto_tsquery('english', :query)",
+                {'query': ' '.join(terms)}, snippet)
+
+    def _match_characters(self, terms):
+        return ('FROM characters ch',
+                "to_tsvector('english', ch.name || ' ' || ch.description) @@ plainto_tsquery('english', :query)",
+                {'query': ' '.join(terms)})
+
+    def _match_archived(self, terms):
+        return ('FROM archived_message_index i', "i.terms @@ plainto_tsquery('english', :query)",
+                {'query': ' '.join(terms)}, 'i.message_id')
+
+
+_BACKENDS = {'sqlite': SqliteSearch, 'postgresql': PostgresSearch}
+
+
+def get_backend(session):
+    """
+    Returns the search backend for the session's database.
+    """
+    dialect = session.get_bind().dialect.name
+    return _BACKENDS.get(dialect, SearchBackend)()
+
+
+def search(session, user_id, query, limit=20, before=None):
+    """
+    Searches a user's messages and, on the first page, their characters.
+    Returns the result page with a cursor for the next one.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return {'messages': [], 'characters': [], 'has_more': False, 'next_cursor': None}
+
+    backend = get_backend(session)
+    # Fetch one extra row to know whether an older page exists
+    rows = backend.search_messages(session, user_id, terms, limit + 1, before=before)
+    archived = backend.search_archived(session, user_id, terms, limit + 1, before=before)
+    if archived:
+        rows = sorted(rows + archived, key=lambda row: row['message_id'], reverse=True)[:limit + 1]
+    messages = rows[:limit]
+    has_more = len(rows) > limit
+    characters = backend.search_characters(session, user_id, terms, limit) if before is None else []
+    return {
+        'messages': messages,
+        'characters': characters,
+        'has_more': has_more,
+        'next_cursor': messages[-1]['message_id'] if has_more else None,
+    }
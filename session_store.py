@@ -0,0 +1,155 @@
+# session_store.py
+
+"""
+Redis-backed Flask sessions and the cached user profile.
+
+The cookie carries only a signed session id and user id. Session data
+lives at session:<sid> and the user's profile at user_profile:<user id>,
+and since the cookie names both keys they are fetched in one pipelined
+round trip when the session is opened. The profile is a small subset of
+the Auth0 userinfo, persisted on User.profile and cached in Redis.
+"""
+
+import json
+import logging
+import secrets
+import redis
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.datastructures import CallbackDict
+
+from extensions import db, get_redis
+from models import User
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+PROFILE_KEY_PREFIX = 'user_profile:'
+# Userinfo claims kept for templates; everything else stays with Auth0
+PROFILE_FIELDS = ('sub', 'name', 'nickname', 'email', 'picture')
+
+
+def slim_profile(userinfo):
+    return {field: userinfo[field] for field in PROFILE_FIELDS if field in userinfo}
+
+
+def _profile_key(user_id):
+    return f'{PROFILE_KEY_PREFIX}{user_id}'
+
+
+def cache_profile(client, profile, ttl):
+    try:
+        client.set(_profile_key(profile['sub']), json.dumps(profile), ex=ttl)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to cache profile for {profile['sub']}: {e}")
+
+
+def load_profile(client, user_id, ttl):
+    """
+    Reads a profile from the database after a cache miss and caches it.
+    Returns None for unknown users.
+    """
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    profile = dict(user.profile or {}, sub=user_id)
+    cache_profile(client, profile, ttl)
+    return profile
+
+
+class RedisSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, profile=None):
+        def on_update(self):
+            self.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # Cached profile fetched alongside the session, or None on a miss
+        self.profile = profile
+        self.loaded_user_id = (initial or {}).get('user_id')
+
+
+class RedisSessionInterface(SessionInterface):
+    """
+    Keeps session data in Redis for PERMANENT_SESSION_LIFETIME, written only
+    when modified. A new session id is issued whenever the signed-in user
+    changes, so a session id set before login is never reused after it.
+    """
+
+    def __init__(self, key_prefix='session:'):
+        self.key_prefix = key_prefix
+
+    def _signer(self, app):
+        return URLSafeSerializer(app.secret_key, salt='redis-session')
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if not cookie:
+            return RedisSession(sid=secrets.token_urlsafe(32), new=True)
+        try:
+            sid, user_id = self._signer(app).loads(cookie)
+        except (BadSignature, ValueError):
+            return RedisSession(sid=secrets.token_urlsafe(32), new=True)
+
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            pipe.get(f'{self.key_prefix}{sid}')
+            if user_id:
+                pipe.get(_profile_key(user_id))
+            results = pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"Session store unavailable: {e}")
+            return RedisSession(sid=secrets.token_urlsafe(32), new=True)
+
+        data = results[0]
+        if data is None:
+            # Expired or evicted; the cookie alone never authenticates
+            return RedisSession(sid=secrets.token_urlsafe(32), new=True)
+        data = json.loads(data)
+        profile = None
+        if user_id and user_id == data.get('user_id') and results[1] is not None:
+            profile = json.loads(results[1])
+        return RedisSession(data, sid=sid, profile=profile)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        client = get_redis()
+
+        if not session:
+            if session.modified and not session.new:
+                try:
+                    client.delete(f'{self.key_prefix}{session.sid}')
+                except redis.RedisError as e:
+                    # The entry expires on its own; dropping the cookie still signs the user out
+                    logger.warning(f"Failed to delete session: {e}")
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        user_id = session.get('user_id')
+        rotated = user_id != session.loaded_user_id and not session.new
+        ttl = app.permanent_session_lifetime
+        try:
+            if rotated:
+                client.delete(f'{self.key_prefix}{session.sid}')
+                session.sid = secrets.token_urlsafe(32)
+            client.set(f'{self.key_prefix}{session.sid}', json.dumps(dict(session)), ex=ttl)
+        except redis.RedisError as e:
+            # Keep the response; without a stored session the next request starts a new one
+            logger.warning(f"Session store unavailable, session not saved: {e}")
+            return
+        if session.new or rotated:
+            response.set_cookie(
+                name,
+                self._signer(app).dumps([session.sid, user_id]),
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
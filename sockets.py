@@ -0,0 +1,143 @@
+# sockets.py
+
+import atexit
+import logging
+import os
+import socket as _socket
+import threading
+from flask import request, session
+from flask_socketio import join_room, leave_room
+
+from extensions import socketio
+from models import Character
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Identifies this server process in the published gauges
+SERVER_ID = f'{_socket.gethostname()}:{os.getpid()}'
+
+# Per-process connection and room membership bookkeeping
+_lock = threading.Lock()
+_connections = {}  # sid -> set of joined rooms
+_room_members = {}  # room -> number of local members
+
+
+def chat_room(user_id, character_id):
+    return f"chat_{user_id}_{character_id}"
+
+
+def connection_stats():
+    """
+    Returns the number of connections and occupied rooms on this process.
+    """
+    with _lock:
+        return {'connections': len(_connections), 'rooms': len(_room_members)}
+
+
+def _publish_stats():
+    stats = connection_stats()
+    metrics.set_gauge('socketio_connections', stats['connections'], server=SERVER_ID)
+    metrics.set_gauge('socketio_rooms', stats['rooms'], server=SERVER_ID)
+
+
+def init_app(app):
+    """
+    Removes this process's gauges when it exits, so a stopped server is not
+    reported with its last connection count forever.
+    """
+    def clear_stats():
+        with app.app_context():
+            metrics.clear_gauges(['socketio_connections', 'socketio_rooms'], server=SERVER_ID)
+
+    atexit.register(clear_stats)
+
+
+def _track_join(sid, room):
+    with _lock:
+        rooms = _connections.setdefault(sid, set())
+        if room not in rooms:
+            rooms.add(room)
+            _room_members[room] = _room_members.get(room, 0) + 1
+
+
+def _track_leave(sid, room):
+    with _lock:
+        rooms = _connections.get(sid)
+        if rooms is None or room not in rooms:
+            return
+        rooms.discard(room)
+        _room_members[room] -= 1
+        if _room_members[room] <= 0:
+            del _room_members[room]
+
+
+@socketio.on('connect')
+def handle_connect(auth=None):
+    # The Flask session cookie is sent with the handshake; reject anonymous sockets
+    user_id = session.get('user_id')
+    if not user_id:
+        logger.debug("Rejected unauthenticated Socket.IO connection")
+        return False
+    with _lock:
+        _connections[request.sid] = set()
+    _publish_stats()
+
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    with _lock:
+        rooms = _connections.pop(request.sid, set())
+        for room in rooms:
+            _room_members[room] -= 1
+            if _room_members[room] <= 0:
+                del _room_members[room]
+    _publish_stats()
+
+
+@socketio.on('join')
+def handle_join(data):
+    user_id = session.get('user_id')
+    character_id = (data or {}).get('character_id')
+    if not user_id or not character_id:
+        return {'ok': False, 'error': 'Invalid join request'}
+
+    # Only the character's owner may listen to its chat room
+    owned = Character.query.with_entities(Character.id).filter_by(
+        id=character_id, user_id=user_id
+    ).first()
+    if not owned:
+        return {'ok': False, 'error': 'Character not found'}
+
+    room = chat_room(user_id, character_id)
+    join_room(room)
+    _track_join(request.sid, room)
+    _publish_stats()
+    return {'ok': True}
+
+
+@socketio.on('leave')
+def handle_leave(data):
+    user_id = session.get('user_id')
+    character_id = (data or {}).get('character_id')
+    if not user_id or not character_id:
+        return {'ok': False}
+
+    room = chat_room(user_id, character_id)
+    leave_room(room)
+    _track_leave(request.sid, room)
+    _publish_stats()
+    return {'ok': True}
+
+
+@socketio.on('cancel_generation')
+def handle_cancel_generation(data):
+    user_id = session.get('user_id')
+    character_id = (data or {}).get('character_id')
+    if not user_id or not character_id:
+        return {'ok': False, 'error': 'Invalid cancel request'}
+
+    from generation import cancel_generation
+    message_id = cancel_generation(user_id, character_id)
+    return {'ok': True, 'cancelled': message_id is not None, 'message_id': message_id}
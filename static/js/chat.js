@@ -8,44 +8,96 @@ const toggleButton = document.getElementById('toggle-description');
 const characterInfoModal = document.getElementById('character-info-modal');
 const closeModalButton = document.getElementById('close-modal');
 const typingIndicator = document.getElementById('typing-indicator');
+const stopButton = document.getElementById('stop-generation') || createStopButton();
 
 chatMessages.style.height = 'calc(100vh - 200px)';
 
-// Variables for pagination
-let currentPage = 1;
+// Variables for pagination (keyset cursor = seq of the oldest loaded message)
+let nextCursor = null;
 let hasMore = true;
 
-// Socket.IO connection
-const socket = io({
+// Streamed replies arrive over Socket.IO unless window.streamTransport or ?transport= selects 'sse'
+const streamTransport = new URLSearchParams(location.search).get('transport') || window.streamTransport || 'socketio';
+
+// Socket.IO connection, only for the socketio transport
+const socket = streamTransport === 'socketio' ? io({
     transports: ['websocket'],
     withCredentials: true,
-});
+}) : null;
+
+if (socket) {
+    // Join the chat room, and rejoin after every reconnect
+    let hasConnected = false;
+    socket.on('connect', () => {
+        socket.emit('join', { 'character_id': characterId }, (response) => {
+            if (response && !response.ok) {
+                console.error('Failed to join chat room:', response.error);
+            }
+        });
+        // Chunks emitted while we were disconnected are fetched from the reply buffer
+        if (hasConnected) {
+            resumePartialMessage();
+        }
+        hasConnected = true;
+    });
 
-// Join the chat room
-socket.emit('join', { 'character_id': characterId });
+    // Handle new messages from the server
+    socket.on('new_message', (data) => {
+        addMessage(data.role, data.content);
+    });
 
-// Handle new messages from the server
-socket.on('new_message', (data) => {
-    addMessage(data.role, data.content);
-});
+    // Handle partial AI responses (coalesced chunks of tokens)
+    socket.on('partial_ai_response', (data) => {
+        if (data.chunk === undefined) {
+            addPartialMessage('assistant', data.token);
+        } else {
+            applyPartialChunk(data.chunk, data.offset);
+        }
+    });
 
-// Handle partial AI responses
-socket.on('partial_ai_response', (data) => {
-    addPartialMessage('assistant', data.token);
-});
+    // Handle AI response completion
+    socket.on('ai_response_complete', (data) => {
+        finalizePartialMessage('assistant', data.content);
+        hideTypingIndicator();
+    });
 
-// Handle AI response completion
-socket.on('ai_response_complete', (data) => {
-    finalizePartialMessage('assistant', data.content);
-    hideTypingIndicator();
-});
+    // Handle errors
+    socket.on('error', (data) => {
+        console.error('Socket error:', data.error);
+        addMessage('assistant', 'Sorry, there was an error processing your message. Please try again.');
+        hideTypingIndicator();
+    });
+}
 
-// Handle errors
-socket.on('error', (data) => {
-    console.error('Socket error:', data.error);
-    addMessage('assistant', 'Sorry, there was an error processing your message. Please try again.');
-    hideTypingIndicator();
-});
+// Server-Sent Events from /api/stream/<conversation_id>. EventSource reconnects
+// by itself and sends Last-Event-ID, so the server resumes after the last chunk.
+let conversationId = null;
+let replySource = null;
+
+function openReplyStream(lastEventId = null) {
+    if (streamTransport !== 'sse' || conversationId === null || replySource) return;
+    const query = lastEventId ? `?last_event_id=${encodeURIComponent(lastEventId)}` : '';
+    replySource = new EventSource(`/api/stream/${conversationId}${query}`, { withCredentials: true });
+
+    replySource.addEventListener('start', () => {
+        aiMessageDiv = null;
+        aiReceivedLength = 0;
+        showTypingIndicator();
+    });
+    replySource.addEventListener('chunk', (event) => {
+        const data = JSON.parse(event.data);
+        applyPartialChunk(data.chunk, data.offset);
+    });
+    replySource.addEventListener('done', () => {
+        aiMessageDiv = null;
+        aiReceivedLength = 0;
+        hideTypingIndicator();
+    });
+    // The reply's buffer expired while we were away; the database has the rest
+    replySource.addEventListener('gone', () => {
+        resumePartialMessage();
+    });
+}
 
 // Event listeners for UI elements
 toggleButton.addEventListener('click', () => {
@@ -90,10 +142,52 @@ function addMessage(role, content, prepend = false) {
     }
 }
 
-// Variables to handle partial AI messages
+// Variables to handle partial AI messages. Offsets count code points, matching the server.
 let aiMessageDiv = null;
+let aiReceivedLength = 0;
+let resumeInFlight = false;
+
+function applyPartialChunk(chunk, offset) {
+    const codePoints = Array.from(chunk);
+    if (offset + codePoints.length <= aiReceivedLength) {
+        return; // Already rendered, e.g. delivered again after a resume
+    }
+    if (offset > aiReceivedLength) {
+        resumePartialMessage(); // Missed chunks; fetch everything after what we have
+        return;
+    }
+    addPartialMessage('assistant', codePoints.slice(aiReceivedLength - offset).join(''));
+}
+
+// Fetch the part of the in-progress reply we have not rendered yet
+async function resumePartialMessage() {
+    if (resumeInFlight) return;
+    resumeInFlight = true;
+    try {
+        const response = await fetch(`/api/resume_generation/${characterId}?offset=${aiReceivedLength}`, {
+            method: 'GET',
+            credentials: 'include',
+        });
+        if (!response.ok) return;
 
-function addPartialMessage(role, token) {
+        const data = await response.json();
+        if (data.content) {
+            addPartialMessage('assistant', data.content);
+        }
+        if (data.status) {
+            // The reply finished while we were away
+            aiMessageDiv = null;
+            aiReceivedLength = 0;
+            hideTypingIndicator();
+        }
+    } catch (error) {
+        console.error('Error resuming reply:', error);
+    } finally {
+        resumeInFlight = false;
+    }
+}
+
+function addPartialMessage(role, chunk) {
     if (!aiMessageDiv) {
         aiMessageDiv = document.createElement('div');
         aiMessageDiv.className = `message ${role} flex items-start mb-4`;
@@ -114,7 +208,8 @@ function addPartialMessage(role, token) {
     }
 
     const contentParagraph = aiMessageDiv.querySelector('p');
-    contentParagraph.innerHTML += token;
+    contentParagraph.innerHTML += chunk;
+    aiReceivedLength += Array.from(chunk).length;
     chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
@@ -123,21 +218,58 @@ function finalizePartialMessage(role, fullContent) {
         const contentParagraph = aiMessageDiv.querySelector('p');
         contentParagraph.innerHTML = fullContent;
         aiMessageDiv = null;
+        aiReceivedLength = 0;
     } else {
         addMessage(role, fullContent);
     }
 }
 
-// Show and hide typing indicator
+// Show and hide typing indicator, together with the stop button
 function showTypingIndicator() {
     typingIndicator.classList.remove('hidden');
+    stopButton.classList.remove('hidden');
+    stopButton.disabled = false;
     chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
 function hideTypingIndicator() {
     typingIndicator.classList.add('hidden');
+    stopButton.classList.add('hidden');
+}
+
+// Stop button, added next to the send button when the page does not provide one
+function createStopButton() {
+    const button = document.createElement('button');
+    button.type = 'button';
+    button.id = 'stop-generation';
+    button.textContent = 'Stop';
+    button.className = 'hidden bg-red-600 hover:bg-red-700 text-white rounded-lg px-4 py-2 ml-2';
+    chatForm.appendChild(button);
+    return button;
+}
+
+// Ask the server to stop the reply; the partial reply arrives via ai_response_complete
+async function cancelGeneration() {
+    stopButton.disabled = true;
+    if (socket && socket.connected) {
+        socket.emit('cancel_generation', { 'character_id': characterId });
+        return;
+    }
+    try {
+        await fetch('/api/cancel_generation', {
+            method: 'POST',
+            credentials: 'include',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ 'character_id': characterId }),
+        });
+    } catch (error) {
+        console.error('Error cancelling reply:', error);
+        stopButton.disabled = false;
+    }
 }
 
+stopButton.addEventListener('click', cancelGeneration);
+
 // Load previous conversation messages
 async function loadConversation() {
     try {
@@ -152,15 +284,20 @@ async function loadConversation() {
         }
 
         const data = await response.json();
+        if (data.conversation_id) {
+            conversationId = data.conversation_id;
+            openReplyStream();
+        }
 
         if (data.info) {
             chatMessages.innerHTML = `<p class="text-info">${data.info}</p>`;
         } else if (data.messages && data.messages.length > 0) {
-            data.messages.reverse().forEach((message) => {
+            // Messages arrive newest-first; prepending each keeps the oldest on top
+            data.messages.forEach((message) => {
                 addMessage(message.role, message.content, true);
             });
             hasMore = data.has_more;
-            currentPage++;
+            nextCursor = data.next_cursor;
         } else {
             chatMessages.innerHTML = '<p class="text-info">No previous messages found. Start chatting to begin!</p>';
         }
@@ -172,10 +309,10 @@ async function loadConversation() {
 
 // Load more messages on scroll
 async function loadMoreMessages() {
-    if (!hasMore) return;
+    if (!hasMore || nextCursor === null) return;
 
     try {
-        const response = await fetch(`/api/get_conversation/${characterId}?page=${currentPage}`, {
+        const response = await fetch(`/api/get_conversation/${characterId}?before=${nextCursor}`, {
             method: 'GET',
             credentials: 'include',
         });
@@ -188,12 +325,12 @@ async function loadMoreMessages() {
         const data = await response.json();
 
         if (data.messages && data.messages.length > 0) {
-            data.messages.reverse().forEach((message) => {
+            data.messages.forEach((message) => {
                 addMessage(message.role, message.content, true);
             });
 
             hasMore = data.has_more;
-            currentPage++;
+            nextCursor = data.next_cursor;
         } else {
             hasMore = false;
         }
@@ -212,20 +349,69 @@ chatMessages.addEventListener('scroll', () => {
 // Load initial conversation
 loadConversation();
 
+// Guards against double-submits while a send is in flight
+let sendInFlight = false;
+
 // Send a message
-chatForm.addEventListener('submit', (e) => {
+chatForm.addEventListener('submit', async (e) => {
     e.preventDefault();
     const userMessage = userMessageInput.value.trim();
-    if (!userMessage) return;
+    if (!userMessage || sendInFlight) return;
 
     addMessage('user', userMessage);
     userMessageInput.value = '';
+    showTypingIndicator();
 
-    // Send message via WebSocket
-    socket.emit('send_message', {
+    // The same id is reused on retry so the server processes the message only once
+    const clientMessageId = crypto.randomUUID();
+    const payload = JSON.stringify({
         'character_id': characterId,
         'message': userMessage,
+        'client_message_id': clientMessageId,
     });
 
-    showTypingIndicator();
+    sendInFlight = true;
+    let delivered = false;
+    try {
+        for (let attempt = 0; attempt < 3 && !delivered; attempt++) {
+            try {
+                const response = await fetch('/api/send_message', {
+                    method: 'POST',
+                    credentials: 'include',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: payload,
+                });
+                if (response.status === 401) {
+                    window.location.href = '/login';
+                    return;
+                }
+                if (response.ok) {
+                    delivered = true;
+                    if (conversationId === null) {
+                        // First message of a new conversation: replay its reply from the start
+                        conversationId = (await response.json()).conversation_id;
+                        openReplyStream('0:0');
+                    }
+                } else if (response.status === 429) {
+                    const retryAfter = response.headers.get('Retry-After') || 'a few';
+                    addMessage('assistant', `You're sending messages too quickly. Please wait ${retryAfter} seconds and try again.`);
+                    hideTypingIndicator();
+                    return;
+                } else if (response.status < 500) {
+                    break;
+                }
+            } catch (error) {
+                console.error('Error sending message:', error);
+            }
+            if (!delivered) {
+                await new Promise((resolve) => setTimeout(resolve, 500 * (attempt + 1)));
+            }
+        }
+        if (!delivered) {
+            addMessage('assistant', 'Sorry, your message could not be sent. Please try again.');
+            hideTypingIndicator();
+        }
+    } finally {
+        sendInFlight = false;
+    }
 });
\ No newline at end of file
@@ -1,78 +1,165 @@
 # tasks.py
 
+import os
 from extensions import celery
-from models import Conversation, Character
+from models import Character, Conversation, Message
 from openrouter_api import generate_character_response
+from openrouter_client import get_client
+from context_builder import needs_summary, summarization_prompt
 from flask import current_app
-from sqlalchemy.orm import scoped_session, sessionmaker
-from sqlalchemy import create_engine
+from generation import Generation, finalize_stale_replies
+from tracing import span
+from worker_db import WorkerSession, get_worker_session
+from avatars import AVATAR_SIZES, AvatarError, process_avatar
+from archive import archive_idle_conversations
+import metrics
 import logging
-from flask_socketio import SocketIO
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 @celery.task
-def generate_character_response_task(conversation_id, character_id, user_message, user_id):
+def generate_character_response_task(conversation_id, character_id, user_message, user_id, message_seq=None, trace=None):
     with current_app.app_context():
-        # Create a new SQLAlchemy session
-        engine = create_engine(current_app.config['SQLALCHEMY_DATABASE_URI'])
-        Session = scoped_session(sessionmaker(bind=engine))
-        session = Session()
+        generation = Generation(conversation_id, character_id, user_message, user_id, message_seq, trace)
 
         try:
-            # Retrieve conversation and character
-            conversation = session.query(Conversation).get(conversation_id)
-            character = session.query(Character).get(character_id)
+            if not generation.prepare():
+                return
+
+            # Generate AI response using openrouter_api
+            ai_response_generator = generate_character_response(
+                None, user_message, messages=generation.messages, model=generation.model,
+                models=generation.models, hedge_delay=generation.hedge_delay, **generation.params
+            )
+            with span('openrouter.stream', generation.correlation_id, conversation_id=conversation_id) as stream_span:
+                try:
+                    for token in ai_response_generator:
+                        if not generation.on_token(token):
+                            break
+                        if generation.checkpoint_due():
+                            generation.checkpoint()
+                finally:
+                    # Closes the upstream HTTP response right away when we stopped early
+                    ai_response_generator.close()
+                stream_span['tokens'] = generation.token_count
+
+            generation.finish()
+
+        except Exception as e:
+            generation.fail(e)
+        finally:
+            generation.close()
+
+
+@celery.task
+def summarize_conversation_task(conversation_id):
+    with current_app.app_context():
+        session = get_worker_session()
+        config = current_app.config
 
-            if not conversation or not character:
-                current_app.logger.error(f"Conversation or character not found (ID: {conversation_id}, {character_id})")
+        try:
+            conversation = session.query(Conversation).get(conversation_id)
+            if not conversation or not needs_summary(conversation, config['CONTEXT_KEEP_RECENT'],
+                                                     config['SUMMARY_TRIGGER_MESSAGES']):
                 return
 
-            # Initialize Socket.IO with message queue
-            socketio_message_queue = current_app.config.get('SOCKETIO_MESSAGE_QUEUE')
-            if not socketio_message_queue:
-                current_app.logger.error("SOCKETIO_MESSAGE_QUEUE is not configured.")
+            # Summarize at most one batch per run, never touching the recent window
+            start = conversation.summary_seq
+            end = min(conversation.message_count - config['CONTEXT_KEEP_RECENT'],
+                      start + config['SUMMARY_BATCH_MESSAGES'])
+            messages = session.query(Message).filter(
+                Message.conversation_id == conversation_id,
+                Message.seq >= start,
+                Message.seq < end
+            ).order_by(Message.seq).all()
+
+            prompt = summarization_prompt(conversation.summary, messages)
+            summary = ''.join(get_client().stream_chat(
+                prompt, model=config['SUMMARY_MODEL'], max_tokens=config['SUMMARY_MAX_TOKENS']
+            )).strip()
+            if not summary:
                 return
 
-            socketio = SocketIO(message_queue=socketio_message_queue)
+            # Only advance if no other run moved the summary in the meantime
+            updated = session.query(Conversation).filter(
+                Conversation.id == conversation_id,
+                Conversation.summary_seq == start
+            ).update({'summary': summary, 'summary_seq': end}, synchronize_session=False)
+            session.commit()
+
+            if updated:
+                session.refresh(conversation)
+                if needs_summary(conversation, config['CONTEXT_KEEP_RECENT'], config['SUMMARY_TRIGGER_MESSAGES']):
+                    summarize_conversation_task.delay(conversation_id)
+
+        except Exception as e:
+            session.rollback()
+            current_app.logger.error(f"Error in summarize_conversation_task: {e}")
+        finally:
+            WorkerSession.remove()
 
-            # Generate AI response using openrouter_api
-            ai_response_generator = generate_character_response(character, user_message)
 
-            ai_response = ''
-            room = f"chat_{user_id}_{character_id}"
+@celery.task
+def process_avatar_task(character_id, staged_path):
+    with current_app.app_context():
+        session = get_worker_session()
+        avatars_dir = os.path.join(current_app.root_path, 'static', 'images', 'avatars')
+
+        try:
+            character = session.query(Character).get(character_id)
+            if not character:
+                return
 
-            max_tokens = 1000  # Set a reasonable limit to prevent infinite loops
-            token_count = 0
+            variants = process_avatar(staged_path, avatars_dir)
+            character.avatar = variants[str(max(AVATAR_SIZES))]
+            character.avatar_variants = variants
+            session.commit()
+            metrics.incr('avatar_uploads_total', result='processed')
 
-            for token in ai_response_generator:
-                ai_response += token
-                token_count += 1
+        except AvatarError as e:
+            # The character keeps its default avatar
+            logger.warning(f"Rejected avatar for character {character_id}: {e}")
+            metrics.incr('avatar_uploads_total', result='rejected')
+        except Exception as e:
+            session.rollback()
+            current_app.logger.error(f"Error in process_avatar_task: {e}")
+            metrics.incr('avatar_uploads_total', result='error')
+        finally:
+            try:
+                os.remove(staged_path)
+            except FileNotFoundError:
+                pass
+            WorkerSession.remove()
 
-                # Emit partial responses to the client via Socket.IO
-                socketio.emit('partial_ai_response', {'token': token}, room=room)
 
-                if token_count >= max_tokens:
-                    current_app.logger.warning(f"Token limit reached in generate_character_response_task for conversation {conversation_id}")
-                    break
+@celery.task
+def finalize_stale_replies_task():
+    with current_app.app_context():
+        session = get_worker_session()
 
-            # Append AI response to conversation
-            conversation.add_message('ai', ai_response)
+        try:
+            finalize_stale_replies(session, current_app.config['REPLY_BUFFER_TTL'])
+        except Exception as e:
+            session.rollback()
+            current_app.logger.error(f"Error in finalize_stale_replies_task: {e}")
+        finally:
+            WorkerSession.remove()
 
-            # Commit the session to save changes
-            session.commit()
 
-            # Notify client that the AI response is complete
-            socketio.emit('ai_response_complete', {'role': 'ai', 'content': ai_response}, room=room)
+@celery.task
+def archive_idle_conversations_task():
+    with current_app.app_context():
+        session = get_worker_session()
+        config = current_app.config
 
+        try:
+            archive_idle_conversations(
+                session, config['ARCHIVE_IDLE_DAYS'], batch_size=config['ARCHIVE_BATCH_SIZE'],
+                keep_recent=config['ARCHIVE_KEEP_RECENT'], level=config['ARCHIVE_ZSTD_LEVEL'],
+            )
         except Exception as e:
-            current_app.logger.error(f"Error in generate_character_response_task: {e}")
-            # Emit error message to the client
-            try:
-                socketio.emit('error', {'error': 'An error occurred while generating the AI response.'}, room=room)
-            except Exception as emit_error:
-                current_app.logger.error(f"Failed to emit error message via Socket.IO: {emit_error}")
+            session.rollback()
+            current_app.logger.error(f"Error in archive_idle_conversations_task: {e}")
         finally:
-            # Close the session
-            session.remove()
\ No newline at end of file
+            WorkerSession.remove()
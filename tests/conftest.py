@@ -0,0 +1,38 @@
+# tests/conftest.py
+
+import os
+import sys
+
+import pytest
+
+# The application modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_openrouter import FakeOpenRouterServer  # noqa: E402
+
+
+@pytest.fixture
+def fake_openrouter(request):
+    """
+    A running FakeOpenRouterServer; parametrize via
+    @pytest.mark.fake_openrouter(tokens=..., failures=..., ...).
+    """
+    marker = request.node.get_closest_marker('fake_openrouter')
+    options = dict(marker.kwargs) if marker else {}
+    with FakeOpenRouterServer(**options) as server:
+        yield server
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'fake_openrouter(**options): options for the fake_openrouter fixture')
+
+
+def wait_for(condition, timeout=3.0):
+    """
+    Polls condition until it holds or timeout seconds pass; returns its last value.
+    """
+    import time
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
@@ -0,0 +1,122 @@
+# tests/test_model_router.py
+
+import time
+
+import pytest
+
+for module in ('requests', 'redis', 'fakeredis', 'flask', 'flask_sqlalchemy', 'flask_migrate',
+               'flask_socketio', 'authlib', 'celery'):
+    pytest.importorskip(module)
+
+import fakeredis  # noqa: E402
+from flask import Flask  # noqa: E402
+
+from config import Config  # noqa: E402
+from openrouter_client import OpenRouterClient, OpenRouterError  # noqa: E402
+from model_router import candidate_models, model_health, record_attempt, route_stream  # noqa: E402
+
+MESSAGES = [{'role': 'user', 'content': 'Hello'}]
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config.update(
+        ROUTER_FALLBACK_MODELS=['backup/model'],
+        ROUTER_MIN_SAMPLES=3,
+        ROUTER_TTFT_TIMEOUT=4.0,
+        ROUTER_MAX_ERROR_RATE=0.2,
+        ROUTER_STATS_WINDOW=300,
+    )
+    app.extensions['redis'] = fakeredis.FakeRedis()
+    with app.app_context():
+        yield app
+
+
+def make_client(server, **options):
+    options.setdefault('backoff', 0.01)
+    return OpenRouterClient(api_key='test', api_url=server.url, **options)
+
+
+def requested_models(server):
+    return [payload['model'] for payload in server.requests]
+
+
+@pytest.mark.fake_openrouter(tokens=3)
+def test_single_candidate_streams(app, fake_openrouter):
+    tokens = list(route_stream(make_client(fake_openrouter), MESSAGES, ['only/model'], {}))
+    assert tokens == ['token0 ', 'token1 ', 'token2 ']
+    assert requested_models(fake_openrouter) == ['only/model']
+    assert model_health(['only/model'])['only/model']['ttft'] is not None
+
+
+@pytest.mark.fake_openrouter(tokens=3, model_delays={'slow/model': 2.0})
+def test_fails_over_when_first_token_is_late(app, fake_openrouter):
+    client = make_client(fake_openrouter)
+    start = time.monotonic()
+    tokens = list(route_stream(client, MESSAGES, ['slow/model', 'fast/model'], {}, ttft_timeout=0.2))
+    assert tokens == ['token0 ', 'token1 ', 'token2 ']
+    assert time.monotonic() - start < 2.0
+    assert requested_models(fake_openrouter) == ['slow/model', 'fast/model']
+
+    health = model_health(['slow/model', 'fast/model'])
+    assert health['slow/model'] == {'requests': 1, 'error_rate': 1.0, 'ttft': None}
+    assert health['fast/model']['error_rate'] == 0.0
+    assert health['fast/model']['ttft'] is not None
+
+
+@pytest.mark.fake_openrouter(tokens=2, failures=[503])
+def test_fails_over_on_error_before_first_token(app, fake_openrouter):
+    client = make_client(fake_openrouter, max_retries=0)
+    tokens = list(route_stream(client, MESSAGES, ['broken/model', 'backup/model'], {}))
+    assert tokens == ['token0 ', 'token1 ']
+    assert requested_models(fake_openrouter) == ['broken/model', 'backup/model']
+    assert model_health(['broken/model'])['broken/model']['error_rate'] == 1.0
+
+
+@pytest.mark.fake_openrouter(failures=[503, 503])
+def test_raises_when_every_model_fails(app, fake_openrouter):
+    client = make_client(fake_openrouter, max_retries=0)
+    with pytest.raises(OpenRouterError):
+        list(route_stream(client, MESSAGES, ['first/model', 'second/model'], {}))
+
+
+@pytest.mark.fake_openrouter(tokens=3, model_delays={'slow/model': 1.0})
+def test_hedged_request_takes_the_faster_model(app, fake_openrouter):
+    client = make_client(fake_openrouter)
+    start = time.monotonic()
+    tokens = list(route_stream(client, MESSAGES, ['slow/model', 'fast/model'], {}, hedge_delay=0.1))
+    assert tokens == ['token0 ', 'token1 ', 'token2 ']
+    assert time.monotonic() - start < 1.0
+    assert requested_models(fake_openrouter) == ['slow/model', 'fast/model']
+
+    # The loser is counted as timed out; only the winner has a first-token time
+    health = model_health(['slow/model', 'fast/model'])
+    assert health['slow/model']['ttft'] is None
+    assert health['slow/model']['error_rate'] == 1.0
+    assert health['fast/model']['ttft'] is not None
+
+
+def test_keeps_order_while_healthy(app):
+    for _ in range(3):
+        record_attempt('primary/model', ttft=0.5)
+    assert candidate_models('primary/model') == ['primary/model', 'backup/model']
+
+
+def test_moves_failing_model_last(app):
+    for _ in range(3):
+        record_attempt('primary/model', error=True)
+    assert candidate_models('primary/model') == ['backup/model', 'primary/model']
+
+
+def test_moves_slow_model_last(app):
+    for _ in range(3):
+        record_attempt('primary/model', ttft=10.0)
+    assert candidate_models('primary/model') == ['backup/model', 'primary/model']
+
+
+def test_ignores_errors_below_min_samples(app):
+    for _ in range(2):
+        record_attempt('primary/model', error=True)
+    assert candidate_models('primary/model') == ['primary/model', 'backup/model']
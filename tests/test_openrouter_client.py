@@ -0,0 +1,72 @@
+# tests/test_openrouter_client.py
+
+import pytest
+
+pytest.importorskip('requests')
+pytest.importorskip('flask')
+
+from openrouter_client import OpenRouterClient, OpenRouterError  # noqa: E402
+from conftest import wait_for  # noqa: E402
+
+MESSAGES = [{'role': 'user', 'content': 'Hello'}]
+
+
+def make_client(server, **options):
+    options.setdefault('backoff', 0.01)
+    return OpenRouterClient(api_key='test', api_url=server.url, **options)
+
+
+@pytest.mark.fake_openrouter(tokens=3)
+def test_streams_tokens(fake_openrouter):
+    client = make_client(fake_openrouter)
+    assert list(client.stream_chat(MESSAGES, model='fake/model')) == ['token0 ', 'token1 ', 'token2 ']
+    assert fake_openrouter.requests[0]['stream'] is True
+    assert fake_openrouter.requests[0]['model'] == 'fake/model'
+
+
+@pytest.mark.fake_openrouter(tokens=2, failures=[503, 502])
+def test_retries_server_errors(fake_openrouter):
+    client = make_client(fake_openrouter, max_retries=3)
+    assert list(client.stream_chat(MESSAGES, model='fake/model')) == ['token0 ', 'token1 ']
+    assert len(fake_openrouter.requests) == 3
+
+
+@pytest.mark.fake_openrouter(tokens=2, failures=[429])
+def test_retries_rate_limit(fake_openrouter):
+    client = make_client(fake_openrouter, max_retries=1)
+    assert list(client.stream_chat(MESSAGES, model='fake/model')) == ['token0 ', 'token1 ']
+    assert len(fake_openrouter.requests) == 2
+
+
+@pytest.mark.fake_openrouter(tokens=2, failures=['timeout'], stall=1.0)
+def test_retries_read_timeout(fake_openrouter):
+    client = make_client(fake_openrouter, read_timeout=0.2, max_retries=1)
+    assert list(client.stream_chat(MESSAGES, model='fake/model')) == ['token0 ', 'token1 ']
+    assert len(fake_openrouter.requests) == 2
+
+
+@pytest.mark.fake_openrouter(failures=[503, 503, 503])
+def test_gives_up_after_max_retries(fake_openrouter):
+    client = make_client(fake_openrouter, max_retries=2)
+    with pytest.raises(OpenRouterError):
+        list(client.stream_chat(MESSAGES, model='fake/model'))
+    assert len(fake_openrouter.requests) == 3
+
+
+@pytest.mark.fake_openrouter(tokens=5)
+def test_reuses_connection(fake_openrouter):
+    client = make_client(fake_openrouter)
+    for _ in range(3):
+        assert len(list(client.stream_chat(MESSAGES, model='fake/model'))) == 5
+    assert len(fake_openrouter.requests) == 3
+    assert fake_openrouter.connections == 1
+
+
+@pytest.mark.fake_openrouter(tokens=1000, delay=0.005)
+def test_early_stop_closes_stream(fake_openrouter):
+    client = make_client(fake_openrouter)
+    stream = client.stream_chat(MESSAGES, model='fake/model')
+    assert next(stream) == 'token0 '
+    stream.close()
+    # The server notices the closed connection long before its 1000 tokens are sent
+    assert wait_for(lambda: fake_openrouter.disconnects == 1, timeout=2.0)
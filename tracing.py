@@ -0,0 +1,61 @@
+# tracing.py
+
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+CORRELATION_HEADER = 'X-Request-ID'
+
+try:
+    from opentelemetry import trace as _otel_trace
+    _tracer = _otel_trace.get_tracer('matrixmingle')
+except ImportError:
+    # OpenTelemetry is optional; spans become timed log lines without it
+    _tracer = None
+
+
+def new_correlation_id(incoming=None):
+    """
+    Returns the caller-supplied correlation id if it looks sane, otherwise a new one.
+    """
+    if incoming and len(incoming) <= 128 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex
+
+
+def trace_context(correlation_id):
+    """
+    Builds the trace context passed from the web request into a Celery task.
+    """
+    return {'correlation_id': correlation_id, 'enqueued_at': time.time()}
+
+
+@contextmanager
+def span(name, correlation_id=None, **attributes):
+    """
+    Times a block, emitting an OpenTelemetry span when OpenTelemetry is installed.
+    Yields a dict of extra attributes the block can fill in.
+    """
+    extra = {}
+    start = time.perf_counter()
+    if _tracer is None:
+        try:
+            yield extra
+        finally:
+            logger.debug(f"[{correlation_id}] {name} took {time.perf_counter() - start:.4f}s {dict(attributes, **extra)}")
+        return
+
+    with _tracer.start_as_current_span(name) as otel_span:
+        if correlation_id:
+            otel_span.set_attribute('correlation_id', correlation_id)
+        for key, value in attributes.items():
+            otel_span.set_attribute(key, value)
+        try:
+            yield extra
+        finally:
+            for key, value in extra.items():
+                otel_span.set_attribute(key, value)
@@ -0,0 +1,302 @@
+# transfer.py
+
+"""
+NDJSON export and import of characters, conversations and messages.
+
+An export is one JSON object per line, each with a "type": a header, then
+users, characters, conversations and finally messages ordered by
+conversation and seq (archived messages follow, per conversation), so an
+import can resolve every reference in one pass.
+Exports read through server-side cursors and imports insert in batches, so
+neither holds more than a batch of rows in memory. Imports assign new ids;
+only the old-to-new id maps for characters and conversations are kept.
+Imported records are checked against RECORD_FIELDS; invalid records and
+batches the database refuses are skipped and reported, the rest is kept.
+"""
+
+import json
+import logging
+from datetime import datetime
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import User, Character, Conversation, Message
+from archive import archived_messages
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+BATCH_SIZE = 1000
+
+CHARACTER_COLUMNS = (Character.id, Character.user_id, Character.name, Character.description,
+                     Character.attributes, Character.avatar, Character.avatar_variants, Character.model,
+                     Character.temperature, Character.max_tokens, Character.created_at, Character.updated_at)
+CONVERSATION_COLUMNS = (Conversation.id, Conversation.user_id, Conversation.character_id,
+                        Conversation.message_count, Conversation.summary, Conversation.summary_seq,
+                        Conversation.created_at, Conversation.updated_at)
+MESSAGE_COLUMNS = (Message.conversation_id, Message.seq, Message.role, Message.content,
+                   Message.complete, Message.created_at)
+
+# Import order: rows of a kind are only inserted once everything they reference is
+KINDS = ('user', 'character', 'conversation', 'message')
+DATETIME_FIELDS = ('created_at', 'updated_at')
+
+# The only fields an import writes, with the JSON types each accepts (None allows null).
+# Other fields are dropped, so an upload can never set columns outside this list.
+RECORD_FIELDS = {
+    'user': {'id': (str,)},
+    'character': {
+        'id': (int,), 'user_id': (str,), 'name': (str,), 'description': (str,), 'attributes': (dict,),
+        'avatar': (str, None), 'avatar_variants': (dict, None), 'model': (str, None),
+        'temperature': (int, float, None), 'max_tokens': (int, None),
+        'created_at': (str, None), 'updated_at': (str, None),
+    },
+    'conversation': {
+        'id': (int,), 'user_id': (str,), 'character_id': (int,), 'message_count': (int,),
+        'summary': (str, None), 'summary_seq': (int,), 'created_at': (str, None), 'updated_at': (str, None),
+    },
+    'message': {
+        'conversation_id': (int,), 'seq': (int,), 'role': (str,), 'content': (str,), 'complete': (bool,),
+        'created_at': (str, None),
+    },
+}
+REQUIRED_FIELDS = {
+    'user': ('id',),
+    'character': ('id', 'user_id', 'name', 'description', 'attributes'),
+    'conversation': ('id', 'user_id', 'character_id'),
+    'message': ('conversation_id', 'seq', 'role', 'content'),
+}
+# Values for optional fields a record leaves out, e.g. columns added after it was exported
+FIELD_DEFAULTS = {'message_count': 0, 'summary_seq': 0, 'complete': True}
+# Rejections listed individually in the result; later ones are only counted
+MAX_REPORTED_ERRORS = 100
+
+
+class TransferError(ValueError):
+    pass
+
+
+def _record(kind, row):
+    record = {'type': kind}
+    for key, value in row._mapping.items():
+        record[key] = value.isoformat() if isinstance(value, datetime) else value
+    return record
+
+
+def export_records(session, user_id=None, batch_size=BATCH_SIZE):
+    """
+    Yields export records for every user, or only user_id's data. Column
+    selects with yield_per stream rows from a server-side cursor without
+    loading ORM objects into the session.
+    """
+    def stream(query):
+        return session.execute(query.execution_options(yield_per=batch_size))
+
+    yield {'type': 'header', 'version': FORMAT_VERSION, 'exported_at': datetime.utcnow().isoformat()}
+
+    users = select(User.id).order_by(User.id)
+    characters = select(*CHARACTER_COLUMNS).order_by(Character.id)
+    conversations = select(*CONVERSATION_COLUMNS).order_by(Conversation.id)
+    messages = (select(*MESSAGE_COLUMNS)
+                .join(Conversation, Conversation.id == Message.conversation_id)
+                .order_by(Message.conversation_id, Message.seq))
+    if user_id is not None:
+        users = users.where(User.id == user_id)
+        characters = characters.where(Character.user_id == user_id)
+        conversations = conversations.where(Conversation.user_id == user_id)
+        messages = messages.where(Conversation.user_id == user_id)
+
+    for kind, query in (('user', users), ('character', characters),
+                        ('conversation', conversations), ('message', messages)):
+        for row in stream(query):
+            yield _record(kind, row)
+
+    # Older messages of idle conversations live compressed in conversation_archives
+    for message in archived_messages(session, user_id=user_id):
+        yield {'type': 'message', **message}
+
+
+def to_ndjson(records):
+    """
+    Serializes records as NDJSON lines.
+    """
+    for record in records:
+        yield json.dumps(record, separators=(',', ':')) + '\n'
+
+
+class Importer:
+    """
+    Loads export lines fed one at a time, inserting each kind in batches and
+    committing after every batch. With owner_id set, every character and
+    conversation is assigned to that user and user records are ignored.
+    Invalid records and refused batches are counted as rejected and described
+    in errors; whatever references them is skipped.
+    """
+
+    def __init__(self, session, owner_id=None, batch_size=BATCH_SIZE):
+        self.session = session
+        self.owner_id = owner_id
+        self.batch_size = batch_size
+        self.pending = {kind: [] for kind in KINDS}
+        self.character_ids = {}
+        self.conversation_ids = {}
+        self.counts = {kind: 0 for kind in KINDS}
+        self.counts['skipped'] = 0
+        self.counts['rejected'] = 0
+        self.errors = []
+        self.line_number = 0
+
+    def reject(self, count, reason):
+        self.counts['rejected'] += count
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Line {self.line_number}: {reason}")
+
+    def validate(self, kind, record):
+        """
+        Returns the record reduced to RECORD_FIELDS with defaults filled in and
+        timestamps parsed. Raises TransferError describing the first problem.
+        """
+        required = REQUIRED_FIELDS[kind]
+        if self.owner_id:
+            required = tuple(field for field in required if field != 'user_id')
+        row = {}
+        for field, types in RECORD_FIELDS[kind].items():
+            if field not in record:
+                if field in required:
+                    raise TransferError(f"{kind} record is missing {field}")
+                row[field] = FIELD_DEFAULTS.get(field)
+                continue
+            value = record[field]
+            # bool is an int in Python, but never a valid id or count
+            valid = ((value is None and None in types)
+                     or (isinstance(value, tuple(t for t in types if t is not None))
+                         and (bool in types or not isinstance(value, bool))))
+            if not valid:
+                raise TransferError(f"{kind} field {field} has an invalid value")
+            row[field] = value
+        for field in DATETIME_FIELDS:
+            if row.get(field):
+                try:
+                    row[field] = datetime.fromisoformat(row[field])
+                except ValueError:
+                    raise TransferError(f"{kind} field {field} is not an ISO timestamp")
+        return row
+
+    def feed(self, line):
+        self.line_number += 1
+        line = line.strip()
+        if not line:
+            return
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            self.reject(1, f"invalid JSON ({e})")
+            return
+        if not isinstance(record, dict):
+            self.reject(1, "record is not a JSON object")
+            return
+        kind = record.get('type')
+
+        if kind == 'header':
+            version = record.get('version', FORMAT_VERSION)
+            if not isinstance(version, int) or version > FORMAT_VERSION:
+                raise TransferError(f"Unsupported export version {version}")
+            return
+        if kind not in self.pending or (kind == 'user' and self.owner_id):
+            return
+
+        try:
+            row = self.validate(kind, record)
+        except TransferError as e:
+            self.reject(1, str(e))
+            return
+        self.pending[kind].append(row)
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush(kind)
+
+    def flush(self, kind=None):
+        """
+        Inserts pending rows of kind (all kinds when None), after first
+        inserting pending rows of every kind it depends on.
+        """
+        last = KINDS.index(kind) if kind else len(KINDS) - 1
+        for current in KINDS[:last + 1]:
+            rows = self.pending[current]
+            if not rows:
+                continue
+            self.pending[current] = []
+            try:
+                getattr(self, f'_insert_{current}s')(rows)
+                self.session.commit()
+            except SQLAlchemyError as e:
+                # E.g. a duplicate user id or a value too long for its column
+                self.session.rollback()
+                self.reject(len(rows), f"batch of {len(rows)} {current} records refused by the database "
+                                       f"({getattr(e, 'orig', e)})")
+
+    def _insert_users(self, rows):
+        ids = {row['id'] for row in rows}
+        existing = set(self.session.scalars(select(User.id).where(User.id.in_(ids))))
+        new_ids = ids - existing
+        if new_ids:
+            self.session.execute(insert(User), [{'id': user_id} for user_id in new_ids])
+        self.counts['user'] += len(new_ids)
+
+    def _insert_characters(self, rows):
+        old_ids = [row.pop('id') for row in rows]
+        for row in rows:
+            if self.owner_id:
+                row['user_id'] = self.owner_id
+        new_ids = self.session.scalars(
+            insert(Character).returning(Character.id, sort_by_parameter_order=True), rows
+        ).all()
+        self.character_ids.update(zip(old_ids, new_ids))
+        self.counts['character'] += len(rows)
+
+    def _insert_conversations(self, rows):
+        old_ids = []
+        kept = []
+        for row in rows:
+            character_id = self.character_ids.get(row['character_id'])
+            if character_id is None:
+                self.counts['skipped'] += 1
+                continue
+            old_ids.append(row.pop('id'))
+            row['character_id'] = character_id
+            if self.owner_id:
+                row['user_id'] = self.owner_id
+            kept.append(row)
+        if not kept:
+            return
+        new_ids = self.session.scalars(
+            insert(Conversation).returning(Conversation.id, sort_by_parameter_order=True), kept
+        ).all()
+        self.conversation_ids.update(zip(old_ids, new_ids))
+        self.counts['conversation'] += len(kept)
+
+    def _insert_messages(self, rows):
+        kept = []
+        for row in rows:
+            conversation_id = self.conversation_ids.get(row['conversation_id'])
+            if conversation_id is None:
+                self.counts['skipped'] += 1
+                continue
+            row['conversation_id'] = conversation_id
+            kept.append(row)
+        if kept:
+            self.session.execute(insert(Message), kept)
+        self.counts['message'] += len(kept)
+
+
+def import_lines(session, lines, owner_id=None, batch_size=BATCH_SIZE):
+    """
+    Imports an iterable of NDJSON lines. Returns (counts per record kind,
+    descriptions of rejected records).
+    """
+    importer = Importer(session, owner_id=owner_id, batch_size=batch_size)
+    for line in lines:
+        importer.feed(line)
+    importer.flush()
+    logger.info(f"Imported {importer.counts}")
+    return importer.counts, importer.errors
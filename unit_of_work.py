@@ -0,0 +1,76 @@
+# unit_of_work.py
+
+import logging
+from sqlalchemy import event, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Conversation
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+AFTER_COMMIT_KEY = 'after_commit_callbacks'
+
+
+def run_after_commit(session, callback):
+    """
+    Defers callback until the session's current transaction commits, e.g. to
+    enqueue a task only once the rows it reads are visible. Dropped on rollback.
+    A failing callback is only logged, since the commit has already happened;
+    callers that must react to a failure should run the step after commit()
+    themselves. Callbacks must not use the session.
+    """
+    session.info.setdefault(AFTER_COMMIT_KEY, []).append(callback)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit_callbacks(session):
+    for callback in session.info.pop(AFTER_COMMIT_KEY, []):
+        try:
+            callback()
+        except Exception as e:
+            logger.exception(f"After-commit callback failed: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_after_commit_callbacks(session):
+    session.info.pop(AFTER_COMMIT_KEY, None)
+
+
+def _dialect_insert(dialect_name):
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def get_or_create_conversation(session, user_id, character_id):
+    """
+    Returns the conversation for (user, character), inserting it if needed
+    without committing. Concurrent creators converge on the same row through
+    the unique constraint instead of creating duplicates.
+    """
+    query = select(Conversation).filter_by(user_id=user_id, character_id=character_id)
+    conversation = session.execute(query).scalar_one_or_none()
+    if conversation is not None:
+        return conversation
+
+    insert = _dialect_insert(session.get_bind(Conversation).dialect.name)
+    if insert is not None:
+        session.execute(
+            insert(Conversation)
+            .values(user_id=user_id, character_id=character_id)
+            .on_conflict_do_nothing(index_elements=['user_id', 'character_id'])
+        )
+    else:
+        # Other databases: insert inside a savepoint and fall back to the winner's row
+        try:
+            with session.begin_nested():
+                session.add(Conversation(user_id=user_id, character_id=character_id))
+        except IntegrityError:
+            pass
+    return session.execute(query).scalar_one()
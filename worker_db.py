@@ -0,0 +1,154 @@
+# worker_db.py
+
+import logging
+import os
+from celery import current_app as current_celery_app
+from celery.signals import worker_process_init, worker_process_shutdown, task_postrun
+from flask import current_app
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from extensions import db
+import metrics
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Process-wide engine and session registry, created once per worker process
+_engine = None
+WorkerSession = scoped_session(sessionmaker())
+
+# Pool utilization counters, updated from pool events
+_pool_usage = {'checkouts': 0, 'peak_checked_out': 0}
+# Every stat pool_stats() can report, exported as db_pool_<name> gauges per worker process
+POOL_STATS = ('checkouts', 'peak_checked_out', 'size', 'checkedout', 'checkedin', 'overflow')
+
+
+def engine_options(config):
+    """
+    Builds create_engine() keyword arguments from the pool settings in config.
+    SQLite uses its own pool classes, so sizing options are only applied to
+    server databases.
+    """
+    options = {'pool_pre_ping': config.get('DB_POOL_PRE_PING', True)}
+    if not config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        options.update(
+            pool_size=config.get('DB_POOL_SIZE', 5),
+            max_overflow=config.get('DB_MAX_OVERFLOW', 10),
+            pool_recycle=config.get('DB_POOL_RECYCLE', 1800),
+            pool_timeout=config.get('DB_POOL_TIMEOUT', 30),
+        )
+    return options
+
+
+def init_worker_engine(config):
+    """
+    Creates the worker's engine and binds the session registry to it.
+    Safe to call repeatedly; only the first call creates an engine.
+    """
+    global _engine
+    if _engine is not None:
+        return _engine
+
+    _engine = create_engine(config['SQLALCHEMY_DATABASE_URI'], **engine_options(config))
+
+    @event.listens_for(_engine, 'checkout')
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        _pool_usage['checkouts'] += 1
+        _pool_usage['peak_checked_out'] = max(
+            _pool_usage['peak_checked_out'], _engine.pool.checkedout()
+        )
+
+    WorkerSession.configure(bind=_engine)
+    logger.info(f"Worker database engine initialized (pid {os.getpid()})")
+    return _engine
+
+
+def dispose_worker_engine():
+    """
+    Closes all pooled connections held by this process.
+    """
+    global _engine
+    WorkerSession.remove()
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
+def get_worker_session():
+    """
+    Returns the session for the current task, lazily initializing the engine
+    when the task runs outside a prefork child (e.g. solo pool or eager mode).
+    """
+    if _engine is None:
+        init_worker_engine(current_app.config)
+    return WorkerSession()
+
+
+def new_worker_session():
+    """
+    Returns a standalone session on the worker engine for work that may hop
+    between threads, where the thread-scoped registry cannot be used. The
+    caller must close it.
+    """
+    if _engine is None:
+        init_worker_engine(current_app.config)
+    return WorkerSession.session_factory()
+
+
+def pool_stats():
+    """
+    Returns a snapshot of the worker pool's utilization.
+    """
+    if _engine is None:
+        return {}
+    pool = _engine.pool
+    stats = {
+        'checkouts': _pool_usage['checkouts'],
+        'peak_checked_out': _pool_usage['peak_checked_out'],
+    }
+    # SQLite pools do not implement the QueuePool sizing accessors
+    for name in ('size', 'checkedout', 'checkedin', 'overflow'):
+        accessor = getattr(pool, name, None)
+        if accessor is not None:
+            stats[name] = accessor()
+    return stats
+
+
+@worker_process_init.connect
+def _on_worker_process_init(**kwargs):
+    global _engine
+    _engine = None
+    flask_app = getattr(current_celery_app, 'flask_app', None)
+    if flask_app is None:
+        return
+    with flask_app.app_context():
+        # Connections inherited from the parent must never be used by the child;
+        # drop them without closing so the parent's sockets are left intact.
+        db.engine.dispose(close=False)
+    init_worker_engine(flask_app.config)
+
+
+@worker_process_shutdown.connect
+def _on_worker_process_shutdown(**kwargs):
+    dispose_worker_engine()
+    # The gauges are labelled with this process's pid, which will not report again
+    flask_app = getattr(current_celery_app, 'flask_app', None)
+    if flask_app is None:
+        return
+    with flask_app.app_context():
+        metrics.clear_gauges([f'db_pool_{name}' for name in POOL_STATS], worker=str(os.getpid()))
+
+
+@task_postrun.connect
+def _on_task_postrun(**kwargs):
+    stats = pool_stats()
+    flask_app = getattr(current_celery_app, 'flask_app', None)
+    if not stats or flask_app is None:
+        return
+    worker = str(os.getpid())
+    with flask_app.app_context():
+        for name, value in stats.items():
+            metrics.set_gauge(f'db_pool_{name}', value, worker=worker)
+    if stats.get('overflow', 0) > 0:
+        logger.warning(f"Database pool overflow in use: {stats}")